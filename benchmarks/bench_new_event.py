@@ -0,0 +1,81 @@
+'''Measures how many events per second a single core can create from nested
+builders, the cost the caller's thread pays, and how long merging their
+fields takes when the events are encoded. The client has 40 global fields
+and each event comes from the third of three nested builders, like a
+request handler several scopes deep. It also measures creating, filling
+and sending events presampled at a rate of 100, against sampling them
+when they are sent.
+
+Run with:
+
+    poetry run python -m benchmarks.bench_new_event
+'''
+import threading
+import time
+
+import libhoney
+
+EVENTS = 100000
+
+
+def main():
+    client = libhoney.Client(writekey="bench", dataset="bench", metrics_sink="none", response_mode="none",
+                             transmission_impl=_NullTransmission())
+    for i in range(40):
+        client.add_field(f"global.field_{i}", i)
+    builder = client.new_builder()
+    builder.add_field("service.scope", "outer")
+    for depth in range(2):
+        builder = builder.clone()
+        builder.add_field(f"scope_{depth}", depth)
+
+    events = []
+    start = time.process_time()
+    for i in range(EVENTS):
+        ev = builder.new_event()
+        ev.add_field("request.id", i)
+        events.append(ev)
+    created = time.process_time() - start
+
+    start = time.process_time()
+    for ev in events:
+        ev.fields()
+    merged = time.process_time() - start
+
+    print(f"new_event + add_field: {EVENTS / created:>12,.0f} events/s/core")
+    print(f"field merge at encode: {EVENTS / merged:>12,.0f} events/s/core")
+
+    builder.add_dynamic_field(_thread_count)
+    builder.sample_rate = 100
+    for name, presample in (("sampled at send", False), ("presampled", True)):
+        start = time.process_time()
+        for i in range(EVENTS):
+            ev = builder.new_event(presample=presample) if presample else builder.new_event()
+            for j in range(20):
+                ev.add_field(f"app.field_{j}", i)
+            ev.send()
+        elapsed = time.process_time() - start
+        print(f"{name + ', 1/100':>21}: {EVENTS / elapsed:>12,.0f} events/s/core")
+    client.close()
+
+
+def _thread_count():
+    return threading.active_count()
+
+
+class _NullTransmission():
+    def start(self):
+        pass
+
+    def send(self, ev):
+        pass
+
+    def close(self):
+        pass
+
+    def get_response_queue(self):
+        return None
+
+
+if __name__ == "__main__":
+    main()
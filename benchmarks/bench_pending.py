@@ -0,0 +1,69 @@
+'''Compares the cost of handing events from many producer threads to a single
+consumer through queue.Queue (one get per event) and through
+libhoney.buffer.PendingBuffer (one drain per wakeup).
+
+Run with:
+
+    poetry run python -m benchmarks.bench_pending
+'''
+import queue
+import threading
+import time
+
+from libhoney.buffer import PendingBuffer
+
+EVENTS = 200000
+CAPACITY = 10000
+
+
+def run_queue(producers):
+    q = queue.Queue(maxsize=CAPACITY)
+
+    def consume():
+        for _ in range(EVENTS):
+            q.get()
+
+    return _run(producers, q.put, consume)
+
+
+def run_buffer(producers):
+    b = PendingBuffer(maxsize=CAPACITY)
+
+    def consume():
+        received = 0
+        while received < EVENTS:
+            received += len(b.drain())
+
+    return _run(producers, b.put, consume)
+
+
+def _run(producers, put, consume):
+    per_producer = EVENTS // producers
+    item = object()
+
+    def produce():
+        for _ in range(per_producer):
+            put(item)
+
+    consumer = threading.Thread(target=consume)
+    threads = [threading.Thread(target=produce) for _ in range(producers)]
+    start = time.perf_counter()
+    consumer.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    consumer.join()
+    return EVENTS / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{'producers':>9} {'queue.Queue ev/s':>18} {'PendingBuffer ev/s':>20} {'speedup':>8}")
+    for producers in (1, 8, 64):
+        q = run_queue(producers)
+        b = run_buffer(producers)
+        print(f"{producers:>9} {q:>18,.0f} {b:>20,.0f} {b / q:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
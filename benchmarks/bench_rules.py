@@ -0,0 +1,72 @@
+'''Measures what RulesSampler costs per event with 50 rules: for an event
+the first rule matches, and for one that matches none and falls through
+to the default rate, checking every rule. The rules mix equality,
+comparison, prefix and regular expression conditions, one or two per
+rule, and events have 30 fields.
+
+Run with:
+
+    poetry run python -m benchmarks.bench_rules
+'''
+import time
+
+import libhoney
+from libhoney.sampling import RulesSampler
+
+EVENTS = 200000
+
+
+def rules():
+    rules = [{"conditions": [{"field": "status_code", "operator": ">=", "value": 500}],
+              "sample_rate": 1}]
+    for i in range(49):
+        kind = i % 4
+        if kind == 0:
+            conditions = [{"field": "route", "operator": "=", "value": f"/route/{i}"}]
+        elif kind == 1:
+            conditions = [{"field": "route", "operator": "starts-with", "value": f"/api/{i}/"},
+                          {"field": "method", "operator": "=", "value": "POST"}]
+        elif kind == 2:
+            conditions = [{"field": "duration_ms", "operator": ">", "value": 1000 + i},
+                          {"field": "service", "operator": "=", "value": f"svc-{i}"}]
+        else:
+            conditions = [{"field": "user_agent", "operator": "matches", "value": f"^bot-{i}\\b"}]
+        rules.append({"conditions": conditions, "sample_rate": i + 2})
+    return rules
+
+
+def main():
+    sampler = RulesSampler(rules(), default_rate=10)
+    client = libhoney.Client(writekey="bench", dataset="bench", metrics_sink="none",
+                             transmission_impl=_NullTransmission())
+    for i in range(25):
+        client.add_field(f"global.field_{i}", i)
+    base = {"route": "/home", "method": "GET", "duration_ms": 12.5,
+            "service": "web", "user_agent": "Mozilla/5.0"}
+
+    for name, status in (("first rule", 503), ("default", 200)):
+        ev = client.new_event(dict(base, status_code=status))
+        start = time.process_time()
+        for _ in range(EVENTS):
+            sampler.rate(ev)
+        elapsed = time.process_time() - start
+        print(f"{name:>10}: {elapsed / EVENTS * 1e6:6.2f} us/event")
+    client.close()
+
+
+class _NullTransmission():
+    def start(self):
+        pass
+
+    def send(self, ev):
+        pass
+
+    def close(self):
+        pass
+
+    def get_response_queue(self):
+        return None
+
+
+if __name__ == "__main__":
+    main()
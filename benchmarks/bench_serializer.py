@@ -0,0 +1,64 @@
+'''Measures how many events per second a single core can encode with each
+serializer installed, and how many bytes each event takes, on a typical event
+with strings, numbers, a nested object and a value that needs
+json_default_handler.
+
+Run with:
+
+    poetry run python -m benchmarks.bench_serializer
+'''
+import datetime
+import time
+import uuid
+
+from libhoney.serializer import available_serializers, get_serializer, has_msgpack
+
+EVENTS = 100000
+
+
+def make_event(i):
+    return {
+        "time": "2024-01-02T03:04:05.678901Z",
+        "samplerate": 1,
+        "data": {
+            "service_name": "checkout",
+            "name": "http_request",
+            "trace.trace_id": str(uuid.UUID(int=i)),
+            "duration_ms": 12.5 + i % 100,
+            "http.status_code": 200,
+            "http.url": f"/api/v1/orders/{i}",
+            "user.id": i,
+            "cache.hit": i % 2 == 0,
+            "request.headers": {"accept": "application/json", "user-agent": "bench/1.0"},
+            "started_at": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        },
+    }
+
+
+def run(name):
+    serializer = get_serializer(name)
+    events = [make_event(i) for i in range(1000)]
+    dumps = serializer.dumps
+    start = time.process_time()
+    for i in range(EVENTS):
+        dumps(events[i % 1000])
+    rate = EVENTS / (time.process_time() - start)
+    size = sum(len(dumps(ev)) for ev in events) / len(events)
+    return rate, size
+
+
+def main():
+    names = list(reversed(available_serializers()))
+    if has_msgpack:
+        names.append("msgpack")
+    baseline = None
+    print(f"{'serializer':>10} {'events/s/core':>14} {'vs json':>8} {'bytes/event':>12}")
+    for name in names:
+        rate, size = run(name)
+        if baseline is None:
+            baseline = rate
+        print(f"{name:>10} {rate:>14,.0f} {rate / baseline:>7.1f}x {size:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,15 @@ def init(writekey="", dataset="", sample_rate=1,
          api_host="https://api.honeycomb.io", max_concurrent_batches=10,
          max_batch_size=100, send_frequency=0.25,
          block_on_send=False, block_on_response=False, transmission_impl=None,
-         debug=False):
+         debug=False, max_batch_bytes=5000000, destination_overrides=None,
+         min_batch_size=1, max_linger=1.0, adaptive=None, max_retries=3,
+         retry_base_delay=0.5, max_retry_delay=30.0, retry_budget_ratio=0.1,
+         spool_dir=None, spool_max_bytes=100 * 1024 * 1024,
+         spool_drain_rate=1000, serializer=None, compression=None,
+         http_backend="requests", prewarm=False, response_mode="events",
+         response_callback=None, metrics_sink="statsd", metrics_interval=10.0,
+         stats_hook=None, sampler=None, target_throughput=None,
+         tail_sampler=None):
     '''Initialize libhoney and prepare it to send events to Honeycomb. This creates
     a global Client object that is configured with the supplied parameters. For some
     advanced used cases, you might consider creating a Client object directly, but
@@ -48,6 +56,10 @@ def init(writekey="", dataset="", sample_rate=1,
             write key at [https://ui.honeycomb.io/account](https://ui.honeycomb.io/account)
     - `dataset`: the name of the default dataset to which to write
     - `sample_rate`: the default sample rate. 1 / `sample_rate` events will be sent.
+    - `sampler`: if set, a sampler from `libhoney.sampling` that picks the
+            sample rate for each event in place of `sample_rate`.
+    - `target_throughput`: if set, and `sampler` isn't, sample each dataset
+            to send about this many events per second. See `Client`.
     - `api_host`: the protocol and Honeycomb api endpoint to send to; defaults to `https://api.honeycomb.io`.
     - `max_concurrent_batches`: the maximum number of concurrent threads sending events.
     - `max_batch_size`: the maximum number of events to batch before sendinga.
@@ -58,6 +70,14 @@ def init(writekey="", dataset="", sample_rate=1,
             false, drop response objects.
     - `transmission_impl`: if set, override the default transmission implementation (for example, TornadoTransmission)
 
+    The remaining arguments tune the default transmission, and are described
+    in `Client`: `max_batch_bytes`, `destination_overrides`, `min_batch_size`,
+    `max_linger`, `adaptive`, `max_retries`, `retry_base_delay`,
+    `max_retry_delay`, `retry_budget_ratio`, `spool_dir`, `spool_max_bytes`,
+    `spool_drain_rate`, `serializer`, `compression`, `http_backend`,
+    `prewarm`, `response_mode`, `response_callback`, `metrics_sink`,
+    `metrics_interval`, `stats_hook` and `tail_sampler`.
+
     --------
 
     **Configuration recommendations**:
@@ -76,6 +96,11 @@ def init(writekey="", dataset="", sample_rate=1,
     Then start gunicorn with the `-c` option:
 
         gunicorn -c /path/to/conf.py
+
+    A client created before the fork, for example with gunicorn's `--preload`,
+    also keeps working: each forked worker gets a fresh sender thread,
+    connection pool and empty queues, and events queued before the fork are
+    sent by the parent only.
     '''
     state.G_CLIENT = Client(
         writekey=writekey,
@@ -89,6 +114,30 @@ def init(writekey="", dataset="", sample_rate=1,
         block_on_response=block_on_response,
         transmission_impl=transmission_impl,
         debug=debug,
+        max_batch_bytes=max_batch_bytes,
+        destination_overrides=destination_overrides,
+        min_batch_size=min_batch_size,
+        max_linger=max_linger,
+        adaptive=adaptive,
+        max_retries=max_retries,
+        retry_base_delay=retry_base_delay,
+        max_retry_delay=max_retry_delay,
+        retry_budget_ratio=retry_budget_ratio,
+        spool_dir=spool_dir,
+        spool_max_bytes=spool_max_bytes,
+        spool_drain_rate=spool_drain_rate,
+        serializer=serializer,
+        compression=compression,
+        http_backend=http_backend,
+        prewarm=prewarm,
+        response_mode=response_mode,
+        response_callback=response_callback,
+        metrics_sink=metrics_sink,
+        metrics_interval=metrics_interval,
+        stats_hook=stats_hook,
+        sampler=sampler,
+        target_throughput=target_throughput,
+        tail_sampler=tail_sampler,
     )
 
 
@@ -114,6 +163,16 @@ def responses():
     return state.G_CLIENT.responses()
 
 
+def stats():
+    '''Returns a snapshot of how events are flowing through the global
+    client. See `Client.stats`.'''
+    if state.G_CLIENT is None:
+        state.warn_uninitialized()
+        return {}
+
+    return state.G_CLIENT.stats()
+
+
 def add_field(name, val):
     '''Add a field to the global client. This field will be sent with every event.'''
     if state.G_CLIENT is None:
@@ -122,14 +181,15 @@ def add_field(name, val):
     state.G_CLIENT.add_field(name, val)
 
 
-def add_dynamic_field(fn):
+def add_dynamic_field(fn, refresh="event"):
     '''Add a dynamic field to the global client. This function will be executed every time an
        event is created. The key/value pair of the function's name and its
-       return value will be sent with every event.'''
+       return value will be sent with every event. See
+       `Client.add_dynamic_field` for `refresh`.'''
     if state.G_CLIENT is None:
         state.warn_uninitialized()
         return
-    state.G_CLIENT.add_dynamic_field(fn)
+    state.G_CLIENT.add_dynamic_field(fn, refresh)
 
 
 def add(data):
@@ -199,5 +259,5 @@ atexit.register(close)  # safe because it's a no-op unless init() was called
 __all__ = [
     "Builder", "Event", "Client", "IsClassicKey", "FieldHolder",
     "SendError", "add", "add_dynamic_field",
-    "add_field", "close", "init", "responses", "send_now",
+    "add_field", "close", "init", "responses", "send_now", "stats",
 ]
@@ -0,0 +1,100 @@
+'''adaptive tunes batching from the latency and status of batch requests'''
+import threading
+import time
+
+# statuses with which the API asks us to slow down
+PUSHBACK_STATUSES = (429, 503)
+
+
+class AIMDController():
+    '''AIMDController sizes the number of in-flight batches and the number of
+    events per batch using additive-increase / multiplicative-decrease.
+
+    Every batch request reports its latency and status with `record`. While
+    requests succeed faster than `target_latency` seconds, concurrency grows
+    by about `concurrency_step` per round of in-flight batches and the batch
+    size grows by `batch_size_step`. A slow request, a 429 or 5xx, or a
+    failed connection multiplies both by `backoff`, at most once per
+    `target_latency` so one burst of failures is a single cut. Both values
+    stay within their configured bounds and start at their maximums unless
+    told otherwise.
+
+    Read `concurrency` and `batch_size` (or `snapshot()`) to monitor the
+    current values.'''
+
+    def __init__(self, min_concurrency=1, max_concurrency=10,
+                 min_batch_size=10, max_batch_size=100,
+                 target_latency=1.0, concurrency_step=1, batch_size_step=10,
+                 backoff=0.5, initial_concurrency=None, initial_batch_size=None):
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        if min_concurrency < 1 or min_concurrency > max_concurrency:
+            raise ValueError("concurrency bounds must satisfy 1 <= min <= max")
+        if min_batch_size < 1 or min_batch_size > max_batch_size:
+            raise ValueError("batch size bounds must satisfy 1 <= min <= max")
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.concurrency_step = concurrency_step
+        self.batch_size_step = batch_size_step
+        self.backoff = backoff
+
+        self._concurrency = float(
+            max_concurrency if initial_concurrency is None else initial_concurrency)
+        self._batch_size = float(
+            max_batch_size if initial_batch_size is None else initial_batch_size)
+        self._latency = None
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        '''the number of batches that may currently be in flight'''
+        return int(self._concurrency)
+
+    @property
+    def batch_size(self):
+        '''the number of events at which a batch is currently sent'''
+        return int(self._batch_size)
+
+    def record(self, latency, status_code):
+        '''record takes the latency in seconds and the HTTP status (0 if the
+        request failed without one) of a finished batch request'''
+        with self._lock:
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += 0.2 * (latency - self._latency)
+
+            pushback = (status_code == 0 or status_code >= 500 or
+                        status_code in PUSHBACK_STATUSES or
+                        latency > self.target_latency)
+            if pushback:
+                now = time.monotonic()
+                if (self._last_decrease is not None and
+                        now - self._last_decrease < self.target_latency):
+                    return
+                self._last_decrease = now
+                self._concurrency = max(
+                    self.min_concurrency, self._concurrency * self.backoff)
+                self._batch_size = max(
+                    self.min_batch_size, self._batch_size * self.backoff)
+            elif 200 <= status_code < 300:
+                # grow by roughly one step per round of in-flight batches
+                self._concurrency = min(
+                    self.max_concurrency,
+                    self._concurrency + self.concurrency_step / self._concurrency)
+                self._batch_size = min(
+                    self.max_batch_size, self._batch_size + self.batch_size_step)
+            # anything else, such as a 400, says nothing about capacity
+
+    def snapshot(self):
+        '''returns the current settings and the smoothed request latency'''
+        with self._lock:
+            return {
+                "concurrency": int(self._concurrency),
+                "batch_size": int(self._batch_size),
+                "latency": self._latency,
+            }
@@ -0,0 +1,112 @@
+'''buffer holds events between `Transmission.send` and the sender thread'''
+import collections
+import queue
+import threading
+import time
+
+
+class PendingBuffer():
+    '''PendingBuffer is a bounded multi-producer, single-consumer buffer.
+
+    The producer side mirrors `queue.Queue`: `put` and `put_nowait` raise
+    `queue.Full` when the buffer is at capacity. Unlike `queue.Queue`, a
+    non-blocking put only appends to a deque and takes no lock unless the
+    consumer is asleep waiting for work. The consumer collects everything
+    available in one call to `drain`.
+
+    Because the capacity check in `put_nowait` is not locked, the buffer can
+    briefly hold a few more than `maxsize` items when producers race on the
+    last free slots.'''
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._reset()
+
+    def _reset(self):
+        '''empties the buffer and replaces its locks, which may have been held
+        by a thread that no longer exists, such as in a forked child'''
+        self._items = collections.deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._consumer_waiting = False
+        self._producers_waiting = 0
+        self._woken = False
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self._items)
+
+    def put_nowait(self, item):
+        '''adds item to the buffer, raising queue.Full if there is no room'''
+        if 0 < self.maxsize <= len(self._items):
+            raise queue.Full
+        self._items.append(item)
+        # the consumer sets this flag before it re-checks for items, so either
+        # it sees our item or we see the flag and wake it up
+        if self._consumer_waiting:
+            with self._mutex:
+                self._not_empty.notify()
+
+    def put(self, item, block=True, timeout=None):
+        '''adds item to the buffer. If block is true, waits up to timeout
+        seconds (forever if None) for room before raising queue.Full.'''
+        if not block:
+            self.put_nowait(item)
+            return
+        try:
+            self.put_nowait(item)
+            return
+        except queue.Full:
+            # wait for room, even if another producer took the last slot
+            # after we saw it free
+            pass
+        with self._mutex:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.full():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Full
+                self._producers_waiting += 1
+                try:
+                    self._not_full.wait(remaining)
+                finally:
+                    self._producers_waiting -= 1
+            self._items.append(item)
+            self._not_empty.notify()
+
+    def wake(self):
+        '''makes the current or next call to `drain` return without waiting
+        for an item, so the consumer can attend to other work'''
+        with self._mutex:
+            self._woken = True
+            self._not_empty.notify()
+
+    def drain(self, timeout=None):
+        '''removes and returns every item in the buffer, oldest first. If the
+        buffer is empty, waits up to timeout seconds (forever if None) for an
+        item to arrive or for `wake` to be called, and returns an empty list
+        if no item arrives.'''
+        items = self._items
+        if not items:
+            with self._mutex:
+                self._consumer_waiting = True
+                try:
+                    if not items and not self._woken:
+                        self._not_empty.wait(timeout)
+                finally:
+                    self._consumer_waiting = False
+                    self._woken = False
+        popleft = items.popleft
+        drained = [popleft() for _ in range(len(items))]
+        if self._producers_waiting:
+            with self._mutex:
+                self._not_full.notify_all()
+        return drained
@@ -1,6 +1,7 @@
 from libhoney import state
-from libhoney.event import Event
+from libhoney.event import Event, _KEPT, _NullEvent, _should_drop
 from libhoney.fields import FieldHolder
+from libhoney.sampling import DeterministicSampler
 
 
 class Builder(object):
@@ -20,11 +21,13 @@ class Builder(object):
             self.dataset = client.dataset
             self.api_host = client.api_host
             self.sample_rate = client.sample_rate
+            self.sampler = client.sampler
         else:
             self.writekey = None
             self.dataset = None
             self.api_host = 'https://api.honeycomb.io'
             self.sample_rate = 1
+            self.sampler = None
 
         self._fields = FieldHolder()  # get an empty FH
         if self.client:
@@ -36,17 +39,26 @@ class Builder(object):
     def add_field(self, name, val):
         self._fields.add_field(name, val)
 
-    def add_dynamic_field(self, fn):
+    def add_dynamic_field(self, fn, refresh="event"):
         '''`add_dynamic_field` adds a function to the builder. When you create an
            event from this builder, the function will be executed. The function
-           name is the key and it should return one value.'''
-        self._fields.add_dynamic_field(fn)
+           name is the key and it should return one value. See
+           `Client.add_dynamic_field` for `refresh`.'''
+        self._fields.add_dynamic_field(fn, refresh)
 
     def add(self, data):
         '''add takes a dict-like object and adds each key/value pair to the
            builder.'''
         self._fields.add(data)
 
+    def sample_by(self, key_field="trace.trace_id", sample_rate=None):
+        '''samples events from this builder, and builders cloned from it, by
+           a hash of their `key_field`, so events sharing a value, like the
+           spans of a trace, are all kept or all dropped. `sample_rate`
+           defaults to the builder's. See
+           `libhoney.sampling.DeterministicSampler`.'''
+        self.sampler = DeterministicSampler(key_field, sample_rate)
+
     def send_now(self, data):
         '''
         DEPRECATED - This will likely be removed in a future major version.
@@ -64,16 +76,41 @@ class Builder(object):
         ev.add(data)
         ev.send()
 
-    def new_event(self):
+    def new_event(self, presample=False):
         '''creates a new event from this builder, inheriting all fields and
-           dynamic fields present in the builder'''
+           dynamic fields present in the builder.
+
+           With `presample`, the sampling decision is made now rather than
+           when the event is sent, from the builder's `sample_rate`, or its
+           `sampler` given the builder's fields. An event sampled out is
+           returned as a stand-in that ignores fields added to it, and only
+           reports the drop when sent, so none of the work of building it
+           is done. An event kept is sent without being sampled again.'''
+        if presample:
+            if self.sampler is None:
+                keep, rate = not _should_drop(self.sample_rate), self.sample_rate
+            else:
+                keep, rate = self.sampler.sample(self)
+            if not keep:
+                return _NullEvent(self.client, self.writekey, self.dataset,
+                                  self.api_host, rate)
         ev = Event(fields=self._fields, client=self.client)
         ev.writekey = self.writekey
         ev.dataset = self.dataset
         ev.api_host = self.api_host
         ev.sample_rate = self.sample_rate
+        ev.sampler = self.sampler
+        if presample:
+            ev.sample_rate = rate
+            ev.sampler = _KEPT
         return ev
 
+    def fields(self):
+        '''returns a copy of the builder's fields, without its dynamic
+           fields'''
+        # _data may be a layer shared with events made from this builder
+        return dict(self._fields._data)
+
     def clone(self):
         '''creates a new builder from this one, creating its own scope to
            which additional fields and dynamic fields can be added.'''
@@ -81,5 +118,6 @@ class Builder(object):
         c.writekey = self.writekey
         c.dataset = self.dataset
         c.sample_rate = self.sample_rate
+        c.sampler = self.sampler
         c.api_host = self.api_host
         return c
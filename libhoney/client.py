@@ -1,10 +1,13 @@
 import logging
 import re
-import queue
 
 from libhoney.event import Event
 from libhoney.builder import Builder
 from libhoney.fields import FieldHolder
+from libhoney.metrics import Metrics
+from libhoney.responses import ResponseReporter
+from libhoney.sampling import ThroughputSampler
+from libhoney.serializer import get_serializer
 from libhoney.transmission import Transmission
 
 
@@ -54,6 +57,15 @@ class Client(object):
             write key at [https://ui.honeycomb.io/account](https://ui.honeycomb.io/account)
     - `dataset`: the name of the default dataset to which to write
     - `sample_rate`: the default sample rate. 1 / `sample_rate` events will be sent.
+    - `sampler`: if set, a sampler from `libhoney.sampling` that picks the
+            sample rate for each event in place of `sample_rate`.
+    - `target_throughput`: if set, and `sampler` isn't, sample each dataset
+            to send about this many events per second, adjusting its sample
+            rate as traffic rises and falls. See
+            `libhoney.sampling.ThroughputSampler`.
+    - `tail_sampler`: if set, a `libhoney.tail.TailSampler` that holds back
+            sent events until their trace is complete, and then keeps or
+            drops the trace as a whole.
     - `max_concurrent_batches`: the maximum number of concurrent threads sending events.
     - `max_batch_size`: the maximum number of events to batch before sending.
     - `send_frequency`: how long to wait before sending a batch of events, in seconds.
@@ -66,6 +78,54 @@ class Client(object):
     - `user_agent_addition`: if set, its contents will be appended to the
             User-Agent string, separated by a space. The expected format is
             product-name/version, eg "myapp/1.0"
+    - `serializer`: how events are encoded: as JSON with "orjson", "msgspec"
+            or "json", as MessagePack with "msgpack" (requires the msgpack
+            module), or None (the default) for the fastest JSON encoder
+            installed. To use it with `transmission_impl`, pass it to that
+            transmission too.
+    - `compression`: how batch requests are compressed: "none", "gzip",
+            "zstd" (requires the zstandard module) or "adaptive", or a codec
+            from `libhoney.compression`. Defaults to gzip.
+    - `http_backend`: the HTTP client batches are sent with: "requests" (the
+            default), "urllib3", "http.client", "httpx" (requires httpx, and
+            h2 for HTTP/2), or a transport from `libhoney.transport`.
+    - `prewarm`: if true, connect to `api_host` as soon as the client
+            starts, rather than when the first batch is sent.
+    - `response_mode`: what goes on the responses queue: "events" (the
+            default), a record per event; "errors", a record per event that
+            failed to send; "batches", a record per batch with a list of its
+            events' metadata; or "none". See `libhoney.responses`.
+    - `response_callback`: if set, a function called with each response
+            record, from the sending threads, instead of queueing it.
+
+    The remaining arguments are passed to the default `Transmission`, and are
+    ignored if `transmission_impl` is set:
+
+    - `max_batch_bytes`: the maximum size of a batch request body, in bytes.
+    - `destination_overrides`: a dict mapping a dataset name to a dict of batch
+            settings (`max_batch_size`, `max_batch_bytes`, `send_frequency`,
+            `min_batch_size`, `max_linger`) to use for that dataset.
+    - `min_batch_size`: batches smaller than this wait up to `max_linger`
+            seconds, rather than `send_frequency`, for more events.
+    - `max_linger`: see `min_batch_size`.
+    - `adaptive`: an `AIMDController`, or True, to tune concurrency and batch
+            size from the API's latency and pushback.
+    - `max_retries`: how many times a failed event is retried.
+    - `retry_base_delay`, `max_retry_delay`: bounds of the jittered
+            exponential backoff between retries, in seconds.
+    - `retry_budget_ratio`: the fraction of fresh traffic to a destination
+            that may be spent on retries.
+    - `spool_dir`: if set, a directory in which to keep events that overflow
+            the send queue or can't be delivered, to be sent later. Events
+            left there by an earlier process are sent on start.
+    - `spool_max_bytes`: the most disk space the spool may use.
+    - `spool_drain_rate`: the most spooled events to send per second.
+    - `metrics_sink`: where internal metrics are flushed: "statsd" (the
+            default), "none", a function called with dicts of counter
+            increments and gauge values, or a sink from `libhoney.metrics`.
+    - `metrics_interval`: how often metrics are flushed, in seconds.
+    - `stats_hook`: if set, a function called with the result of `stats()`
+            each time metrics are flushed.
     '''
 
     def __init__(self, writekey="", dataset="", sample_rate=1,
@@ -73,13 +133,36 @@ class Client(object):
                  max_concurrent_batches=10, max_batch_size=100,
                  send_frequency=0.25, block_on_send=False,
                  block_on_response=False, transmission_impl=None,
-                 user_agent_addition='', debug=False):
-
+                 user_agent_addition='', debug=False,
+                 max_batch_bytes=5000000, destination_overrides=None,
+                 min_batch_size=1, max_linger=1.0, adaptive=None,
+                 max_retries=3, retry_base_delay=0.5, max_retry_delay=30.0,
+                 retry_budget_ratio=0.1, spool_dir=None,
+                 spool_max_bytes=100 * 1024 * 1024, spool_drain_rate=1000,
+                 serializer=None, compression=None, http_backend="requests",
+                 prewarm=False, response_mode="events", response_callback=None,
+                 metrics_sink="statsd", metrics_interval=10.0, stats_hook=None,
+                 sampler=None, target_throughput=None, tail_sampler=None):
+
+        self.serializer = get_serializer(serializer)
+        self.stats_hook = stats_hook
+        # counts events dropped by sampling, for stats()
+        self._metrics = Metrics()
         self.xmit = transmission_impl
         if self.xmit is None:
             self.xmit = Transmission(
                 max_concurrent_batches=max_concurrent_batches, block_on_send=block_on_send, block_on_response=block_on_response,
                 user_agent_addition=user_agent_addition, debug=debug,
+                max_batch_bytes=max_batch_bytes, destination_overrides=destination_overrides,
+                min_batch_size=min_batch_size, max_linger=max_linger, adaptive=adaptive,
+                max_retries=max_retries, retry_base_delay=retry_base_delay,
+                max_retry_delay=max_retry_delay, retry_budget_ratio=retry_budget_ratio,
+                spool_dir=spool_dir, spool_max_bytes=spool_max_bytes, spool_drain_rate=spool_drain_rate,
+                serializer=self.serializer, compression=compression,
+                http_backend=http_backend, prewarm_hosts=(api_host,) if prewarm else (),
+                response_mode=response_mode, response_callback=response_callback,
+                metrics_sink=metrics_sink, metrics_interval=metrics_interval,
+                stats_hook=self._export_stats if stats_hook else None,
             )
 
         self.xmit.start()
@@ -87,8 +170,16 @@ class Client(object):
         self.dataset = dataset
         self.api_host = api_host
         self.sample_rate = sample_rate
+        if sampler is None and target_throughput:
+            sampler = ThroughputSampler(target_throughput)
+        self.sampler = sampler
         self._responses = self.xmit.get_response_queue()
         self.block_on_response = block_on_response
+        self._reporter = ResponseReporter(
+            self._responses, response_mode, response_callback, block_on_response)
+        self.tail_sampler = tail_sampler
+        if tail_sampler is not None:
+            tail_sampler.start(self._transmit, self.send_dropped_response)
 
         self.fields = FieldHolder()
 
@@ -156,15 +247,37 @@ class Client(object):
         '''
         return self._responses
 
+    def stats(self):
+        '''Returns a snapshot of how events are flowing through the client:
+        see `Transmission.stats`. `dropped` also counts the events dropped
+        by sampling, as "sampling". With a `transmission_impl` that has no
+        stats, only that count is returned. With a `tail_sampler`, `tail`
+        holds its `stats()`.'''
+        stats = {}
+        if hasattr(self.xmit, "stats"):
+            stats = self.xmit.stats()
+        stats.setdefault("dropped", {})["sampling"] = \
+            self._metrics.counters().get("sampled", 0)
+        if self.tail_sampler is not None:
+            stats["tail"] = self.tail_sampler.stats()
+        return stats
+
+    def _export_stats(self, _):
+        self.stats_hook(self.stats())
+
     def add_field(self, name, val):
         '''add a global field. This field will be sent with every event.'''
         self.fields.add_field(name, val)
 
-    def add_dynamic_field(self, fn):
+    def add_dynamic_field(self, fn, refresh="event"):
         '''add a global dynamic field. This function will be executed every time an
         event is created. The key/value pair of the function's name and its
-        return value will be sent with every event.'''
-        self.fields.add_dynamic_field(fn)
+        return value will be sent with every event.
+
+        For functions too costly to call for every event, `refresh` may be
+        "batch", to call it once for each batch of events as it is sent, or
+        a number of seconds to reuse its value for.'''
+        self.fields.add_dynamic_field(fn, refresh)
 
     def add(self, data):
         '''add takes a mappable object and adds each key/value pair to the
@@ -185,9 +298,20 @@ class Client(object):
                 " ev = %s", event.fields())
             return
 
-        self.log("send enqueuing event ev = %s", event.fields())
+        if self.debug:
+            # fields() merges the event's fields, which otherwise waits
+            # until the event is encoded on the sending thread
+            self.log("send enqueuing event ev = %s", event.fields())
+        if self.tail_sampler is not None:
+            self.tail_sampler.add(event)
+            return
         self.xmit.send(event)
 
+    def _transmit(self, event):
+        # events the tail sampler keeps
+        if self.xmit is not None:
+            self.xmit.send(event)
+
     def send_now(self, data):
         '''
         DEPRECATED - This will likely be removed in a future major version.
@@ -203,26 +327,14 @@ class Client(object):
         '''
         ev = self.new_event()
         ev.add(data)
-        self.log("send_now enqueuing event ev = %s", ev.fields())
+        if self.debug:
+            self.log("send_now enqueuing event ev = %s", ev.fields())
         ev.send()
 
     def send_dropped_response(self, event):
         '''push the dropped event down the responses queue'''
-        response = {
-            "status_code": 0,
-            "duration": 0,
-            "metadata": event.metadata,
-            "body": "",
-            "error": "event dropped due to sampling",
-        }
-        self.log("enqueuing response = %s", response)
-        try:
-            if self.block_on_response:
-                self._responses.put(response)
-            else:
-                self._responses.put_nowait(response)
-        except queue.Full:
-            pass
+        self._metrics.incr("sampled")
+        self._reporter.sampled(event.metadata)
 
     def close(self):
         '''Wait for in-flight events to be transmitted then shut down cleanly.
@@ -230,6 +342,8 @@ class Client(object):
         application is consuming from the responses queue and needs to know
         when all responses have been received.'''
 
+        if self.tail_sampler is not None:
+            self.tail_sampler.close()
         if self.xmit:
             self.xmit.close()
 
@@ -244,6 +358,8 @@ class Client(object):
         Note: does not work with asynchronous Transmission implementations such
         as TornadoTransmission.
         '''
+        if self.tail_sampler is not None:
+            self.tail_sampler.flush()
         if self.xmit and isinstance(self.xmit, Transmission):
             self.xmit.close()
             self.xmit.start()
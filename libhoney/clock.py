@@ -0,0 +1,49 @@
+'''clock gives events cheap wall clock timestamps, as integer nanoseconds
+since the epoch, and formats them as RFC3339 only when they are encoded'''
+import datetime
+import time
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def now_ns():
+    '''returns the current time in nanoseconds since the epoch'''
+    # time_ns is a single clock read that allocates nothing bigger than an
+    # int, which is cheaper than offsetting perf_counter_ns from a wall clock
+    # anchor in Python, and can't drift from the wall clock
+    return time.time_ns()
+
+
+def to_datetime(ns, tz=None):
+    '''returns a timestamp as a datetime in UTC: a naive one, as
+    datetime.utcnow() returns, or with `tz` as its tzinfo'''
+    dt = _EPOCH + datetime.timedelta(microseconds=ns // 1000)
+    if tz is not None:
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+
+def from_datetime(dt):
+    '''returns a datetime as nanoseconds since the epoch. Naive datetimes
+    are taken to be in UTC.'''
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+# the second the cached prefix is for, and the prefix
+_prefix = (None, "")
+
+
+def rfc3339(ns):
+    '''returns a timestamp formatted as an RFC3339 UTC time with microsecond
+    precision, like "2016-01-02T03:04:05.000006Z". Events arrive in roughly
+    time order, so the date and time up to the second is cached.'''
+    global _prefix  # pylint: disable=global-statement
+    seconds, fraction = divmod(ns, 1000000000)
+    cached_second, prefix = _prefix
+    if seconds != cached_second:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S.", time.gmtime(seconds))
+        _prefix = (seconds, prefix)
+    return f"{prefix}{fraction // 1000:06d}Z"
@@ -0,0 +1,177 @@
+'''compression holds the codecs that can compress batch request bodies'''
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+    has_zstd = True
+except ImportError:
+    has_zstd = False
+
+
+class NoCodec():
+    '''NoCodec sends bodies uncompressed'''
+    name = "none"
+    content_encoding = None
+
+    def compressobj(self):
+        '''returns None, meaning the body is sent as is'''
+        return None
+
+
+class GzipCodec():
+    '''GzipCodec compresses bodies with gzip at `level`'''
+    name = "gzip"
+    content_encoding = "gzip"
+    levels = (1, 3, 6, 9)
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def compressobj(self):
+        '''returns a new compressor with `compress` and `flush` methods'''
+        # a wbits of 16 + MAX_WBITS makes zlib write a gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class ZstdCodec():
+    '''ZstdCodec compresses bodies with zstd at `level`. It requires the
+    zstandard module.
+
+    A zstandard compression object shares its compressor's context, so each
+    body gets a compressor of its own: batches are compressed on several
+    threads at once.'''
+    name = "zstd"
+    content_encoding = "zstd"
+    levels = (1, 3, 6, 9, 12)
+
+    def __init__(self, level=3):
+        if not has_zstd:
+            raise ImportError("the zstd codec requires zstandard, but it was not found.")
+        self.level = level
+
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+
+class AdaptiveCodec():
+    '''AdaptiveCodec picks the compression level that sends the fewest bytes
+    while keeping compression within a CPU budget.
+
+    One batch in `sample_every` is compressed at the next level in turn, and
+    the CPU time and compression ratio it achieves are folded into a moving
+    average for that level. Every other batch uses the level with the best
+    ratio among those that cost no more than `cpu_budget` seconds of CPU per
+    megabyte of uncompressed body, or the cheapest level if none do. Fewer
+    bytes per event means more events through the same link, so this
+    maximizes throughput for the CPU we are willing to spend.
+
+    `codec` is "zstd" or "gzip"; by default zstd is used if it is installed.'''
+
+    def __init__(self, codec=None, levels=None, cpu_budget=0.01, sample_every=10):
+        if codec is None:
+            codec = ZstdCodec.name if has_zstd else GzipCodec.name
+        codec_class = _LEVELLED_CODECS[codec]
+        self.levels = tuple(levels or codec_class.levels)
+        self._codecs = {level: codec_class(level) for level in self.levels}
+        self.name = "adaptive"
+        self.content_encoding = codec_class.content_encoding
+        self.cpu_budget = cpu_budget
+        self.sample_every = sample_every
+
+        # level -> [cpu seconds per MB, compressed / uncompressed size]
+        self._stats = {}
+        self._level = self.levels[0]
+        self._batches = 0
+        self._next_sample = 0
+        self._lock = threading.Lock()
+
+    @property
+    def level(self):
+        '''the level used for batches that aren't being sampled'''
+        return self._level
+
+    def compressobj(self):
+        with self._lock:
+            self._batches += 1
+            if self._batches % self.sample_every:
+                return self._codecs[self._level].compressobj()
+            level = self.levels[self._next_sample]
+            self._next_sample = (self._next_sample + 1) % len(self.levels)
+        return _MeasuredCompressor(self, level, self._codecs[level].compressobj())
+
+    def stats(self):
+        '''returns the measured cpu seconds per MB and compression ratio of
+        each level sampled so far'''
+        with self._lock:
+            return {level: {"cpu_per_mb": cpu, "ratio": ratio}
+                    for level, (cpu, ratio) in self._stats.items()}
+
+    def _record(self, level, cpu, raw_bytes, compressed_bytes):
+        if not raw_bytes:
+            return
+        cpu_per_mb = cpu * 1000000 / raw_bytes
+        ratio = compressed_bytes / raw_bytes
+        with self._lock:
+            stats = self._stats.get(level)
+            if stats is None:
+                self._stats[level] = [cpu_per_mb, ratio]
+            else:
+                stats[0] += 0.3 * (cpu_per_mb - stats[0])
+                stats[1] += 0.3 * (ratio - stats[1])
+            within_budget = [(r, lvl) for lvl, (c, r) in self._stats.items()
+                             if c <= self.cpu_budget]
+            if within_budget:
+                self._level = min(within_budget)[1]
+            else:
+                self._level = min((c, lvl) for lvl, (c, _) in self._stats.items())[1]
+
+
+class _MeasuredCompressor():
+    '''wraps a compressor to report its CPU time and ratio to an
+    AdaptiveCodec when it is flushed'''
+
+    def __init__(self, codec, level, compressor):
+        self._codec = codec
+        self._level = level
+        self._compressor = compressor
+        self._cpu = 0.0
+        self._raw = 0
+        self._compressed = 0
+
+    def compress(self, data):
+        start = time.thread_time()
+        out = self._compressor.compress(data)
+        self._cpu += time.thread_time() - start
+        self._raw += len(data)
+        self._compressed += len(out)
+        return out
+
+    def flush(self):
+        start = time.thread_time()
+        out = self._compressor.flush()
+        self._cpu += time.thread_time() - start
+        self._compressed += len(out)
+        self._codec._record(self._level, self._cpu, self._raw, self._compressed)
+        return out
+
+
+_LEVELLED_CODECS = {GzipCodec.name: GzipCodec, ZstdCodec.name: ZstdCodec}
+
+
+def get_codec(codec, level=None):
+    '''returns a codec. `codec` may be "none", "gzip", "zstd", "adaptive" or
+    a codec object, which is returned as is. `level` sets the level of gzip
+    or zstd, and otherwise each uses its own default.'''
+    if not isinstance(codec, str):
+        return codec
+    if codec == NoCodec.name:
+        return NoCodec()
+    if codec == "adaptive":
+        return AdaptiveCodec()
+    if codec in _LEVELLED_CODECS:
+        if level is None:
+            return _LEVELLED_CODECS[codec]()
+        return _LEVELLED_CODECS[codec](level)
+    raise ValueError(f"unknown compression: {codec}")
@@ -0,0 +1,59 @@
+'''encoding turns individually encoded events into batch request bodies'''
+
+
+def iter_batch(payloads, compressor=None, serializer=None):
+    '''iter_batch yields the body of a batch request built from a sequence of
+    encoded events, in chunks. Each event is written straight into the
+    compressor as it is consumed, so the uncompressed body is never assembled
+    in memory. `compressor` is a fresh compressor from a codec's
+    `compressobj`, or None to leave the body uncompressed.
+
+    The events are framed as an array in the format of `serializer`, which
+    needs `payloads` to be a sized sequence. Without a serializer they are
+    framed as a JSON array, and `payloads` may be any iterable.
+
+    Join the chunks with `b"".join` if the HTTP layer needs a single buffer.'''
+    if serializer is None:
+        header, separator, footer = b"[", b",", b"]"
+    else:
+        header = serializer.batch_header(len(payloads))
+        separator = serializer.batch_separator
+        footer = serializer.batch_footer
+
+    if compressor is None:
+        yield header
+        first = True
+        for payload in payloads:
+            if not first and separator:
+                yield separator
+            first = False
+            yield payload
+        if footer:
+            yield footer
+        return
+
+    compress = compressor.compress
+    chunk = compress(header)
+    if chunk:
+        yield chunk
+    first = True
+    for payload in payloads:
+        if not first and separator:
+            chunk = compress(separator)
+            if chunk:
+                yield chunk
+        first = False
+        chunk = compress(payload)
+        if chunk:
+            yield chunk
+    if footer:
+        chunk = compress(footer)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def encode_batch(payloads, compressor=None, serializer=None):
+    '''encode_batch returns the body of a batch request as a single bytes
+    object. See `iter_batch`.'''
+    return b"".join(iter_batch(payloads, compressor, serializer))
@@ -2,8 +2,8 @@ import datetime
 import random
 from contextlib import contextmanager
 
-from libhoney import state
-from libhoney.fields import FieldHolder
+from libhoney import clock, state
+from libhoney.fields import BatchField, FieldHolder
 
 
 class Event(object):
@@ -20,11 +20,13 @@ class Event(object):
             self.dataset = client.dataset
             self.api_host = client.api_host
             self.sample_rate = client.sample_rate
+            self.sampler = client.sampler
         else:
             self.writekey = None
             self.dataset = None
             self.api_host = 'https://api.honeycomb.io'
             self.sample_rate = 1
+            self.sampler = None
 
         # populate the event's fields
         self._fields = FieldHolder()  # get an empty FH
@@ -34,12 +36,34 @@ class Event(object):
         [self._fields.add_dynamic_field(fn) for fn in dyn_fields]
         self._fields += fields
 
-        # fill in other info
-        self.created_at = datetime.datetime.utcnow()
+        # fill in other info. The time is kept in ns until something asks
+        # for created_at, and is only formatted when the event is encoded.
+        self._timestamp_ns = clock.now_ns()
+        self._created_at = None
         self.metadata = None
-        # execute all the dynamic functions and add their data
+        # execute all the dynamic functions and add their data, except those
+        # the transmission calls once per batch
+        self._batch_fields = None
         for fn in self._fields._dyn_fields:
-            self._fields.add_field(fn.__name__, fn())
+            if fn.__class__ is BatchField:
+                if self._batch_fields is None:
+                    self._batch_fields = []
+                self._batch_fields.append(fn)
+            else:
+                self._fields.add_field(fn.__name__, fn())
+
+    @property
+    def created_at(self):
+        '''the time of the event, as a naive datetime in UTC unless it was
+        set to something else'''
+        if self._created_at is None:
+            self._created_at = clock.to_datetime(self._timestamp_ns)
+        return self._created_at
+
+    @created_at.setter
+    def created_at(self, value):
+        self._created_at = value
+        self._timestamp_ns = None
 
     def add_field(self, name, val):
         self._fields.add_field(name, val)
@@ -77,7 +101,9 @@ class Event(object):
 
         Will drop sampled events when sample_rate > 1,
         and ensure that the Honeycomb datastore correctly considers it
-        as representing `sample_rate` number of similar events.'''
+        as representing `sample_rate` number of similar events. If the
+        event has a `sampler` (see `libhoney.sampling`), the sampler decides
+        instead, and sets `sample_rate`.'''
         # warn if we're not using a client instance and global libhoney
         # is not initialized. This will result in a noop, but is better
         # than crashing the caller if they forget to initialize
@@ -85,7 +111,12 @@ class Event(object):
             state.warn_uninitialized()
             return
 
-        if _should_drop(self.sample_rate):
+        if self.sampler is None:
+            drop = _should_drop(self.sample_rate)
+        else:
+            keep, self.sample_rate = self.sampler.sample(self)
+            drop = not keep
+        if drop:
             self.client.send_dropped_response(self)
             return
 
@@ -129,6 +160,63 @@ class Event(object):
         return self._fields._data
 
 
+class _NullEvent(object):
+    '''_NullEvent stands in for an event that was sampled out as it was
+    created (see `Builder.new_event`). Adding fields to it does nothing,
+    and sending it only reports it as dropped by sampling, with whatever
+    metadata was added.'''
+
+    def __init__(self, client, writekey, dataset, api_host, sample_rate):
+        self.client = client
+        self.writekey = writekey
+        self.dataset = dataset
+        self.api_host = api_host
+        self.sample_rate = sample_rate
+        self.metadata = None
+        self._timestamp_ns = clock.now_ns()
+        self._created_at = None
+
+    created_at = Event.created_at
+
+    def add_field(self, name, val):
+        pass
+
+    def add_metadata(self, md):
+        self.metadata = md
+
+    def add(self, data):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    def send(self):
+        if self.client is None:
+            state.warn_uninitialized()
+            return
+        self.client.send_dropped_response(self)
+
+    def send_presampled(self):
+        self.send()
+
+    def __str__(self):
+        return "{}"
+
+    def fields(self):
+        return {}
+
+
+class _Kept(object):
+    '''the sampler of an event already kept by sampling when it was created'''
+
+    def sample(self, event):
+        return True, event.sample_rate
+
+
+_KEPT = _Kept()
+
+
 def _should_drop(rate):
     '''returns true if the sample should be dropped'''
     return random.randint(1, rate) != 1
@@ -1,21 +1,85 @@
 import inspect
-import json
-from libhoney.internal import json_default_handler
+import threading
+import time
+
+from libhoney.serializer import default_serializer
+
+# refresh policies for dynamic fields: call the function for every event,
+# or once for each batch of events sent. A number of seconds is a third
+# policy, caching the function's value for that long.
+EVERY_EVENT = "event"
+EVERY_BATCH = "batch"
 
 
 class FieldHolder:
     '''A FieldHolder is the generalized class that stores fields and dynamic
-       fields. It should not be used directly; only through the subclasses'''
+       fields. It should not be used directly; only through the subclasses
+
+       Fields are kept in layers, so that an event or builder can inherit
+       the fields of its client and builders without copying them: a tuple
+       of inherited dicts, oldest first, under a dict of fields added
+       locally. Inherited dicts are never modified again. A holder whose
+       local dict has been inherited by another copies it before it next
+       changes it. The layers are merged into one dict the first time all
+       the fields are read, which for an event is when it is encoded.'''
+
+    # holders with more layers than this are flattened, to bound the cost of
+    # merging them
+    _MAX_LAYERS = 8
 
     def __init__(self):
-        self._data = {}
+        self._layers = ()
+        self._local = {}
+        # true if _local is one of another holder's layers
+        self._shared = False
         self._dyn_fields = set()
 
+    @property
+    def _data(self):
+        '''all of the fields, as one dict'''
+        if self._layers:
+            merged = {}
+            for layer in self._layers:
+                merged.update(layer)
+            merged.update(self._local)
+            self._layers = ()
+            self._local = merged
+            self._shared = False
+        return self._local
+
+    @_data.setter
+    def _data(self, data):
+        self._layers = ()
+        self._local = data
+        self._shared = False
+
     def __add__(self, other):
         '''adding two field holders merges the data with other overriding
            any fields they have in common'''
-        self._data.update(other._data)
-        self._dyn_fields.update(other._dyn_fields)
+        if other._local:
+            other._shared = True
+        mine = self._layers
+        if self._local:
+            mine += (self._local,)
+            self._local = {}
+            self._shared = False
+        theirs = other._layers
+        if other._local:
+            theirs += (other._local,)
+        if not mine or _starts_with(theirs, mine):
+            # other already holds everything we do, as when an event is made
+            # from a builder that inherited the client's fields
+            layers = theirs
+        else:
+            layers = _dedupe(mine + theirs)
+        if len(layers) > self._MAX_LAYERS:
+            merged = {}
+            for layer in layers:
+                merged.update(layer)
+            layers = (merged,)
+        self._layers = layers
+        if other._dyn_fields:
+            self._dyn_fields.update(other._dyn_fields)
         return self
 
     def __eq__(self, other):
@@ -28,24 +92,126 @@ class FieldHolder:
         return not self.__eq__(other)
 
     def add_field(self, name, val):
-        self._data[name] = val
+        if self._shared:
+            self._local = dict(self._local)
+            self._shared = False
+        self._local[name] = val
 
-    def add_dynamic_field(self, fn):
+    def add_dynamic_field(self, fn, refresh=EVERY_EVENT):
+        '''adds a function whose name is a field's name and whose return
+        value is its value. `refresh` says how often it is called: for every
+        event ("event"), once per batch of events on the sending thread
+        ("batch"), or at most every `refresh` seconds, with the value shared
+        by the events in between.'''
         if not inspect.isroutine(fn):
             raise TypeError("add_dynamic_field requires function argument")
+        if refresh == EVERY_BATCH:
+            fn = BatchField(fn)
+        elif refresh != EVERY_EVENT:
+            if isinstance(refresh, bool) or not isinstance(refresh, (int, float)) or refresh <= 0:
+                raise ValueError(
+                    f"refresh must be \"{EVERY_EVENT}\", \"{EVERY_BATCH}\" or a positive number of seconds")
+            fn = CachedField(fn, refresh)
         self._dyn_fields.add(fn)
 
     def add(self, data):
         try:
-            for k, v in data.items():
-                self.add_field(k, v)
+            items = data.items()
         except AttributeError:
             raise TypeError("add requires a dict-like argument") from None
+        for k, v in items:
+            self.add_field(k, v)
 
     def is_empty(self):
         '''returns true if there is no data in this FieldHolder'''
-        return len(self._data) == 0
+        # layers are never empty
+        return not self._local and not self._layers
 
     def __str__(self):
         '''returns a JSON blob of the fields in this holder'''
-        return json.dumps(self._data, default=json_default_handler)
+        return default_serializer().dumps(self._data).decode()
+
+
+def _starts_with(layers, prefix):
+    '''returns true if layers begins with the very dicts in prefix'''
+    if len(prefix) > len(layers):
+        return False
+    for a, b in zip(layers, prefix):
+        if a is not b:
+            return False
+    return True
+
+
+def _dedupe(layers):
+    '''returns layers with only the last appearance of each dict. Inheriting
+    from a builder repeats the client's layers, and the last appearance is
+    the one that decides the result.'''
+    seen = set()
+    deduped = []
+    for layer in reversed(layers):
+        if id(layer) not in seen:
+            seen.add(id(layer))
+            deduped.append(layer)
+    deduped.reverse()
+    return tuple(deduped)
+
+
+_MISSING = object()
+
+
+class CachedField():
+    '''CachedField wraps a dynamic field function to call it at most every
+    `ttl` seconds, and returns the last value in between. Whichever thread
+    finds the value stale refreshes it, while the others keep using the
+    stale value rather than wait.'''
+
+    def __init__(self, fn, ttl):
+        self.fn = fn
+        self.ttl = ttl
+        self.__name__ = fn.__name__
+        # (value, monotonic expiry), replaced as a whole
+        self._cached = (_MISSING, 0)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        value, expires = self._cached
+        if time.monotonic() < expires:
+            return value
+        # only wait on another thread's refresh if there is nothing to return
+        if not self._lock.acquire(blocking=value is _MISSING):  # pylint: disable=consider-using-with
+            return value
+        try:
+            value, expires = self._cached
+            if time.monotonic() < expires:
+                return value
+            value = self.fn()
+            self._cached = (value, time.monotonic() + self.ttl)
+            return value
+        finally:
+            self._lock.release()
+
+    def __eq__(self, other):
+        return (isinstance(other, CachedField) and
+                (self.fn, self.ttl) == (other.fn, other.ttl))
+
+    def __hash__(self):
+        return hash((CachedField, self.fn, self.ttl))
+
+
+class BatchField():
+    '''BatchField marks a dynamic field function to be called once for each
+    batch of events, on the sending thread, rather than for every event.
+    FileTransmission, which doesn't batch, calls it for every event.'''
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.__name__ = fn.__name__
+
+    def __call__(self):
+        return self.fn()
+
+    def __eq__(self, other):
+        return isinstance(other, BatchField) and self.fn == other.fn
+
+    def __hash__(self):
+        return hash((BatchField, self.fn))
@@ -0,0 +1,237 @@
+'''metrics keeps libhoney's internal counters, gauges and histograms in
+process and periodically flushes them to a sink, such as statsd'''
+import bisect
+import threading
+import time
+
+
+def _series(low, high):
+    '''returns 1, 2.5 and 5 times each power of ten from 10**low up to
+    10**high'''
+    return tuple(float(f"{m}e{e}") for e in range(low, high)
+                 for m in (1, 2.5, 5)) + (float(f"1e{high}"),)
+
+
+# bucket upper bounds for timings, in seconds: 1us to 10s
+TIME_BUCKETS = _series(-6, 1)
+# bucket upper bounds for batch sizes: 1 to 4096 events
+COUNT_BUCKETS = tuple(2 ** i for i in range(13))
+# bucket upper bounds for body sizes: 256B to 8MB
+BYTE_BUCKETS = tuple(2 ** i for i in range(8, 24))
+
+
+class Histogram():
+    '''Histogram counts observations in fixed buckets, given by their upper
+    bounds. Anything over the last bound lands in an overflow bucket.
+    Observing a value is a binary search and a few additions.'''
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._count = 0
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self):
+        '''returns the count, sum and mean of the observations, estimates of
+        their median and 99th percentile, and the count in each bucket as
+        a list of [upper bound, count] pairs'''
+        with self._lock:
+            counts = list(self._counts)
+            count, total = self._count, self._sum
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0,
+            "p50": self._quantile(counts, count, 0.5),
+            "p99": self._quantile(counts, count, 0.99),
+            "buckets": [[bound, n] for bound, n in zip(self.bounds + (float("inf"),), counts)],
+        }
+
+    def _quantile(self, counts, count, q):
+        # the upper bound of the bucket holding the q'th observation
+        if not count:
+            return 0
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= q * count:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+class StatsdSink():
+    '''StatsdSink sends metrics to statsd, batched into as few packets as
+    possible. The statsd client is created along with the sink.'''
+
+    def __init__(self, host="localhost", port=8125, prefix="libhoney"):
+        import statsd  # pylint: disable=import-outside-toplevel
+
+        self.client = statsd.StatsClient(host, port, prefix=prefix)
+
+    def send(self, counters, gauges):
+        pipe = self.client.pipeline()
+        for name, count in counters.items():
+            if count:
+                pipe.incr(name, count)
+        for name, value in gauges.items():
+            pipe.gauge(name, value)
+        pipe.send()
+
+
+class CallbackSink():
+    '''CallbackSink calls `callback(counters, gauges)` with each flush'''
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def send(self, counters, gauges):
+        self.callback(counters, gauges)
+
+
+def get_metrics_sink(sink):
+    '''returns a sink. `sink` may be "statsd", "none" (or None), a function to
+    wrap in a CallbackSink, or any object with a `send(counters, gauges)`
+    method, which is returned as is.'''
+    if sink is None or sink == "none":
+        return None
+    if sink == "statsd":
+        return StatsdSink()
+    if isinstance(sink, str):
+        raise ValueError(f"unknown metrics sink: {sink}")
+    if hasattr(sink, "send"):
+        return sink
+    return CallbackSink(sink)
+
+
+class Metrics():
+    '''Metrics counts in memory, which is cheap enough to do for every event,
+    and hands the counts to `sink` at most every `interval` seconds, from
+    whichever thread calls `maybe_flush`. After each flush, `export` is
+    called, if given, with no arguments.
+
+    Counters only ever go up; each flush passes the sink how much they grew
+    since the last one. Each thread counts into a dict of its own, without
+    taking a lock, and the dicts are summed when the counters are read.
+    Gauges are functions, sampled when flushed. Histograms are kept in
+    memory only.'''
+
+    def __init__(self, sink=None, interval=10.0, export=None):
+        self.sink = sink
+        self.interval = interval
+        self.export = export
+        self.started_at = time.monotonic()
+        self.next_flush = time.monotonic() + interval
+        # each counting thread's counts, which only it writes to
+        self._local = threading.local()
+        self._shards = []
+        # the counts of threads that have exited
+        self._retired = {}
+        self._flushed = {}
+        self._gauges = {}
+        self._histograms = {}
+        # guards _shards and _retired
+        self._lock = threading.Lock()
+        # true if a counter has changed since the last flush
+        self.dirty = False
+
+    def incr(self, name, count=1):
+        try:
+            counts = self._local.counts
+        except AttributeError:
+            counts = self._new_shard()
+        counts[name] = counts.get(name, 0) + count
+        self.dirty = True
+
+    def _new_shard(self):
+        counts = self._local.counts = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), counts))
+        return counts
+
+    def gauge(self, name, fn):
+        '''registers `fn`, which returns the current value of gauge `name`'''
+        self._gauges[name] = fn
+
+    def histogram(self, name, bounds):
+        '''returns histogram `name`, creating it with `bounds` if need be'''
+        hist = self._histograms.get(name)
+        if hist is None:
+            hist = self._histograms[name] = Histogram(bounds)
+        return hist
+
+    @property
+    def active(self):
+        '''true if flushing does anything'''
+        return self.sink is not None or self.export is not None
+
+    def counters(self):
+        '''returns the current value of every counter'''
+        with self._lock:
+            totals = dict(self._retired)
+            live = []
+            for thread, counts in self._shards:
+                # copying a dict is atomic, so this is safe while the thread
+                # goes on counting into it
+                snapshot = dict(counts)
+                for name, count in snapshot.items():
+                    totals[name] = totals.get(name, 0) + count
+                if thread.is_alive():
+                    live.append((thread, counts))
+                else:
+                    for name, count in snapshot.items():
+                        self._retired[name] = self._retired.get(name, 0) + count
+            self._shards = live
+        return totals
+
+    def gauges(self):
+        '''returns the current value of every gauge'''
+        return {name: fn() for name, fn in self._gauges.items()}
+
+    def histograms(self):
+        '''returns a snapshot of every histogram'''
+        return {name: hist.snapshot() for name, hist in self._histograms.items()}
+
+    def maybe_flush(self, now=None):
+        '''flushes if there is a sink or export and `interval` has passed
+        since the last flush'''
+        if not self.active:
+            return
+        if now is None:
+            now = time.monotonic()
+        if now >= self.next_flush:
+            self.flush()
+
+    def flush(self):
+        '''sends the sink what the counters have grown by since the last
+        flush, and the gauges' current values, then calls export'''
+        self.next_flush = time.monotonic() + self.interval
+        self.dirty = False
+        counters = self.counters()
+        # metrics are best effort
+        if self.sink is not None:
+            deltas = {name: count - self._flushed.get(name, 0)
+                      for name, count in counters.items()}
+            self._flushed = counters
+            try:
+                self.sink.send(deltas, self.gauges())
+            except Exception:
+                pass
+        if self.export is not None:
+            try:
+                self.export()
+            except Exception:
+                pass
+
+    def _after_fork(self):
+        # the locks may have been held by threads that didn't survive the fork
+        self._lock = threading.Lock()
+        for hist in self._histograms.values():
+            hist._lock = threading.Lock()
@@ -0,0 +1,98 @@
+'''responses delivers records of what happened to sent events, according to
+a response mode'''
+import queue
+import time
+
+# a record per event, as libhoney has always done
+EVENTS = "events"
+# a record per event that could not be sent
+ERRORS = "errors"
+# a record per batch (per distinct outcome within a batch), whose `metadata`
+# is a list of the metadata of the events it covers
+BATCHES = "batches"
+# no records at all
+NONE = "none"
+
+RESPONSE_MODES = (EVENTS, ERRORS, BATCHES, NONE)
+
+
+def succeeded(status_code, error):
+    '''returns true if an event with this outcome was accepted'''
+    return error is None and status_code is not None and 200 <= status_code < 300
+
+
+class ResponseReporter():
+    '''ResponseReporter hands response records to `responses`, a queue, or,
+    if given, to `callback`, which is called with each record on the thread
+    that produced it (for Transmission, the sender threads). A callback should
+    return quickly; anything it raises is ignored.
+
+    `mode` is one of RESPONSE_MODES. In "events" mode, the default, records
+    are the dicts libhoney has always put on the responses queue. "errors"
+    mode sends the same dicts, but only for events that failed. "batches"
+    mode sends one record for all the events in a batch that had the same
+    outcome, with a list of their metadata in place of a single `metadata`.
+    "none" skips building records entirely.'''
+
+    def __init__(self, responses, mode=EVENTS, callback=None, block=False):
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"unknown response_mode: {mode}")
+        self.responses = responses
+        self.mode = mode
+        self.callback = callback
+        self.block = block
+        # true if successfully sent events are reported at all, so callers
+        # can skip collecting them
+        self.wants_successes = mode in (EVENTS, BATCHES)
+
+    def report(self, status_code, error, start, metadata):
+        '''reports the outcome of sending the events whose metadata is listed
+        in `metadata`. `start` is the time.time() the send began, or None if
+        it never did.'''
+        mode = self.mode
+        if mode == NONE or not metadata:
+            return
+        if mode == ERRORS and succeeded(status_code, error):
+            return
+        duration = 0
+        if start is not None:
+            duration = (time.time() - start) * 1000
+        if mode == BATCHES:
+            self._deliver({
+                "status_code": status_code,
+                "body": "",
+                "error": error,
+                "duration": duration,
+                "metadata": list(metadata),
+            })
+            return
+        for md in metadata:
+            self._deliver({
+                "status_code": status_code,
+                "body": "",
+                "error": error,
+                "duration": duration,
+                "metadata": md,
+            })
+
+    def sampled(self, metadata):
+        '''reports an event dropped by sampling. That isn't a failure, so it
+        isn't reported in "errors" mode.'''
+        if self.mode == ERRORS:
+            return
+        self.report(0, "event dropped due to sampling", None, [metadata])
+
+    def _deliver(self, record):
+        if self.callback is not None:
+            try:
+                self.callback(record)
+            except Exception:
+                pass
+            return
+        if self.block:
+            self.responses.put(record)
+            return
+        try:
+            self.responses.put_nowait(record)
+        except queue.Full:
+            pass
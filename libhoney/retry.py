@@ -0,0 +1,102 @@
+'''retry holds the pieces Transmission uses to resend failed events'''
+import datetime
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+
+# batch or per-event statuses worth trying again
+RETRYABLE_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    '''returns a delay in seconds before retry number `attempt` (counting
+    from 0), using exponential backoff with full jitter: a random value
+    between 0 and base_delay * 2 ** attempt, capped at max_delay.'''
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    '''parses a Retry-After header, given either as a number of seconds or
+    as an HTTP date, into a number of seconds. Returns None if the header is
+    missing or malformed.'''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+class RetryBudget():
+    '''RetryBudget limits retries to a fraction of the fresh traffic sent to a
+    destination, so retries can never crowd it out.
+
+    Every fresh event sent earns `ratio` tokens and every retried event costs
+    one. The balance starts at, and is capped at, `reserve` tokens, which
+    lets a quiet destination retry an occasional failure.'''
+
+    def __init__(self, ratio=0.1, reserve=100):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self, events):
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + events * self.ratio)
+
+    def withdraw(self, events):
+        '''returns how many of `events` retries the budget allows, and
+        charges for them'''
+        with self._lock:
+            granted = min(events, int(self._tokens))
+            self._tokens -= granted
+            return granted
+
+
+class RetryQueue():
+    '''RetryQueue holds work that is due at a later time. It is safe to push
+    from any thread.'''
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, due, item):
+        with self._lock:
+            # the counter keeps items with equal due times in push order and
+            # means the items themselves are never compared
+            heapq.heappush(self._heap, (due, next(self._counter), item))
+
+    def next_due(self):
+        '''returns the due time of the earliest item, or None if empty'''
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        '''removes and returns every item due at or before `now`'''
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def pop_all(self):
+        with self._lock:
+            items = [entry[2] for entry in sorted(self._heap)]
+            self._heap = []
+        return items
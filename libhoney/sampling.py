@@ -0,0 +1,385 @@
+'''sampling holds samplers, which decide per event whether to send it and
+at what sample rate.
+
+Every sampler has the same small interface: `sample(event)` returns a pair
+`(keep, rate)`. `Event.send` drops the event unless `keep` is true, and
+otherwise sends it with its `sample_rate` set to `rate`, so Honeycomb
+counts it as `rate` events.
+
+Samplers are safe to use from several threads at once.'''
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+
+
+class Sampler():
+    '''Sampler is the base for samplers that choose a rate for each event
+    with `rate(event)` and then keep one event in `rate` at random.'''
+
+    def rate(self, event):
+        raise NotImplementedError
+
+    def sample(self, event):
+        rate = self.rate(event)
+        return rate <= 1 or random.randint(1, rate) == 1, rate
+
+
+# the largest value of the 32 bit hash prefix DeterministicSampler compares
+_MAX_UINT32 = 2 ** 32 - 1
+
+
+def deterministic_keep(value, rate):
+    '''returns true if the event with key `value` should be kept at sample
+    rate `rate`. The first four bytes of the SHA1 of the key, as a big
+    endian unsigned int, must not be above 2**32-1 / rate. This is the
+    algorithm the Honeycomb beelines and OpenTelemetry samplers use, so
+    they all keep or drop the same traces.'''
+    if rate <= 1:
+        return True
+    if not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    (prefix,) = struct.unpack_from(">I", hashlib.sha1(value).digest())
+    return prefix <= _MAX_UINT32 / rate
+
+
+class DeterministicSampler():
+    '''DeterministicSampler keeps or drops events by a hash of the value of
+    `key_field`, so that every event with the same value, such as all the
+    spans of one trace, gets the same decision in any process, and in any
+    SDK using the same algorithm (see `deterministic_keep`).
+
+    Events are sampled at `sample_rate`, or at their own `sample_rate` if
+    it is None. Events without the field are sampled at random.'''
+
+    def __init__(self, key_field="trace.trace_id", sample_rate=None):
+        self.key_field = key_field
+        self.sample_rate = sample_rate
+
+    def sample(self, event):
+        rate = self.sample_rate
+        if rate is None:
+            rate = event.sample_rate
+        value = event.fields().get(self.key_field)
+        if value is None:
+            return rate <= 1 or random.randint(1, rate) == 1, rate
+        return deterministic_keep(value, rate), rate
+
+
+def key_function(key_fields=(), key=None):
+    '''returns a function from an event to its sampling key: `key` itself
+    if given, or else the value of the single field in `key_fields`, or a
+    tuple of the values of several'''
+    if key is not None:
+        return key
+    key_fields = tuple(key_fields)
+    if len(key_fields) == 1:
+        name = key_fields[0]
+        return lambda ev: ev.fields().get(name)
+    return lambda ev: tuple(map(ev.fields().get, key_fields))
+
+
+def goal_rates(counts, goal_rate):
+    '''returns a sample rate for each key in `counts`, a dict of how many
+    events each key had, that keeps about 1 / `goal_rate` of the events
+    overall. Keys get a share of the kept events by the log of their count,
+    so rare keys are kept at or near a rate of 1 while the most common ones
+    take most of the sampling.'''
+    total = sum(counts.values())
+    log_sum = sum(math.log10(c) for c in counts.values() if c > 1)
+    if log_sum == 0:
+        return {k: 1 for k in counts}
+    goal_ratio = (total / goal_rate) / log_sum
+
+    rates = {}
+    # what rarer keys didn't use of their share is passed on to the
+    # commoner ones
+    extra = 0.0
+    remaining = len(counts)
+    for k, count in sorted(counts.items(), key=lambda kv: kv[1]):
+        count = max(1, count)
+        goal = max(1, math.log10(count) * goal_ratio)
+        share = extra / remaining
+        goal += share
+        extra -= share
+        remaining -= 1
+        if count <= goal:
+            rates[k] = 1
+            extra += goal - count
+        else:
+            rate = math.ceil(count / goal)
+            extra += goal - count / rate
+            rates[k] = rate
+    return rates
+
+
+class _WindowedSampler(Sampler):
+    '''_WindowedSampler counts the events of each key over a window of
+    `window` seconds, and at the end of each recomputes the keys' rates
+    from the counts and the window's actual length with `_rates_for`. Keys seen for the first time are sent
+    at a rate of 1 until then. At most `max_keys` keys are counted per
+    window.
+
+    The rates are recomputed by the first event after a window ends, so
+    there is no extra thread.'''
+
+    def __init__(self, key_fields=(), key=None, window=30.0, max_keys=500):
+        self.window = window
+        self.max_keys = max_keys
+        self._key = key_function(key_fields, key)
+        self._counts = {}
+        self._rates = {}
+        self._window_started = time.monotonic()
+        self._window_ends = self._window_started + window
+        self._lock = threading.Lock()
+
+    def rate(self, event):
+        key = self._key(event)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._window_ends:
+                self._rates = self._rates_for(self._counts, now - self._window_started)
+                self._counts = {}
+                self._window_started = now
+                self._window_ends = now + self.window
+            counts = self._counts
+            if key in counts:
+                counts[key] += 1
+            elif len(counts) < self.max_keys:
+                counts[key] = 1
+            return self._rates.get(key, 1)
+
+    def rates(self):
+        '''returns the current rate of each key'''
+        with self._lock:
+            return dict(self._rates)
+
+    def _rates_for(self, counts, elapsed):
+        raise NotImplementedError
+
+
+class AvgSampleRate(_WindowedSampler):
+    '''AvgSampleRate keeps about 1 / `goal_rate` of all events, sampling
+    common keys heavily and rare ones lightly or not at all, using the
+    counts from the previous window. Keys come from `key_fields`, or from
+    `key`, a function of the event: for example, an event's route and status
+    code with `key_fields=("route", "status_code")`.'''
+
+    def __init__(self, goal_rate=10, key_fields=(), key=None, window=30.0, max_keys=500):
+        super().__init__(key_fields, key, window, max_keys)
+        self.goal_rate = goal_rate
+
+    def _rates_for(self, counts, elapsed):
+        return goal_rates(counts, self.goal_rate)
+
+
+class EMASampleRate(_WindowedSampler):
+    '''EMASampleRate is like AvgSampleRate, but computes rates from an
+    exponential moving average of each key's counts over past windows
+    rather than from the last window only, so that rates change smoothly
+    and a short burst doesn't swing them. Each window's counts have a
+    weight of `weight`. Keys whose average falls below `age_out` are
+    forgotten.'''
+
+    def __init__(self, goal_rate=10, key_fields=(), key=None, window=15.0, max_keys=500,
+                 weight=0.5, age_out=0.5):
+        super().__init__(key_fields, key, window, max_keys)
+        self.goal_rate = goal_rate
+        self.weight = weight
+        self.age_out = age_out
+        self._averages = {}
+
+    def _rates_for(self, counts, elapsed):
+        self._averages = _moving_averages(self._averages, counts, self.weight, self.age_out)
+        return goal_rates(self._averages, self.goal_rate)
+
+
+class ThroughputSampler(_WindowedSampler):
+    '''ThroughputSampler holds the events sent for each key to about
+    `goal_throughput` per second, by default keying events by their
+    dataset. Each window it measures each key's arrival rate, averaged
+    over past windows as EMASampleRate does, and samples the key at the
+    lowest rate that brings it down to the goal. Quiet keys are sent at a
+    rate of 1.'''
+
+    def __init__(self, goal_throughput=100, key_fields=(), key=None, window=2.0, max_keys=500,
+                 weight=0.5):
+        if key is None and not key_fields:
+            key = _dataset
+        super().__init__(key_fields, key, window, max_keys)
+        self.goal_throughput = goal_throughput
+        self.weight = weight
+        self._averages = {}
+
+    def _rates_for(self, counts, elapsed):
+        per_second = {k: count / elapsed for k, count in counts.items()} if elapsed > 0 else {}
+        # forget keys that have fallen below an event per 100 seconds
+        self._averages = _moving_averages(self._averages, per_second, self.weight, 0.01)
+        return {k: max(1, math.ceil(avg / self.goal_throughput))
+                for k, avg in self._averages.items()}
+
+
+# a field missing from an event
+_MISSING = object()
+
+# the operators RulesSampler understands
+OPERATORS = ("=", "!=", ">", ">=", "<", "<=", "in", "exists", "not-exists",
+             "starts-with", "contains", "does-not-contain", "matches")
+
+# operators that only hold for fields whose values are strings, as Python
+# expressions testing the field `f` against the rule's value `c`
+_STRING_TESTS = {
+    "starts-with": "{f}.startswith({c})",
+    "contains": "{c} in {f}",
+    "does-not-contain": "{c} not in {f}",
+    "matches": "{c}({f}) is not None",
+}
+
+
+class RulesSampler(Sampler):
+    '''RulesSampler samples each event at the rate of the first of `rules`
+    that matches it, or at `default_rate` if none does. For example, to
+    keep every server error, one in fifty health checks and one in ten of
+    everything else:
+
+        RulesSampler([
+            {"conditions": [{"field": "status_code", "operator": ">=", "value": 500}],
+             "sample_rate": 1},
+            {"conditions": [{"field": "route", "operator": "=", "value": "/healthz"}],
+             "sample_rate": 50},
+        ], default_rate=10)
+
+    A rule matches when all its `conditions` do; a rule without conditions
+    matches everything. Each condition tests a `field` with one of the
+    `OPERATORS`; all but "exists" and "not-exists" take a `value`. The
+    ordering operators compare numbers with numbers and strings with
+    strings, and fail for fields of any other type. The string operators,
+    including "matches", a regular expression search, fail for fields that
+    aren't strings. Rules may have a `name`, used in error messages.
+
+    The rules are checked when the sampler is created, and compiled into a
+    single function that looks up each field once and tests the rules in
+    turn, so bad rules raise ValueError up front and deciding on an event
+    costs little more than the comparisons themselves.'''
+
+    def __init__(self, rules, default_rate=1):
+        self.rules = list(rules)
+        self.default_rate = _check_rate(default_rate, "default_rate")
+        self._decide = _compile_rules(self.rules, self.default_rate)
+
+    @classmethod
+    def from_config(cls, config):
+        '''returns a RulesSampler from a dict with `rules` and optionally
+        `default_rate`, or from the name of a JSON file holding one'''
+        if isinstance(config, str):
+            with open(config, encoding="utf-8") as f:
+                config = json.load(f)
+        return cls(config.get("rules", ()), config.get("default_rate", 1))
+
+    def rate(self, event):
+        return self._decide(event.fields())
+
+
+def _check_rate(rate, what):
+    if rate.__class__ is not int or rate < 1:
+        raise ValueError(f"{what} must be a whole number of at least 1, not {rate!r}")
+    return rate
+
+
+def _compile_rules(rules, default_rate):
+    '''returns a function from an event's data to its sample rate under
+    `rules`. The rules become the body of the function's source, with the
+    fields and values they refer to bound as variables.'''
+    namespace = {"_MISSING": _MISSING, "_NUMBERS": (int, float), "_is_in": _is_in}
+    fields = {}
+    body = []
+
+    def constant(value):
+        name = f"c{len(namespace)}"
+        namespace[name] = value
+        return name
+
+    for i, rule in enumerate(rules):
+        name = rule.get("name", f"rule {i}")
+        rate = _check_rate(rule.get("sample_rate"), f"sample_rate of {name}")
+        tests = []
+        for cond in rule.get("conditions", ()):
+            if "field" not in cond:
+                raise ValueError(f"condition without a field in {name}")
+            field = cond["field"]
+            if field not in fields:
+                fields[field] = f"f{len(fields)}"
+            tests.append(_condition(name, cond, fields[field], constant))
+        body.append(f"    if {' and '.join(tests) or 'True'}:")
+        body.append(f"        return {rate}")
+
+    lookups = [f"    {var} = get({constant(field)}, _MISSING)" for field, var in fields.items()]
+    source = "\n".join(["def decide(data):", "    get = data.get"] + lookups + body +
+                       [f"    return {default_rate}", ""])
+    exec(compile(source, "<RulesSampler>", "exec"), namespace)  # pylint: disable=exec-used
+    return namespace["decide"]
+
+
+def _condition(name, cond, f, constant):
+    '''returns a Python expression for condition `cond` of rule `name`,
+    testing the field in variable `f`'''
+    op = cond.get("operator", "=")
+    if op not in OPERATORS:
+        raise ValueError(f"unknown operator in {name}: {op}")
+    if op == "exists":
+        return f"{f} is not _MISSING"
+    if op == "not-exists":
+        return f"{f} is _MISSING"
+    if "value" not in cond:
+        raise ValueError(f"condition on {cond['field']} without a value in {name}")
+    value = cond["value"]
+    try:
+        if op == "=":
+            return f"{f} == {constant(value)}"
+        if op == "!=":
+            return f"{f} != {constant(value)}"
+        if op == "in":
+            if isinstance(value, (str, bytes)):
+                # which would be taken as a set of characters
+                raise TypeError("expected a list of values, not a string")
+            return f"_is_in({f}, {constant(frozenset(value))})"
+        if op == "matches":
+            return f"({f}.__class__ is str and {constant(re.compile(value).search)}({f}) is not None)"
+        if op in _STRING_TESTS:
+            if not isinstance(value, str):
+                raise TypeError("expected a string")
+            return f"({f}.__class__ is str and {_STRING_TESTS[op].format(f=f, c=constant(value))})"
+    except (re.error, TypeError) as e:
+        raise ValueError(f"bad value for {cond['field']} in {name}: {e}") from None
+    if value.__class__ in (int, float):
+        return f"({f}.__class__ in _NUMBERS and {f} {op} {constant(value)})"
+    if value.__class__ is str:
+        return f"({f}.__class__ is str and {f} {op} {constant(value)})"
+    raise ValueError(f"bad value for {cond['field']} in {name}: {op} needs a number or a string")
+
+
+def _is_in(found, values):
+    try:
+        return found in values
+    except TypeError:
+        # unhashable
+        return False
+
+
+def _dataset(event):
+    return event.dataset
+
+
+def _moving_averages(averages, values, weight, age_out):
+    '''returns `averages` updated with this window's `values`, leaving out
+    any that fall below `age_out`'''
+    updated = {}
+    for k in set(averages) | set(values):
+        avg = weight * values.get(k, 0) + (1 - weight) * averages.get(k, 0)
+        if avg >= age_out:
+            updated[k] = avg
+    return updated
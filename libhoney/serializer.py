@@ -0,0 +1,199 @@
+'''serializer encodes event payloads, as JSON using the fastest encoder that
+is installed, or as MessagePack'''
+import json
+import struct
+
+from libhoney.internal import json_default_handler
+
+try:
+    import orjson
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
+try:
+    import msgspec
+    has_msgspec = True
+except ImportError:
+    has_msgspec = False
+
+try:
+    import msgpack
+    has_msgpack = True
+except ImportError:
+    has_msgpack = False
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+class JSONSerializer():
+    '''JSONSerializer encodes with the standard library's json module, without
+    the whitespace it adds by default. Values json can't encode are passed
+    through `json_default_handler`.
+
+    Every serializer also describes how its events are framed into a batch
+    body; see `libhoney.encoding.iter_batch`.'''
+    name = "json"
+    content_type = JSON_CONTENT_TYPE
+    # event times are given to dumps as RFC3339 strings rather than datetimes
+    native_datetimes = False
+    batch_separator = b","
+    batch_footer = b"]"
+
+    def batch_header(self, count):  # pylint: disable=unused-argument
+        return b"["
+
+    def dumps(self, obj):
+        '''returns the JSON encoding of obj as bytes'''
+        return json.dumps(obj, default=json_default_handler,
+                          separators=(",", ":")).encode()
+
+
+class OrjsonSerializer(JSONSerializer):
+    '''OrjsonSerializer encodes with orjson. datetimes, dates, times and
+    dataclasses are handed to `json_default_handler` just as the json module
+    would, so they encode the same way. Anything orjson refuses outright, such
+    as an integer wider than 64 bits, is encoded with the json module instead.
+
+    Unlike the json module, orjson encodes NaN and infinity as null and enum
+    members by their value.'''
+    # pylint can't see into orjson's compiled module
+    # pylint: disable=no-member
+    name = "orjson"
+
+    def __init__(self):
+        self._option = (orjson.OPT_NON_STR_KEYS |
+                        orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj, default=json_default_handler, option=self._option)
+        except TypeError:
+            # orjson.JSONEncodeError is a TypeError
+            return super().dumps(obj)
+
+
+class MsgspecSerializer(JSONSerializer):
+    '''MsgspecSerializer encodes with msgspec. Types msgspec doesn't support
+    are passed through `json_default_handler`, but msgspec has its own
+    encodings for some that the json module doesn't support, such as
+    datetimes, dataclasses and Decimals. Anything msgspec refuses outright is
+    encoded with the json module instead.'''
+    name = "msgspec"
+
+    def __init__(self):
+        self._encoder = msgspec.json.Encoder(enc_hook=json_default_handler)
+
+    def dumps(self, obj):
+        try:
+            return self._encoder.encode(obj)
+        except (TypeError, ValueError, OverflowError):
+            return super().dumps(obj)
+
+
+class MsgpackSerializer():
+    '''MsgpackSerializer encodes events as MessagePack, which the batch
+    endpoint accepts as application/msgpack. It requires the msgpack module.
+
+    Event times, and any datetime fields with a timezone, are encoded as
+    native msgpack timestamps. Values msgpack can't encode, naive datetimes
+    included, are passed through `json_default_handler`, and integers too
+    wide for msgpack are encoded as strings.'''
+    name = "msgpack"
+    content_type = MSGPACK_CONTENT_TYPE
+    native_datetimes = True
+    batch_separator = b""
+    batch_footer = b""
+
+    def __init__(self):
+        if not has_msgpack:
+            raise ImportError("the msgpack serializer requires msgpack, but it was not found.")
+
+    def dumps(self, obj):
+        try:
+            return msgpack.packb(obj, default=json_default_handler, datetime=True)
+        except (OverflowError, ValueError, TypeError):
+            return msgpack.packb(_narrow_ints(obj), default=json_default_handler, datetime=True)
+
+    def batch_header(self, count):
+        '''returns the msgpack array header for `count` items'''
+        return _msgpack_array_header(count)
+
+
+def _msgpack_array_header(count):
+    if count < 16:
+        return bytes((0x90 | count,))
+    if count < 0x10000:
+        return b"\xdc" + struct.pack(">H", count)
+    return b"\xdd" + struct.pack(">I", count)
+
+
+def _narrow_ints(obj):
+    '''returns a copy of obj with any integer msgpack can't hold replaced by
+    its string form'''
+    if isinstance(obj, dict):
+        return {k: _narrow_ints(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_narrow_ints(v) for v in obj]
+    if isinstance(obj, int) and not -2 ** 63 <= obj < 2 ** 64:
+        return str(obj)
+    return obj
+
+
+def parse_batch_response(content_type, body):
+    '''decodes the body of a batch response, which is JSON or, in reply to a
+    msgpack request, may be msgpack'''
+    if content_type and content_type.split(";")[0].strip() in (
+            MSGPACK_CONTENT_TYPE, "application/x-msgpack"):
+        if not has_msgpack:
+            raise ImportError("decoding a msgpack response requires msgpack, but it was not found.")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def available_serializers():
+    '''returns the names of the JSON serializers that can be used here,
+    fastest first'''
+    names = []
+    if has_orjson:
+        names.append(OrjsonSerializer.name)
+    if has_msgspec:
+        names.append(MsgspecSerializer.name)
+    names.append(JSONSerializer.name)
+    return names
+
+
+def get_serializer(serializer=None):
+    '''returns a serializer. `serializer` may be the name of one ("orjson",
+    "msgspec", "json" or "msgpack"), a serializer object, which is returned as
+    is, or None for the fastest JSON serializer installed.'''
+    if serializer is None:
+        serializer = available_serializers()[0]
+    if not isinstance(serializer, str):
+        return serializer
+    if serializer == OrjsonSerializer.name:
+        if not has_orjson:
+            raise ImportError("the orjson serializer requires orjson, but it was not found.")
+        return OrjsonSerializer()
+    if serializer == MsgspecSerializer.name:
+        if not has_msgspec:
+            raise ImportError("the msgspec serializer requires msgspec, but it was not found.")
+        return MsgspecSerializer()
+    if serializer == JSONSerializer.name:
+        return JSONSerializer()
+    if serializer == MsgpackSerializer.name:
+        return MsgpackSerializer()
+    raise ValueError(f"unknown serializer: {serializer}")
+
+
+_default = None
+
+
+def default_serializer():
+    '''returns a shared instance of the fastest serializer installed'''
+    global _default  # pylint: disable=global-statement
+    if _default is None:
+        _default = get_serializer()
+    return _default
@@ -0,0 +1,216 @@
+'''spool keeps batches on local disk while they cannot be queued or sent'''
+import logging
+import os
+import struct
+import threading
+import zlib
+
+_MAGIC = b"HSP1"
+# magic, body length, crc32 of body
+_HEADER = struct.Struct("<4sII")
+_LENGTH = struct.Struct("<I")
+_SUFFIX = ".spool"
+
+log = logging.getLogger(__name__)
+
+
+class Spool():
+    '''Spool is an append-only store of encoded batches in a local directory.
+
+    Records are appended to segment files through a large write buffer, and
+    every record carries a CRC32 of its contents. A segment is sealed once it
+    reaches `segment_bytes` and is deleted after every record in it has been
+    read. The reader can also catch up with the segment being written, which
+    is then deleted without being sealed. Segments left behind by an earlier
+    process are picked up when the spool is created. Reading stops at the
+    first damaged record in a segment, such as one cut short by a crash, and
+    skips the rest of that segment.
+
+    `append` refuses records once the segments on disk would exceed
+    `max_bytes`. Records are delivered at least once: a segment that was
+    being read when the process died is read again from the start.
+
+    A spool directory must only be used by one process at a time. It is
+    created readable by its owner only, as are the segments, since records
+    carry write keys.'''
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024,
+                 segment_bytes=4 * 1024 * 1024):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+        self._lock = threading.Lock()
+        self._sealed = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith(_SUFFIX))
+        self._bytes = sum(os.path.getsize(path) for path in self._sealed)
+        self._next_seq = 0
+        if self._sealed:
+            self._next_seq = int(os.path.basename(
+                self._sealed[-1])[:-len(_SUFFIX)]) + 1
+
+        self._writer = None
+        self._writer_path = None
+        self._writer_bytes = 0
+        self._dirty = False
+        self._reader = None
+        self._reader_end = None
+        self._read_offset = 0
+
+    def size(self):
+        '''returns the number of bytes the spool holds on disk'''
+        return self._bytes
+
+    def append(self, destination, payloads):
+        '''appends a batch of encoded events for `destination`, a
+        (writekey, dataset, api_host) tuple. Returns False, leaving the spool
+        unchanged, if the record would take the spool over max_bytes.'''
+        record = _encode_record(destination, payloads)
+        with self._lock:
+            if self._bytes + len(record) > self.max_bytes:
+                return False
+            if self._writer is None:
+                self._open_writer()
+            self._writer.write(record)
+            self._dirty = True
+            self._writer_bytes += len(record)
+            self._bytes += len(record)
+            if self._writer_bytes >= self.segment_bytes:
+                self._seal()
+        return True
+
+    def pop(self):
+        '''removes and returns the oldest record as a (destination, payloads)
+        pair, or None if the spool is empty'''
+        with self._lock:
+            while True:
+                if self._reader is None:
+                    if self._sealed:
+                        path = self._sealed[0]
+                    elif self._writer_bytes:
+                        path = self._writer_path
+                    else:
+                        return None
+                    # closed in _finish_segment or close
+                    self._reader = open(path, "rb")  # pylint: disable=consider-using-with
+                    self._reader.seek(self._read_offset)
+                    self._reader_end = None
+                live = not self._sealed
+                if live:
+                    # the reader has caught up with the writer, whose
+                    # buffered records must reach the file to be read
+                    self._writer.flush()
+                    end = self._writer_bytes
+                else:
+                    if self._reader_end is None:
+                        self._reader_end = os.path.getsize(self._sealed[0])
+                    end = self._reader_end
+                record = self._read_record()
+                if record is None or self._reader.tell() >= end:
+                    # release the disk space as soon as a segment is used up
+                    self._finish_segment(live)
+                if record is not None:
+                    return record
+
+    def flush(self):
+        '''writes any buffered records through to disk'''
+        with self._lock:
+            if self._dirty:
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+                self._dirty = False
+
+    def close(self):
+        '''seals the segment being written and closes all files. The spool
+        can still be used afterwards.'''
+        with self._lock:
+            if self._writer is not None:
+                self._seal()
+            if self._reader is not None:
+                # pick up from the same record if the spool is used again
+                self._read_offset = self._reader.tell()
+                self._reader.close()
+                self._reader = None
+
+    def _open_writer(self):
+        self._writer_path = os.path.join(
+            self.directory, f"{self._next_seq:020d}{_SUFFIX}")
+        self._next_seq += 1
+        # segments hold write keys, so only the owner may read them
+        fd = os.open(self._writer_path,
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        # closed in _seal or _finish_segment
+        self._writer = os.fdopen(fd, "ab", buffering=256 * 1024)  # pylint: disable=consider-using-with
+        self._writer_bytes = 0
+
+    def _seal(self):
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._dirty = False
+        self._sealed.append(self._writer_path)
+        self._writer = None
+        self._writer_path = None
+        self._writer_bytes = 0
+
+    def _read_record(self):
+        header = self._reader.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        magic, length, crc = _HEADER.unpack(header)
+        body = self._reader.read(length) if magic == _MAGIC else b""
+        if len(body) != length or zlib.crc32(body) != crc:
+            log.warning("skipping damaged spool segment %s from offset %d",
+                        self._reader.name, self._reader.tell())
+            return None
+        return _decode_record(body)
+
+    def _finish_segment(self, live):
+        self._reader.close()
+        self._reader = None
+        self._read_offset = 0
+        if live:
+            # everything written has been read, so the segment can go without
+            # ever being synced
+            path = self._writer_path
+            self._writer.close()
+            self._writer = None
+            self._writer_path = None
+            self._writer_bytes = 0
+            self._dirty = False
+        else:
+            path = self._sealed.pop(0)
+        self._bytes -= os.path.getsize(path)
+        os.remove(path)
+
+
+def _encode_record(destination, payloads):
+    parts = []
+    for field in destination:
+        field = (field or "").encode()
+        parts.append(_LENGTH.pack(len(field)))
+        parts.append(field)
+    parts.append(_LENGTH.pack(len(payloads)))
+    for payload in payloads:
+        parts.append(_LENGTH.pack(len(payload)))
+        parts.append(payload)
+    body = b"".join(parts)
+    return _HEADER.pack(_MAGIC, len(body), zlib.crc32(body)) + body
+
+
+def _decode_record(body):
+    view = memoryview(body)
+    offset = 0
+
+    def take():
+        nonlocal offset
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size + length
+        return bytes(view[offset - length:offset])
+
+    destination = tuple(take().decode() for _ in range(3))
+    (count,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    return destination, [take() for _ in range(count)]
@@ -0,0 +1,233 @@
+'''tail holds TailSampler, which buffers the events of each trace and
+samples the trace as a whole once it is complete'''
+import collections
+import os
+import threading
+import time
+import weakref
+
+from libhoney.metrics import Metrics
+from libhoney.sampling import deterministic_keep
+
+
+def keep_errors(rate=10, error_field="error", status_field="status_code"):
+    '''returns a policy that keeps every trace with an event that has an
+    `error_field`, or a `status_field` of 500 or more, and samples the
+    other traces at `rate`'''
+    def policy(events):
+        for ev in events:
+            data = ev.fields()
+            if data.get(error_field) is not None:
+                return 1
+            status = data.get(status_field)
+            if status.__class__ is int and status >= 500:
+                return 1
+        return rate
+    return policy
+
+
+class TailSampler():
+    '''TailSampler sits between a Client and its transmission, and holds
+    back the events of each trace until the trace is complete: when its
+    root event, the one without a `parent_field`, is sent, or when no event
+    has been added to it for `trace_timeout` seconds. `policy` is then
+    called with the trace's events and returns a sample rate for the whole
+    trace, or 0 to drop it. The trace is kept or dropped by a hash of its
+    id, as DeterministicSampler does, and all its events go on with their
+    `sample_rate` multiplied by that rate, so that events already sampled
+    when they were sent keep counting for as many as they stood for. Events
+    that arrive after their trace was decided follow the same decision.
+    Events without a `trace_field` are sent right away.
+
+    The buffer holds at most `max_traces` traces and `max_events` events.
+    When it is full, the least recently active trace is decided early with
+    the events it has. `stats()` counts those, and everything else the
+    sampler does.
+
+    Pass a TailSampler to a Client as `tail_sampler`; the client starts and
+    closes it. A background thread decides timed out traces.'''
+
+    def __init__(self, policy=None, trace_field="trace.trace_id",
+                 parent_field="trace.parent_id", trace_timeout=30.0,
+                 max_traces=10000, max_events=100000):
+        self.policy = policy or keep_errors()
+        self.trace_field = trace_field
+        self.parent_field = parent_field
+        self.trace_timeout = trace_timeout
+        self.max_traces = max_traces
+        self.max_events = max_events
+        self.metrics = Metrics()
+        self.metrics.gauge("buffered_traces", lambda: len(self._traces))
+        self.metrics.gauge("buffered_events", lambda: self._events)
+        self._send = None
+        self._drop = None
+        # trace id to [events, last time one was added], least recently
+        # active first, which is also the order they time out in
+        self._traces = collections.OrderedDict()
+        self._events = 0
+        # trace id to the rate it was kept at, or 0, for recent traces
+        self._decided = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        _live_samplers.add(self)
+
+    def start(self, send, drop):
+        '''starts deciding traces, calling `send` with each event to keep
+        and `drop` with each one to drop'''
+        self._send = send
+        self._drop = drop
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, event):
+        data = event.fields()
+        trace_id = data.get(self.trace_field)
+        if trace_id is None:
+            self.metrics.incr("untraced_events")
+            self._send(event)
+            return
+        now = time.monotonic()
+        decided = ()
+        with self._cond:
+            rate = self._decided.get(trace_id)
+            if rate is None:
+                decided = self._buffer(trace_id, event, data.get(self.parent_field) is None, now)
+        if rate is not None:
+            self.metrics.incr("late_events")
+            self._release([event], rate)
+            return
+        for events, rate in decided:
+            self._release(events, rate)
+
+    def flush(self):
+        '''decides every buffered trace now'''
+        with self._cond:
+            decided = [self._decide(trace_id) for trace_id in list(self._traces)]
+        for events, rate in decided:
+            self._release(events, rate)
+
+    def close(self):
+        '''decides every buffered trace and stops the background thread'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        '''returns what the sampler has done: how many traces and events it
+        kept and dropped, how many traces were decided early because the
+        buffer was full ("evicted_traces") or timed out without a root
+        ("expired_traces"), how many events arrived after their trace was
+        decided or had no trace id, and how much is buffered now'''
+        stats = {name: 0 for name in (
+            "kept_traces", "dropped_traces", "kept_events", "dropped_events",
+            "evicted_traces", "expired_traces", "late_events", "untraced_events")}
+        stats.update(self.metrics.counters())
+        stats.update(self.metrics.gauges())
+        return stats
+
+    def _buffer(self, trace_id, event, is_root, now):
+        # called with the lock held; returns the traces decided as a result
+        trace = self._traces.get(trace_id)
+        if trace is None:
+            trace = self._traces[trace_id] = [[], now]
+            if len(self._traces) == 1:
+                # the thread may be waiting without a deadline
+                self._cond.notify()
+        else:
+            self._traces.move_to_end(trace_id)
+            trace[1] = now
+        trace[0].append(event)
+        self._events += 1
+
+        decided = []
+        if is_root:
+            decided.append(self._decide(trace_id))
+        while self._traces and (len(self._traces) > self.max_traces or self._events > self.max_events):
+            self.metrics.incr("evicted_traces")
+            decided.append(self._decide(next(iter(self._traces))))
+        return decided
+
+    def _decide(self, trace_id):
+        # called with the lock held
+        events, _ = self._traces.pop(trace_id)
+        self._events -= len(events)
+        rate = self.policy(events)
+        if not rate or not deterministic_keep(trace_id, rate):
+            rate = 0
+        self._decided[trace_id] = rate
+        if len(self._decided) > self.max_traces:
+            self._decided.popitem(last=False)
+        if rate:
+            self.metrics.incr("kept_traces")
+        else:
+            self.metrics.incr("dropped_traces")
+        return events, rate
+
+    def _release(self, events, rate):
+        if not rate:
+            self.metrics.incr("dropped_events", len(events))
+            for ev in events:
+                self._drop(ev)
+            return
+        self.metrics.incr("kept_events", len(events))
+        for ev in events:
+            ev.sample_rate = ev.sample_rate * rate
+            self._send(ev)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                decided = self._expire(time.monotonic())
+                if not decided:
+                    self._cond.wait(self._until_next_timeout())
+                    continue
+            for events, rate in decided:
+                self._release(events, rate)
+
+    def _expire(self, now):
+        # called with the lock held
+        expired = []
+        for trace_id, (_, last_added) in self._traces.items():
+            if last_added + self.trace_timeout > now:
+                break
+            expired.append(trace_id)
+        if expired:
+            self.metrics.incr("expired_traces", len(expired))
+        return [self._decide(trace_id) for trace_id in expired]
+
+    def _until_next_timeout(self):
+        # called with the lock held; None if nothing is buffered
+        for _, last_added in self._traces.values():
+            return max(0, last_added + self.trace_timeout - time.monotonic())
+        return None
+
+    def _after_fork_in_child(self):
+        # the buffered traces are the parent's to decide
+        self._cond = threading.Condition()
+        self._traces = collections.OrderedDict()
+        self._events = 0
+        self.metrics._after_fork()
+        if self._thread is not None and not self._closed:
+            self.start(self._send, self._drop)
+
+
+# the background thread doesn't survive a fork, so the child gets a fresh
+# one. Samplers are tracked weakly so that this doesn't keep them alive.
+_live_samplers = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for s in list(_live_samplers):
+        s._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,67 @@
+'''Tests for libhoney/adaptive.py'''
+
+import unittest
+from unittest import mock
+
+from libhoney.adaptive import AIMDController
+
+
+class TestAIMDController(unittest.TestCase):
+    def test_starts_at_maximums(self):
+        c = AIMDController(max_concurrency=8, max_batch_size=200)
+        self.assertEqual(c.concurrency, 8)
+        self.assertEqual(c.batch_size, 200)
+
+    def test_additive_increase(self):
+        c = AIMDController(max_concurrency=8, max_batch_size=200,
+                           initial_concurrency=2, initial_batch_size=50)
+        for _ in range(4):
+            c.record(0.1, 200)
+        self.assertEqual(c.concurrency, 3)
+        self.assertEqual(c.batch_size, 90)
+        for _ in range(1000):
+            c.record(0.1, 200)
+        self.assertEqual(c.concurrency, 8)
+        self.assertEqual(c.batch_size, 200)
+
+    def test_multiplicative_decrease(self):
+        c = AIMDController(min_concurrency=1, max_concurrency=8,
+                           min_batch_size=10, max_batch_size=200)
+        c.record(0.1, 429)
+        self.assertEqual(c.concurrency, 4)
+        self.assertEqual(c.batch_size, 100)
+
+    def test_decrease_once_per_target_latency(self):
+        c = AIMDController(max_concurrency=8, max_batch_size=200, target_latency=1.0)
+        with mock.patch('libhoney.adaptive.time.monotonic') as m_time:
+            m_time.return_value = 100.0
+            c.record(0.1, 503)
+            c.record(0.1, 503)
+            self.assertEqual(c.concurrency, 4)
+            m_time.return_value = 101.5
+            c.record(0.1, 0)
+            self.assertEqual(c.concurrency, 2)
+
+    def test_slow_requests_push_back(self):
+        c = AIMDController(max_concurrency=8, target_latency=0.5)
+        c.record(2.0, 200)
+        self.assertEqual(c.concurrency, 4)
+
+    def test_bounds(self):
+        c = AIMDController(min_concurrency=2, max_concurrency=8,
+                           min_batch_size=50, max_batch_size=200, target_latency=0)
+        for _ in range(10):
+            c.record(0.1, 503)
+        self.assertEqual(c.concurrency, 2)
+        self.assertEqual(c.batch_size, 50)
+
+    def test_client_errors_are_ignored(self):
+        c = AIMDController(max_concurrency=8, initial_concurrency=4)
+        c.record(0.1, 400)
+        self.assertEqual(c.snapshot()["concurrency"], 4)
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            AIMDController(min_concurrency=5, max_concurrency=2)
+        with self.assertRaises(ValueError):
+            AIMDController(backoff=1.5)
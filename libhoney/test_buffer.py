@@ -0,0 +1,117 @@
+'''Tests for libhoney/buffer.py'''
+
+import queue
+import threading
+import time
+import unittest
+
+from libhoney.buffer import PendingBuffer
+
+
+class TestPendingBuffer(unittest.TestCase):
+    def test_drain_returns_everything_in_order(self):
+        b = PendingBuffer(maxsize=10)
+        for i in range(5):
+            b.put_nowait(i)
+        self.assertEqual(b.qsize(), 5)
+        self.assertEqual(b.drain(), [0, 1, 2, 3, 4])
+        self.assertTrue(b.empty())
+
+    def test_drain_times_out_when_empty(self):
+        b = PendingBuffer()
+        start = time.monotonic()
+        self.assertEqual(b.drain(0.05), [])
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_wake(self):
+        b = PendingBuffer()
+        consumer = threading.Thread(target=b.drain)
+        consumer.start()
+        time.sleep(0.05)
+        b.wake()
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+        # a wake before the consumer waits is not lost
+        b.wake()
+        start = time.monotonic()
+        self.assertEqual(b.drain(5), [])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_put_nowait_full(self):
+        b = PendingBuffer(maxsize=2)
+        b.put_nowait(1)
+        b.put(2)
+        with self.assertRaises(queue.Full):
+            b.put_nowait(3)
+        with self.assertRaises(queue.Full):
+            b.put(3, True, 0.01)
+
+    def test_drain_wakes_on_put(self):
+        b = PendingBuffer()
+        drained = []
+        consumer = threading.Thread(target=lambda: drained.extend(b.drain()))
+        consumer.start()
+        time.sleep(0.05)
+        b.put_nowait("ev")
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(drained, ["ev"])
+
+    def test_blocking_put_waits_for_drain(self):
+        b = PendingBuffer(maxsize=1)
+        b.put_nowait(1)
+        producer = threading.Thread(target=b.put, args=(2,))
+        producer.start()
+        time.sleep(0.05)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(b.drain(), [1])
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(b.drain(), [2])
+
+    def test_blocking_put_survives_losing_the_last_slot(self):
+        class RacingBuffer(PendingBuffer):
+            raced = False
+
+            def put_nowait(self, item):
+                if not self.raced:
+                    # another producer takes the last slot first
+                    self.raced = True
+                    super().put_nowait("other")
+                super().put_nowait(item)
+
+        b = RacingBuffer(maxsize=1)
+        producer = threading.Thread(target=b.put, args=("mine",))
+        producer.start()
+        time.sleep(0.05)
+        self.assertEqual(b.drain(), ["other"])
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(b.drain(), ["mine"])
+
+    def test_many_producers(self):
+        b = PendingBuffer(maxsize=100)
+        drained = []
+        done = threading.Event()
+
+        def consume():
+            while not done.is_set() or not b.empty():
+                drained.extend(b.drain(0.01))
+
+        def produce(n):
+            for i in range(1000):
+                b.put((n, i))
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        producers = [threading.Thread(target=produce, args=(n,)) for n in range(8)]
+        for p in producers:
+            p.start()
+        for p in producers:
+            p.join()
+        done.set()
+        consumer.join(5)
+        self.assertEqual(len(drained), 8000)
+        # each producer's events stay in order
+        for n in range(8):
+            self.assertEqual([i for m, i in drained if m == n], list(range(1000)))
@@ -18,7 +18,8 @@ class TestClient(unittest.TestCase):
 
         self.tx = mock.Mock()
         self.m_xmit = mock.patch('libhoney.client.Transmission')
-        self.m_xmit.start().return_value = self.tx
+        self.xmit_class = self.m_xmit.start()
+        self.xmit_class.return_value = self.tx
 
     def tearDown(self):
         self.m_xmit.stop()
@@ -210,6 +211,26 @@ class TestClient(unittest.TestCase):
         with client.Client(transmission_impl=mock_xmit) as c:
             self.assertEqual(c.xmit, mock_xmit)
 
+    def test_stats(self):
+        self.tx.stats.return_value = {"enqueued": 1, "dropped": {"overflow": 2, "error": 0}}
+        with mock.patch('libhoney.event._should_drop') as m_drop:
+            m_drop.return_value = True
+            with client.Client(writekey="mykey", dataset="something") as c:
+                c.new_event().send()
+                self.assertEqual(c.stats(), {
+                    "enqueued": 1, "dropped": {"overflow": 2, "error": 0, "sampling": 1}})
+
+        with client.Client(transmission_impl=mock.Mock(spec=["start", "close", "get_response_queue"])) as c:
+            self.assertEqual(c.stats(), {"dropped": {"sampling": 0}})
+
+    def test_stats_hook(self):
+        hook = mock.Mock()
+        self.tx.stats.return_value = {"enqueued": 5}
+        with client.Client(stats_hook=hook):
+            _, kwargs = self.xmit_class.call_args
+            kwargs["stats_hook"]({"enqueued": 5})
+        hook.assert_called_once_with({"enqueued": 5, "dropped": {"sampling": 0}})
+
     def test_is_classic_with_empty_key(self):
         self.assertEqual(IsClassicKey(""), True)
 
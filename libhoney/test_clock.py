@@ -0,0 +1,29 @@
+'''Tests for libhoney/clock.py'''
+import datetime
+import time
+import unittest
+
+from libhoney import clock
+
+
+class TestClock(unittest.TestCase):
+    def test_now_ns_tracks_the_wall_clock(self):
+        self.assertLess(abs(clock.now_ns() - time.time_ns()), 50000000)
+
+    def test_datetimes(self):
+        ns = 1451703845000006000
+        dt = datetime.datetime(2016, 1, 2, 3, 4, 5, 6)
+        self.assertEqual(clock.to_datetime(ns), dt)
+        self.assertEqual(clock.to_datetime(ns, datetime.timezone.utc),
+                         dt.replace(tzinfo=datetime.timezone.utc))
+        self.assertEqual(clock.from_datetime(dt), ns)
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        self.assertEqual(clock.from_datetime(datetime.datetime(2016, 1, 1, 22, 4, 5, 6, tzinfo=eastern)), ns)
+
+    def test_rfc3339(self):
+        self.assertEqual(clock.rfc3339(1451703845000006000), "2016-01-02T03:04:05.000006Z")
+        # same second, from the cache
+        self.assertEqual(clock.rfc3339(1451703845999999999), "2016-01-02T03:04:05.999999Z")
+        self.assertEqual(clock.rfc3339(1451703846000000000), "2016-01-02T03:04:06.000000Z")
+        dt = datetime.datetime(2021, 6, 7, 8, 9, 10, 123456)
+        self.assertEqual(clock.rfc3339(clock.from_datetime(dt)), dt.isoformat() + "Z")
@@ -0,0 +1,98 @@
+'''Tests for libhoney/compression.py'''
+
+import gzip
+import json
+import threading
+import unittest
+
+from libhoney import compression
+from libhoney.encoding import encode_batch
+
+PAYLOADS = [json.dumps({"data": {"key": i, "text": "hello " * 10}}).encode()
+            for i in range(100)]
+
+
+class TestCodecs(unittest.TestCase):
+    def test_none(self):
+        codec = compression.get_codec("none")
+        self.assertIsNone(codec.content_encoding)
+        self.assertIsNone(codec.compressobj())
+
+    def test_gzip(self):
+        codec = compression.get_codec("gzip", 6)
+        self.assertEqual(codec.level, 6)
+        self.assertEqual(codec.content_encoding, "gzip")
+        body = encode_batch(PAYLOADS, codec.compressobj())
+        self.assertEqual(len(json.loads(gzip.decompress(body))), 100)
+
+    @unittest.skipUnless(compression.has_zstd, "requires zstandard")
+    def test_zstd(self):
+        codec = compression.get_codec("zstd")
+        self.assertEqual(codec.content_encoding, "zstd")
+        body = encode_batch(PAYLOADS, codec.compressobj())
+        decompressed = compression.zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        self.assertEqual(len(json.loads(decompressed)), 100)
+
+    @unittest.skipUnless(compression.has_zstd, "requires zstandard")
+    def test_zstd_batches_are_independent(self):
+        def decompress(body):
+            return json.loads(compression.zstandard.ZstdDecompressor().decompressobj().decompress(body))
+
+        for codec in (compression.get_codec("zstd"),
+                      compression.AdaptiveCodec(codec="zstd", levels=(3,))):
+            # interleaved on one thread
+            first, second = codec.compressobj(), codec.compressobj()
+            out = {id(first): [], id(second): []}
+            for payload in PAYLOADS:
+                for c in (first, second):
+                    out[id(c)].append(c.compress(payload + b"\n"))
+            for c in (first, second):
+                body = b"".join(out[id(c)]) + c.flush()
+                lines = compression.zstandard.ZstdDecompressor().decompressobj().decompress(body)
+                self.assertEqual(lines.splitlines(), PAYLOADS)
+
+            # concurrently on several threads
+            results = []
+
+            def encode():
+                results.append(decompress(encode_batch(PAYLOADS, codec.compressobj())))
+
+            threads = [threading.Thread(target=encode) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(results), 8)
+            for batch in results:
+                self.assertEqual(len(batch), 100)
+
+    def test_get_codec(self):
+        codec = compression.GzipCodec()
+        self.assertIs(compression.get_codec(codec), codec)
+        self.assertIsInstance(compression.get_codec("adaptive"), compression.AdaptiveCodec)
+        with self.assertRaises(ValueError):
+            compression.get_codec("brotli")
+
+
+class TestAdaptiveCodec(unittest.TestCase):
+    def test_samples_each_level_in_turn(self):
+        codec = compression.AdaptiveCodec(codec="gzip", levels=(1, 9), sample_every=2)
+        for _ in range(4):
+            body = encode_batch(PAYLOADS, codec.compressobj())
+            self.assertEqual(len(json.loads(gzip.decompress(body))), 100)
+        stats = codec.stats()
+        self.assertEqual(sorted(stats), [1, 9])
+        self.assertLess(stats[9]["ratio"], 1)
+
+    def test_picks_best_ratio_within_budget(self):
+        codec = compression.AdaptiveCodec(codec="gzip", levels=(1, 6, 9), cpu_budget=0.01)
+        codec._record(1, cpu=0.005, raw_bytes=1000000, compressed_bytes=300000)
+        codec._record(6, cpu=0.008, raw_bytes=1000000, compressed_bytes=200000)
+        codec._record(9, cpu=0.05, raw_bytes=1000000, compressed_bytes=180000)
+        self.assertEqual(codec.level, 6)
+
+    def test_cheapest_level_when_over_budget(self):
+        codec = compression.AdaptiveCodec(codec="gzip", levels=(1, 6), cpu_budget=0.001)
+        codec._record(6, cpu=0.02, raw_bytes=1000000, compressed_bytes=200000)
+        codec._record(1, cpu=0.01, raw_bytes=1000000, compressed_bytes=300000)
+        self.assertEqual(codec.level, 1)
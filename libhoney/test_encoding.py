@@ -0,0 +1,51 @@
+'''Tests for libhoney/encoding.py'''
+
+import gzip
+import json
+import unittest
+from unittest import mock
+
+from libhoney import encoding
+from libhoney.compression import GzipCodec
+
+
+class TestEncodeBatch(unittest.TestCase):
+    def setUp(self):
+        self.events = [
+            {"time": "2013-01-01T11:11:11Z", "samplerate": 1, "data": {"key": i}}
+            for i in range(50)
+        ]
+        self.payloads = [json.dumps(ev).encode() for ev in self.events]
+
+    def test_uncompressed(self):
+        body = encoding.encode_batch(self.payloads)
+        self.assertEqual(json.loads(body), self.events)
+
+    def test_gzip(self):
+        body = encoding.encode_batch(self.payloads, GzipCodec(1).compressobj())
+        self.assertEqual(json.loads(gzip.decompress(body)), self.events)
+
+    def test_empty(self):
+        self.assertEqual(encoding.encode_batch([]), b"[]")
+        body = encoding.encode_batch([], GzipCodec(9).compressobj())
+        self.assertEqual(gzip.decompress(body), b"[]")
+
+    def test_serializer_framing(self):
+        framing = mock.Mock(batch_separator=b"", batch_footer=b"")
+        framing.batch_header.return_value = b"H"
+        self.assertEqual(encoding.encode_batch([b"a", b"b"], None, framing), b"Hab")
+        framing.batch_header.assert_called_once_with(2)
+
+    def test_iter_batch_is_lazy(self):
+        consumed = []
+
+        def payloads():
+            for p in self.payloads:
+                consumed.append(p)
+                yield p
+
+        chunks = encoding.iter_batch(payloads())
+        self.assertEqual(consumed, [])
+        self.assertEqual(next(chunks), b"[")
+        self.assertEqual(json.loads(b"[" + b"".join(chunks)), self.events)
+        self.assertEqual(len(consumed), len(self.payloads))
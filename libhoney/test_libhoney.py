@@ -6,6 +6,7 @@ import unittest
 from unittest import mock
 
 import libhoney
+from libhoney.fields import BatchField, FieldHolder
 
 
 def sample_dyn_fn():
@@ -48,9 +49,24 @@ class TestGlobalScope(unittest.TestCase):
             m_xmit.assert_called_with(
                 block_on_response=True, block_on_send=False,
                 max_concurrent_batches=5, user_agent_addition='',
-                debug=False,
+                debug=False, max_batch_bytes=5000000, destination_overrides=None,
+                min_batch_size=1, max_linger=1.0, adaptive=None, max_retries=3,
+                retry_base_delay=0.5, max_retry_delay=30.0, retry_budget_ratio=0.1,
+                spool_dir=None, spool_max_bytes=100 * 1024 * 1024, spool_drain_rate=1000,
+                serializer=libhoney.state.G_CLIENT.serializer, compression=None,
+                http_backend="requests", prewarm_hosts=(),
+                response_mode="events", response_callback=None,
+                metrics_sink="statsd", metrics_interval=10.0, stats_hook=None,
             )
 
+    def test_init_transmission_options(self):
+        with mock.patch('libhoney.client.Transmission') as m_xmit:
+            libhoney.init(writekey="wk", dataset="ds",
+                          spool_dir="/tmp/spool", max_retries=5)
+            _, kwargs = m_xmit.call_args
+            self.assertEqual(kwargs["spool_dir"], "/tmp/spool")
+            self.assertEqual(kwargs["max_retries"], 5)
+
     def test_close(self):
         mock_client = mock.Mock()
         libhoney.state.G_CLIENT = mock_client
@@ -124,6 +140,88 @@ class TestFieldHolder(unittest.TestCase):
         with self.assertRaises(TypeError):
             libhoney.add_dynamic_field("foo")
 
+    def test_cached_dynamic_field(self):
+        calls = []
+
+        def active_threads():
+            calls.append(1)
+            return len(calls)
+
+        fh = FieldHolder()
+        fh.add_dynamic_field(active_threads, refresh=10)
+        fh.add_dynamic_field(active_threads, refresh=10)
+        (fn,) = fh._dyn_fields
+        self.assertEqual(fn.__name__, "active_threads")
+        with mock.patch("libhoney.fields.time.monotonic", return_value=100):
+            self.assertEqual((fn(), fn()), (1, 1))
+        with mock.patch("libhoney.fields.time.monotonic", return_value=110):
+            # another thread refreshing it gets the stale value
+            fn._lock.acquire()
+            self.assertEqual(fn(), 1)
+            fn._lock.release()
+            self.assertEqual((fn(), fn()), (2, 2))
+
+    def test_dynamic_field_refresh(self):
+        fh = FieldHolder()
+        fh.add_dynamic_field(sample_dyn_fn, refresh="batch")
+        (fn,) = fh._dyn_fields
+        self.assertIsInstance(fn, BatchField)
+        self.assertEqual(fn(), ("dyna", "magic"))
+        for refresh in ("hourly", 0, -1, True, None):
+            with self.assertRaises(ValueError):
+                fh.add_dynamic_field(sample_dyn_fn, refresh=refresh)
+
+    def test_batch_fields_are_left_to_the_transmission(self):
+        libhoney.init()
+        calls = []
+
+        def rusage():
+            calls.append(1)
+            return 5
+
+        libhoney.add_dynamic_field(rusage, refresh="batch")
+        ev = libhoney.Event()
+        self.assertEqual(calls, [])
+        self.assertEqual(ev._batch_fields, list(libhoney.state.G_CLIENT.fields._dyn_fields))
+        self.assertNotIn("rusage", ev.fields())
+
+    def test_layers_are_copy_on_write(self):
+        parent = FieldHolder()
+        parent.add({"a": 1, "b": 2})
+        child = FieldHolder()
+        child += parent
+        child.add_field("c", 3)
+        # the child refers to the parent's fields rather than copying them
+        self.assertIs(child._layers[0], parent._local)
+        parent.add_field("a", 10)
+        child.add_field("b", 20)
+        self.assertEqual(parent._data, {"a": 10, "b": 2})
+        self.assertEqual(child._data, {"a": 1, "b": 20, "c": 3})
+        self.assertEqual(child._layers, ())
+
+    def test_repeated_layers(self):
+        client = FieldHolder()
+        client.add({"a": 1, "b": 1})
+        builder = FieldHolder()
+        builder += client
+        builder.add_field("a", 2)
+        ev = FieldHolder()
+        ev += client
+        ev += builder
+        self.assertEqual(len(ev._layers), 2)
+        self.assertEqual(ev._data, {"a": 2, "b": 1})
+
+    def test_layers_are_bounded(self):
+        fh = FieldHolder()
+        for i in range(20):
+            other = FieldHolder()
+            other.add_field("f", i)
+            other.add_field(f"f{i}", i)
+            fh += other
+            self.assertLessEqual(len(fh._layers), FieldHolder._MAX_LAYERS)
+        self.assertEqual(fh._data["f"], 19)
+        self.assertEqual(len(fh._data), 21)
+
 
 class TestBuilder(unittest.TestCase):
     def setUp(self):
@@ -208,6 +306,67 @@ class TestBuilder(unittest.TestCase):
         # move to event testing when written
         self.assertEqual(json.loads(str(ev)), {"a": 1, "3": "c", "b": 3})
 
+    def test_new_event_presample(self):
+        with mock.patch('libhoney.client.Transmission') as m_xmit:
+            libhoney.init(writekey="wk", dataset="ds")
+            dyn_calls = []
+            libhoney.add_dynamic_field(lambda: dyn_calls.append(1))
+            b = libhoney.Builder({"route": "/"})
+            b.sample_rate = 100
+
+            with mock.patch('libhoney.builder._should_drop', return_value=True) as m_sd:
+                ev = b.new_event(presample=True)
+                m_sd.assert_called_once_with(100)
+            self.assertEqual(dyn_calls, [])
+            ev.add_field("a", 1)
+            ev.add({"b": 2})
+            with ev.timer("t"):
+                pass
+            ev.add_metadata("md")
+            self.assertEqual(ev.fields(), {})
+            b.dataset = "other"
+            with mock.patch('libhoney.builder._should_drop', return_value=True):
+                other = b.new_event(presample=True)
+            self.assertEqual((other.writekey, other.dataset, other.api_host),
+                             ("wk", "other", "https://api.honeycomb.io"))
+            self.assertIsInstance(other.created_at, datetime.datetime)
+            with mock.patch.object(libhoney.state.G_CLIENT._reporter, "sampled") as m_sampled:
+                ev.send()
+                m_sampled.assert_called_once_with("md")
+            m_xmit.return_value.send.assert_not_called()
+            self.assertEqual(libhoney.state.G_CLIENT._metrics.counters(), {"sampled": 1})
+
+            # a kept event isn't sampled again when sent
+            with mock.patch('libhoney.builder._should_drop', return_value=False), \
+                    mock.patch('libhoney.event._should_drop', return_value=True):
+                ev = b.new_event(presample=True)
+                self.assertEqual(dyn_calls, [1])
+                ev.send()
+            self.assertEqual(ev.sample_rate, 100)
+            m_xmit.return_value.send.assert_called_once_with(ev)
+
+    def test_new_event_presample_with_sampler(self):
+        libhoney.init()
+        b = libhoney.Builder({"route": "/healthz"})
+        b.sampler = mock.Mock()
+        b.sampler.sample.return_value = (True, 50)
+        ev = b.new_event(presample=True)
+        b.sampler.sample.assert_called_once_with(b)
+        self.assertEqual(b.fields(), {"route": "/healthz"})
+        self.assertEqual(ev.sample_rate, 50)
+        self.assertEqual(ev.sampler.sample(ev), (True, 50))
+        b.sampler.sample.return_value = (False, 50)
+        self.assertEqual(b.new_event(presample=True).fields(), {})
+
+    def test_builder_fields_is_a_copy(self):
+        libhoney.init()
+        b = libhoney.Builder()
+        b.add_field("a", 1)
+        ev = b.new_event()
+        b.fields()["a"] = 2
+        self.assertEqual(ev.fields(), {"a": 1})
+        self.assertEqual(b.fields(), {"a": 1})
+
     def test_clone_builder(self):
         libhoney.init()
 
@@ -242,9 +401,11 @@ class TestEvent(unittest.TestCase):
             def utcnow(self):
                 return self.time
 
-        with mock.patch('libhoney.event.datetime') as m_datetime:
+        with mock.patch('libhoney.event.datetime') as m_datetime,\
+                mock.patch('libhoney.clock.now_ns') as m_now:
             fakeStart = datetime.datetime(2016, 1, 2, 3, 4, 5, 6)
             fakeEnd = fakeStart + datetime.timedelta(milliseconds=5)
+            m_now.return_value = 1451703845000006000
             fd = fakeDate()
             fd.setNow(fakeStart)
             m_datetime.datetime = fd
@@ -254,6 +415,17 @@ class TestEvent(unittest.TestCase):
             self.assertEqual(ev._fields._data, {"howlong": 5})
             self.assertEqual(ev.created_at, fakeStart)
 
+    def test_created_at(self):
+        libhoney.init()
+        ev = libhoney.Event()
+        self.assertIsInstance(ev._timestamp_ns, int)
+        self.assertIsNone(ev.created_at.tzinfo)
+        self.assertLess(abs(ev.created_at - datetime.datetime.utcnow()), datetime.timedelta(seconds=1))
+        when = datetime.datetime(2016, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        ev.created_at = when
+        self.assertIs(ev.created_at, when)
+        self.assertIsNone(ev._timestamp_ns)
+
     def test_str(self):
         libhoney.init()
         ev = libhoney.Event()
@@ -264,11 +436,11 @@ class TestEvent(unittest.TestCase):
         ev.add_field("null", None)
 
         serialized = str(ev)
-        self.assertTrue('"obj": {"a": 1}' in serialized)
-        self.assertTrue('"string": "a:1"' in serialized)
-        self.assertTrue('"number": 5' in serialized)
-        self.assertTrue('"boolean": true' in serialized)
-        self.assertTrue('"null": null' in serialized)
+        self.assertTrue('"obj":{"a":1}' in serialized)
+        self.assertTrue('"string":"a:1"' in serialized)
+        self.assertTrue('"number":5' in serialized)
+        self.assertTrue('"boolean":true' in serialized)
+        self.assertTrue('"null":null' in serialized)
 
     def test_send(self):
         with mock.patch('libhoney.client.Transmission') as m_xmit:
@@ -0,0 +1,117 @@
+'''Tests for libhoney/metrics.py'''
+import threading
+import unittest
+from unittest import mock
+
+from libhoney import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_flush_sends_deltas(self):
+        sink = mock.Mock()
+        m = metrics.Metrics(sink, interval=10)
+        m.gauge("queue_length", lambda: 3)
+        m.incr("messages_queued")
+        m.incr("messages_queued", 2)
+        self.assertTrue(m.dirty)
+        m.flush()
+        sink.send.assert_called_once_with({"messages_queued": 3}, {"queue_length": 3})
+        self.assertFalse(m.dirty)
+        m.incr("send_errors")
+        m.flush()
+        sink.send.assert_called_with({"messages_queued": 0, "send_errors": 1}, {"queue_length": 3})
+        self.assertEqual(m.counters(), {"messages_queued": 3, "send_errors": 1})
+
+    def test_maybe_flush_waits_for_interval(self):
+        sink = mock.Mock()
+        m = metrics.Metrics(sink, interval=10)
+        m.maybe_flush(m.next_flush - 1)
+        sink.send.assert_not_called()
+        m.maybe_flush(m.next_flush)
+        sink.send.assert_called_once()
+
+    def test_no_sink(self):
+        m = metrics.Metrics()
+        m.incr("messages_queued")
+        m.flush()
+        m.maybe_flush()
+        self.assertEqual(m.counters(), {"messages_queued": 1})
+
+    def test_sink_errors_are_ignored(self):
+        m = metrics.Metrics(metrics.CallbackSink(mock.Mock(side_effect=OSError)))
+        m.incr("messages_queued")
+        m.flush()
+
+    def test_statsd_sink(self):
+        with mock.patch("statsd.StatsClient") as m_statsd:
+            sink = metrics.get_metrics_sink("statsd")
+            sink.send({"messages_queued": 5, "send_errors": 0}, {"queue_length": 2})
+        pipe = m_statsd.return_value.pipeline.return_value
+        pipe.incr.assert_called_once_with("messages_queued", 5)
+        pipe.gauge.assert_called_once_with("queue_length", 2)
+        pipe.send.assert_called_once_with()
+
+    def test_get_metrics_sink(self):
+        self.assertIsNone(metrics.get_metrics_sink(None))
+        self.assertIsNone(metrics.get_metrics_sink("none"))
+        fn = mock.Mock(spec=[])
+        self.assertIsInstance(metrics.get_metrics_sink(fn), metrics.CallbackSink)
+        sink = metrics.CallbackSink(fn)
+        self.assertIs(metrics.get_metrics_sink(sink), sink)
+        with self.assertRaises(ValueError):
+            metrics.get_metrics_sink("graphite")
+
+
+class TestCounters(unittest.TestCase):
+    def test_threads_count_without_locking(self):
+        m = metrics.Metrics()
+        m.incr("sent")
+        # once a thread has counted, counting takes no lock
+        lock, m._lock = m._lock, None
+        m.incr("sent", 2)
+        m._lock = lock
+
+        def count():
+            for _ in range(1000):
+                m.incr("sent")
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for t in threads:
+            t.start()
+        # read while some threads may still be counting
+        self.assertLessEqual(m.counters()["sent"], 4003)
+        for t in threads:
+            t.join()
+        self.assertEqual(m.counters(), {"sent": 4003})
+        # the exited threads' counts are kept, and their dicts let go
+        self.assertEqual(len(m._shards), 1)
+        self.assertEqual(m.counters(), {"sent": 4003})
+        self.assertTrue(m.dirty)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        h = metrics.Histogram((1, 10, 100))
+        for value in (0.5, 1, 5, 50, 500):
+            h.observe(value)
+        snap = h.snapshot()
+        self.assertEqual(snap["count"], 5)
+        self.assertEqual(snap["sum"], 556.5)
+        self.assertEqual(snap["buckets"], [[1, 2], [10, 1], [100, 1], [float("inf"), 1]])
+        self.assertEqual(snap["p50"], 10)
+        self.assertEqual(snap["p99"], float("inf"))
+
+    def test_empty(self):
+        snap = metrics.Histogram(metrics.TIME_BUCKETS).snapshot()
+        self.assertEqual((snap["count"], snap["mean"], snap["p50"]), (0, 0, 0))
+
+    def test_export(self):
+        export = mock.Mock(side_effect=[RuntimeError, None])
+        m = metrics.Metrics(export=export)
+        self.assertTrue(m.active)
+        m.histogram("wait", (1,)).observe(2)
+        self.assertIs(m.histogram("wait", (1,)), m.histogram("wait", ()))
+        self.assertEqual(m.histograms()["wait"]["count"], 1)
+        m.flush()
+        m.flush()
+        self.assertEqual(export.call_count, 2)
@@ -0,0 +1,64 @@
+'''Tests for libhoney/responses.py'''
+import queue
+import unittest
+from unittest import mock
+
+from libhoney.responses import ResponseReporter
+
+
+class TestResponseReporter(unittest.TestCase):
+    def test_events(self):
+        q = queue.Queue()
+        r = ResponseReporter(q)
+        r.report(202, None, None, ["a", "b"])
+        self.assertEqual(q.get_nowait(), {
+            "status_code": 202, "body": "", "error": None, "duration": 0, "metadata": "a"})
+        self.assertEqual(q.get_nowait()["metadata"], "b")
+        r.sampled("c")
+        self.assertEqual(q.get_nowait()["error"], "event dropped due to sampling")
+
+    def test_errors(self):
+        q = queue.Queue()
+        r = ResponseReporter(q, mode="errors")
+        r.report(202, None, None, ["a"])
+        r.sampled("b")
+        r.report(202, "odd", None, ["c"])
+        r.report(0, "timeout", None, ["d"])
+        r.report(None, None, None, ["e"])
+        self.assertEqual([q.get_nowait()["metadata"] for _ in range(q.qsize())], ["c", "d", "e"])
+
+    def test_batches(self):
+        q = queue.Queue()
+        r = ResponseReporter(q, mode="batches")
+        r.report(400, "bad", None, ["a", "b"])
+        r.report(202, None, None, [])
+        self.assertEqual(q.qsize(), 1)
+        self.assertEqual(q.get_nowait()["metadata"], ["a", "b"])
+
+    def test_none(self):
+        q = mock.Mock()
+        r = ResponseReporter(q, mode="none")
+        r.report(400, "bad", None, ["a"])
+        r.sampled("b")
+        q.put_nowait.assert_not_called()
+        q.put.assert_not_called()
+
+    def test_callback(self):
+        q = mock.Mock()
+        callback = mock.Mock(side_effect=[RuntimeError("oops"), None])
+        r = ResponseReporter(q, callback=callback)
+        r.report(202, None, None, ["a", "b"])
+        self.assertEqual([c[0][0]["metadata"] for c in callback.call_args_list], ["a", "b"])
+        q.put_nowait.assert_not_called()
+
+    def test_full_queue(self):
+        q = queue.Queue(maxsize=1)
+        ResponseReporter(q).report(202, None, None, ["a", "b"])
+        self.assertEqual(q.get_nowait()["metadata"], "a")
+        q = mock.Mock()
+        ResponseReporter(q, block=True).report(202, None, None, ["a"])
+        q.put.assert_called_once()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            ResponseReporter(queue.Queue(), mode="some")
@@ -0,0 +1,61 @@
+'''Tests for libhoney/retry.py'''
+
+import datetime
+import email.utils
+import unittest
+from unittest import mock
+
+from libhoney import retry
+
+
+class TestBackoffDelay(unittest.TestCase):
+    def test_full_jitter(self):
+        with mock.patch('libhoney.retry.random.uniform') as m_uniform:
+            m_uniform.side_effect = lambda low, high: high
+            self.assertEqual(retry.backoff_delay(0, 0.5, 30), 0.5)
+            self.assertEqual(retry.backoff_delay(3, 0.5, 30), 4)
+            self.assertEqual(retry.backoff_delay(10, 0.5, 30), 30)
+            m_uniform.assert_called_with(0, 30)
+
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(retry.parse_retry_after("7"), 7)
+        self.assertEqual(retry.parse_retry_after("-3"), 0)
+
+    def test_http_date(self):
+        when = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+        delay = retry.parse_retry_after(email.utils.format_datetime(when, usegmt=True))
+        self.assertGreater(delay, 55)
+        self.assertLessEqual(delay, 60)
+
+    def test_invalid(self):
+        self.assertIsNone(retry.parse_retry_after(None))
+        self.assertIsNone(retry.parse_retry_after("soon"))
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_budget(self):
+        b = retry.RetryBudget(ratio=0.5, reserve=4)
+        self.assertEqual(b.withdraw(3), 3)
+        self.assertEqual(b.withdraw(3), 1)
+        self.assertEqual(b.withdraw(1), 0)
+        b.deposit(4)
+        self.assertEqual(b.withdraw(5), 2)
+        # deposits never bank more than the reserve
+        b.deposit(1000)
+        self.assertEqual(b.withdraw(10), 4)
+
+
+class TestRetryQueue(unittest.TestCase):
+    def test_ordering(self):
+        q = retry.RetryQueue()
+        self.assertIsNone(q.next_due())
+        q.push(3, "c")
+        q.push(1, "a")
+        q.push(2, "b")
+        self.assertEqual(q.next_due(), 1)
+        self.assertEqual(q.pop_due(2), ["a", "b"])
+        self.assertEqual(len(q), 1)
+        self.assertEqual(q.pop_all(), ["c"])
+        self.assertEqual(len(q), 0)
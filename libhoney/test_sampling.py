@@ -0,0 +1,285 @@
+'''Tests for libhoney/sampling.py'''
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import libhoney
+from libhoney import sampling
+
+
+class FakeEvent():
+    def __init__(self, sample_rate=1, **fields):
+        self.sample_rate = sample_rate
+        self._data = fields
+
+    def fields(self):
+        return self._data
+
+
+class TestGoalRates(unittest.TestCase):
+    def test_common_keys_take_the_sampling(self):
+        counts = {"/": 10000, "/login": 100, "/error": 1}
+        rates = sampling.goal_rates(counts, 10)
+        self.assertEqual(rates["/error"], 1)
+        self.assertLess(rates["/login"], rates["/"])
+        kept = sum(count / rates[k] for k, count in counts.items())
+        self.assertAlmostEqual(kept, sum(counts.values()) / 10, delta=20)
+
+    def test_no_counts(self):
+        self.assertEqual(sampling.goal_rates({}, 10), {})
+        self.assertEqual(sampling.goal_rates({"a": 1, "b": 1}, 10), {"a": 1, "b": 1})
+
+
+class TestKeyFunction(unittest.TestCase):
+    def test_key_function(self):
+        ev = FakeEvent(route="/", status_code=200)
+        self.assertEqual(sampling.key_function(["route"])(ev), "/")
+        self.assertEqual(sampling.key_function(["route", "status_code", "x"])(ev), ("/", 200, None))
+        self.assertEqual(sampling.key_function(["route"], key=len)("abc"), 3)
+
+
+class TestAvgSampleRate(unittest.TestCase):
+    def test_rates_come_from_the_last_window(self):
+        with mock.patch("libhoney.sampling.time.monotonic", return_value=0):
+            s = sampling.AvgSampleRate(goal_rate=10, key_fields=["route"], window=30)
+            for _ in range(1000):
+                self.assertEqual(s.sample(FakeEvent(route="/")), (True, 1))
+            s.sample(FakeEvent(route="/error"))
+        with mock.patch("libhoney.sampling.time.monotonic", return_value=30), \
+                mock.patch("libhoney.sampling.random.randint", return_value=2):
+            keep, rate = s.sample(FakeEvent(route="/"))
+            self.assertFalse(keep)
+            self.assertEqual(rate, 10)
+            self.assertEqual(s.sample(FakeEvent(route="/error")), (True, 1))
+            # unseen keys are kept
+            self.assertEqual(s.sample(FakeEvent(route="/new")), (True, 1))
+        self.assertEqual(s.rates(), {"/": rate, "/error": 1})
+
+    def test_max_keys(self):
+        with mock.patch("libhoney.sampling.time.monotonic", return_value=0):
+            s = sampling.AvgSampleRate(key_fields=["id"], max_keys=3)
+            for i in range(10):
+                s.sample(FakeEvent(id=i))
+        self.assertEqual(len(s._counts), 3)
+
+
+class TestEMASampleRate(unittest.TestCase):
+    def test_averages_age_out(self):
+        with mock.patch("libhoney.sampling.time.monotonic") as m_time:
+            m_time.return_value = 0
+            s = sampling.EMASampleRate(goal_rate=10, key_fields=["route"], window=15)
+            for _ in range(100):
+                s.sample(FakeEvent(route="/"))
+            s.sample(FakeEvent(route="/rare"))
+            m_time.return_value = 15
+            s.sample(FakeEvent(route="/"))
+            self.assertEqual(s._averages, {"/": 50, "/rare": 0.5})
+            first = s.rates()["/"]
+            # a quiet window halves the averages rather than resetting them
+            m_time.return_value = 30
+            s.sample(FakeEvent(route="/"))
+            self.assertEqual(s._averages, {"/": 25.5})
+            self.assertGreater(s.rates()["/"], 1)
+            self.assertGreater(first, 1)
+
+
+class TestThroughputSampler(unittest.TestCase):
+    def test_holds_each_dataset_to_the_goal(self):
+        with mock.patch("libhoney.sampling.time.monotonic") as m_time:
+            m_time.return_value = 0
+            s = sampling.ThroughputSampler(goal_throughput=100, window=2, weight=1)
+            busy, quiet = mock.Mock(dataset="busy"), mock.Mock(dataset="quiet")
+            for _ in range(2000):
+                self.assertEqual(s.rate(busy), 1)
+            s.rate(quiet)
+            # a late window is measured over its actual length
+            m_time.return_value = 4
+            self.assertEqual(s.rate(busy), 5)
+            self.assertEqual(s.rate(quiet), 1)
+            m_time.return_value = 6
+            for _ in range(3000):
+                s.rate(busy)
+            m_time.return_value = 8
+            self.assertEqual(s.rate(busy), 15)
+            # quiet keys are forgotten
+            self.assertEqual(s.rates(), {"busy": 15})
+
+    def test_averages_windows(self):
+        with mock.patch("libhoney.sampling.time.monotonic") as m_time:
+            m_time.return_value = 0
+            s = sampling.ThroughputSampler(goal_throughput=10, key_fields=["route"], window=1)
+            for _ in range(400):
+                s.rate(FakeEvent(route="/"))
+            m_time.return_value = 1
+            self.assertEqual(s.rate(FakeEvent(route="/")), 20)
+            m_time.return_value = 2
+            self.assertEqual(s.rate(FakeEvent(route="/")), 11)
+
+    def test_client_target_throughput(self):
+        with libhoney.Client(transmission_impl=mock.Mock(), target_throughput=50) as c:
+            self.assertIsInstance(c.sampler, sampling.ThroughputSampler)
+            self.assertEqual(c.sampler.goal_throughput, 50)
+        sampler = mock.Mock()
+        with libhoney.Client(transmission_impl=mock.Mock(), target_throughput=50,
+                             sampler=sampler) as c:
+            self.assertIs(c.sampler, sampler)
+
+
+class TestRulesSampler(unittest.TestCase):
+    RULES = [
+        {"conditions": [{"field": "status_code", "operator": ">=", "value": 500}],
+         "sample_rate": 1},
+        {"name": "health checks",
+         "conditions": [{"field": "route", "value": "/healthz"}],
+         "sample_rate": 50},
+        {"conditions": [{"field": "route", "operator": "starts-with", "value": "/static/"},
+                        {"field": "method", "operator": "in", "value": ["GET", "HEAD"]}],
+         "sample_rate": 100},
+        {"conditions": [{"field": "user_agent", "operator": "matches", "value": r"bot\b"},
+                        {"field": "error", "operator": "not-exists"}],
+         "sample_rate": 20},
+    ]
+
+    def test_first_matching_rule_wins(self):
+        s = sampling.RulesSampler(self.RULES, default_rate=10)
+        for fields, rate in [
+            ({"status_code": 503, "route": "/healthz"}, 1),
+            ({"status_code": 200, "route": "/healthz"}, 50),
+            ({"route": "/static/app.js", "method": "HEAD"}, 100),
+            ({"route": "/static/app.js", "method": "POST"}, 10),
+            ({"user_agent": "a googlebot crawler"}, 20),
+            ({"user_agent": "a googlebot crawler", "error": "timeout"}, 10),
+            ({"user_agent": "robots"}, 10),
+            # values of the wrong type never match
+            ({"status_code": "503", "route": ["/healthz"], "user_agent": 1}, 10),
+            ({"method": ["GET"], "route": "/static/"}, 10),
+            ({}, 10),
+        ]:
+            self.assertEqual(s.rate(FakeEvent(**fields)), rate, fields)
+
+    def test_operators(self):
+        def matches(op, value, found):
+            s = sampling.RulesSampler(
+                [{"conditions": [{"field": "f", "operator": op, "value": value}], "sample_rate": 2}])
+            return s.rate(FakeEvent(f=found)) == 2
+
+        self.assertTrue(matches("!=", 1, 2))
+        self.assertFalse(matches("!=", 1, 1))
+        self.assertTrue(matches("<", 1.5, 1))
+        self.assertTrue(matches("<=", "b", "a"))
+        self.assertFalse(matches(">", 1, True))
+        self.assertTrue(matches("contains", "err", "an error"))
+        self.assertTrue(matches("does-not-contain", "err", "ok"))
+        self.assertFalse(matches("does-not-contain", "err", None))
+        self.assertTrue(matches("exists", None, None))
+        self.assertEqual(sampling.RulesSampler(
+            [{"conditions": [{"field": "f", "operator": "exists"}], "sample_rate": 2}]
+        ).rate(FakeEvent()), 1)
+
+    def test_bad_rules(self):
+        for rule in [
+            {"sample_rate": 0},
+            {"sample_rate": 2.5},
+            {"conditions": [{"field": "f", "operator": "~", "value": 1}], "sample_rate": 2},
+            {"conditions": [{"operator": "=", "value": 1}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "="}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "matches", "value": "("}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "in", "value": [[1]]}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "in", "value": "GET"}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "in", "value": b"GET"}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "<", "value": None}], "sample_rate": 2},
+            {"conditions": [{"field": "f", "operator": "contains", "value": 1}], "sample_rate": 2},
+        ]:
+            with self.assertRaises(ValueError):
+                sampling.RulesSampler([rule])
+
+    def test_from_config(self):
+        config = {"rules": self.RULES, "default_rate": 5}
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(config, f)
+        try:
+            for s in (sampling.RulesSampler.from_config(config),
+                      sampling.RulesSampler.from_config(f.name)):
+                self.assertEqual(s.rate(FakeEvent(route="/healthz")), 50)
+                self.assertEqual(s.rate(FakeEvent(route="/")), 5)
+        finally:
+            os.unlink(f.name)
+
+    def test_field_names_are_not_code(self):
+        s = sampling.RulesSampler([{"conditions": [{"field": "') or ('", "value": "x"}],
+                                    "sample_rate": 3}])
+        self.assertEqual(s.rate(FakeEvent(**{"') or ('": "x"})), 3)
+        self.assertEqual(s.rate(FakeEvent()), 1)
+
+
+class TestDeterministicSampler(unittest.TestCase):
+    def test_deterministic_keep(self):
+        # the first four bytes of sha1("trace-1") are 0x66400e4b, which is
+        # kept at rates up to (2**32 - 1) / 0x66400e4b = 2.5037
+        self.assertEqual(hashlib.sha1(b"trace-1").digest()[:4], bytes.fromhex("66400e4b"))
+        self.assertTrue(sampling.deterministic_keep("trace-1", 2.5))
+        self.assertFalse(sampling.deterministic_keep("trace-1", 2.51))
+        self.assertFalse(sampling.deterministic_keep(b"trace-1", 3))
+        self.assertTrue(sampling.deterministic_keep(None, 1))
+
+    def test_keeps_about_one_in_rate(self):
+        kept = sum(sampling.deterministic_keep(f"trace-{i}", 10) for i in range(10000))
+        self.assertAlmostEqual(kept, 1000, delta=100)
+
+    def test_same_decision_for_a_trace(self):
+        s = sampling.DeterministicSampler("trace.trace_id")
+        for i in range(100):
+            trace = f"trace-{i}"
+            decisions = {s.sample(FakeEvent(sample_rate=4, **{"trace.trace_id": trace}))
+                         for _ in range(5)}
+            self.assertEqual(decisions, {(sampling.deterministic_keep(trace, 4), 4)})
+        s = sampling.DeterministicSampler("id", sample_rate=3)
+        self.assertEqual(s.sample(FakeEvent(id=2, sample_rate=100))[1], 3)
+
+    def test_missing_key_samples_at_random(self):
+        s = sampling.DeterministicSampler()
+        with mock.patch("libhoney.sampling.random.randint", return_value=1):
+            self.assertEqual(s.sample(FakeEvent(sample_rate=5)), (True, 5))
+
+    def test_builder_sample_by(self):
+        libhoney.close()
+        b = libhoney.Builder()
+        b.sample_rate = 4
+        b.sample_by("request_id")
+        ev = b.clone().new_event()
+        self.assertIsInstance(ev.sampler, sampling.DeterministicSampler)
+        self.assertEqual(ev.sampler.key_field, "request_id")
+        ev.add_field("request_id", "trace-1")
+        self.assertEqual(ev.sampler.sample(ev), (False, 4))
+
+
+class TestEventSend(unittest.TestCase):
+    def setUp(self):
+        libhoney.close()
+
+    def tearDown(self):
+        libhoney.close()
+
+    def test_sampler_sets_sample_rate(self):
+        sampler = mock.Mock()
+        tx = mock.Mock()
+        with libhoney.Client(writekey="wk", dataset="ds", transmission_impl=tx,
+                             sampler=sampler) as c:
+            sampler.sample.return_value = (True, 7)
+            ev = c.new_builder().new_event()
+            ev.add_field("a", 1)
+            ev.send()
+            sampler.sample.assert_called_once_with(ev)
+            self.assertEqual(ev.sample_rate, 7)
+            tx.send.assert_called_once_with(ev)
+
+            sampler.sample.return_value = (False, 7)
+            with mock.patch.object(c, "send_dropped_response") as m_dropped:
+                ev = c.new_event({"a": 1})
+                ev.send()
+                m_dropped.assert_called_once_with(ev)
+            self.assertEqual(tx.send.call_count, 1)
@@ -0,0 +1,135 @@
+'''Tests for libhoney/serializer.py'''
+
+import dataclasses
+import datetime
+import decimal
+import json
+import unittest
+from unittest import mock
+
+from libhoney import serializer
+from libhoney.internal import json_default_handler
+
+
+class Unprintable():
+    def __str__(self):
+        raise ValueError("no")
+
+
+@dataclasses.dataclass
+class Point():
+    x: int
+    y: int
+
+
+def sample():
+    return {
+        "string": "a:1",
+        "number": 5,
+        "float": 1.5,
+        "boolean": True,
+        "null": None,
+        "list": [1, "two", {"three": 3}],
+        "datetime": datetime.datetime(2024, 1, 2, 3, 4, 5, 6),
+        "date": datetime.date(2024, 1, 2),
+        "decimal": decimal.Decimal("1.10"),
+        "set": {1},
+        "dataclass": Point(1, 2),
+        "unprintable": Unprintable(),
+        1: "int key",
+    }
+
+
+class TestJSONSerializer(unittest.TestCase):
+    def test_matches_json_default_handler(self):
+        s = serializer.JSONSerializer()
+        expected = json.dumps(sample(), default=json_default_handler)
+        self.assertEqual(json.loads(s.dumps(sample())), json.loads(expected))
+
+    def test_compact(self):
+        s = serializer.JSONSerializer()
+        self.assertEqual(s.dumps({"a": [1, 2]}), b'{"a":[1,2]}')
+
+
+@unittest.skipUnless(serializer.has_orjson, "requires orjson")
+class TestOrjsonSerializer(unittest.TestCase):
+    def test_matches_json_serializer(self):
+        expected = serializer.JSONSerializer().dumps(sample())
+        self.assertEqual(json.loads(serializer.OrjsonSerializer().dumps(sample())),
+                         json.loads(expected))
+
+    def test_falls_back_on_big_ints(self):
+        self.assertEqual(serializer.OrjsonSerializer().dumps({"big": 2 ** 70}),
+                         b'{"big":%d}' % 2 ** 70)
+
+
+@unittest.skipUnless(serializer.has_msgspec, "requires msgspec")
+class TestMsgspecSerializer(unittest.TestCase):
+    def test_unknown_types(self):
+        s = serializer.MsgspecSerializer()
+        data = json.loads(s.dumps({"unprintable": Unprintable(), "set": {1}}))
+        self.assertEqual(data["unprintable"], "libhoney was unable to encode value")
+        self.assertEqual(data["set"], [1])
+
+
+class TestMsgpack(unittest.TestCase):
+    def test_array_header(self):
+        self.assertEqual(serializer._msgpack_array_header(3), b"\x93")
+        self.assertEqual(serializer._msgpack_array_header(100), b"\xdc\x00\x64")
+        self.assertEqual(serializer._msgpack_array_header(70000), b"\xdd\x00\x01\x11\x70")
+
+    def test_narrow_ints(self):
+        self.assertEqual(serializer._narrow_ints({"a": [2 ** 64, 1], "b": -2 ** 63}),
+                         {"a": [str(2 ** 64), 1], "b": -2 ** 63})
+
+    def test_parse_json_response(self):
+        self.assertEqual(serializer.parse_batch_response(
+            "application/json; charset=utf-8", b'[{"status":202}]'), [{"status": 202}])
+        self.assertEqual(serializer.parse_batch_response(None, b'[]'), [])
+
+    def test_requires_msgpack(self):
+        with mock.patch.object(serializer, "has_msgpack", False):
+            with self.assertRaises(ImportError):
+                serializer.get_serializer("msgpack")
+
+    @unittest.skipUnless(serializer.has_msgpack, "requires msgpack")
+    def test_round_trip(self):
+        from libhoney.encoding import encode_batch  # pylint: disable=import-outside-toplevel
+        s = serializer.get_serializer("msgpack")
+        when = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        payloads = [s.dumps({"time": when, "data": {"n": i, "big": 2 ** 70,
+                                                    "naive": datetime.datetime(2024, 1, 2),
+                                                    "unprintable": Unprintable()}})
+                    for i in range(20)]
+        body = encode_batch(payloads, None, s)
+        events = serializer.msgpack.unpackb(body, raw=False, timestamp=3)
+        self.assertEqual(len(events), 20)
+        self.assertEqual(events[3]["time"], when)
+        self.assertEqual(events[3]["data"]["n"], 3)
+        self.assertEqual(events[3]["data"]["big"], str(2 ** 70))
+        self.assertEqual(events[3]["data"]["naive"], "2024-01-02 00:00:00")
+        self.assertEqual(events[3]["data"]["unprintable"], "libhoney was unable to encode value")
+        self.assertEqual(serializer.parse_batch_response(
+            "application/msgpack", serializer.msgpack.packb([{"status": 202}])),
+            [{"status": 202}])
+
+
+class TestGetSerializer(unittest.TestCase):
+    def test_default_is_fastest_installed(self):
+        self.assertEqual(serializer.get_serializer().name,
+                         serializer.available_serializers()[0])
+
+    def test_by_name(self):
+        self.assertIsInstance(serializer.get_serializer("json"), serializer.JSONSerializer)
+        with self.assertRaises(ValueError):
+            serializer.get_serializer("yaml")
+
+    def test_missing_library(self):
+        with mock.patch.object(serializer, "has_orjson", False):
+            with self.assertRaises(ImportError):
+                serializer.get_serializer("orjson")
+            self.assertNotIn("orjson", serializer.available_serializers())
+
+    def test_custom(self):
+        custom = mock.Mock()
+        self.assertIs(serializer.get_serializer(custom), custom)
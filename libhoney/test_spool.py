@@ -0,0 +1,122 @@
+'''Tests for libhoney/spool.py'''
+
+import os
+import shutil
+import tempfile
+import stat
+import unittest
+from unittest import mock
+
+from libhoney.spool import Spool
+
+DEST = ("writeme", "dataset", "http://urlme/")
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        s = Spool(self.dir)
+        self.assertIsNone(s.pop())
+        self.assertTrue(s.append(DEST, [b'{"a":1}', b'{"b":2}']))
+        self.assertTrue(s.append(("other", "ds", "http://h/"), [b'{"c":3}']))
+        self.assertEqual(s.pop(), (DEST, [b'{"a":1}', b'{"b":2}']))
+        self.assertEqual(s.pop(), (("other", "ds", "http://h/"), [b'{"c":3}']))
+        self.assertIsNone(s.pop())
+        # fully read segments are removed
+        self.assertEqual(s.size(), 0)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_recovers_segments(self):
+        s = Spool(self.dir, segment_bytes=64)
+        for i in range(5):
+            s.append(DEST, [b'{"key":%d}' % i])
+        s.close()
+
+        s = Spool(self.dir)
+        self.assertGreater(s.size(), 0)
+        self.assertEqual([s.pop()[1][0] for _ in range(5)],
+                         [b'{"key":%d}' % i for i in range(5)])
+        self.assertIsNone(s.pop())
+
+    def test_new_segments_sort_after_recovered_ones(self):
+        s = Spool(self.dir)
+        s.append(DEST, [b"old"])
+        s.close()
+        s = Spool(self.dir)
+        s.append(DEST, [b"new"])
+        self.assertEqual(s.pop()[1], [b"old"])
+        self.assertEqual(s.pop()[1], [b"new"])
+
+    def test_close_keeps_read_position(self):
+        s = Spool(self.dir)
+        s.append(DEST, [b"first"])
+        s.append(DEST, [b"second"])
+        self.assertEqual(s.pop()[1], [b"first"])
+        s.close()
+        self.assertEqual(s.pop()[1], [b"second"])
+        self.assertIsNone(s.pop())
+
+    def test_max_bytes(self):
+        s = Spool(self.dir, max_bytes=100)
+        self.assertTrue(s.append(DEST, [b"x" * 40]))
+        self.assertFalse(s.append(DEST, [b"x" * 40]))
+        s.pop()
+        self.assertTrue(s.append(DEST, [b"x" * 40]))
+
+    def test_skips_damaged_records(self):
+        s = Spool(self.dir)
+        s.append(DEST, [b"good"])
+        s.append(DEST, [b"damaged"])
+        s.close()
+        s.append(DEST, [b"next segment"])
+        s.close()
+
+        first = os.path.join(self.dir, sorted(os.listdir(self.dir))[0])
+        with open(first, "r+b") as f:
+            data = f.read()
+            f.seek(data.rindex(b"damaged"))
+            f.write(b"DAMAGED")
+
+        s = Spool(self.dir)
+        self.assertEqual(s.pop()[1], [b"good"])
+        self.assertEqual(s.pop()[1], [b"next segment"])
+        self.assertIsNone(s.pop())
+
+    def test_truncated_segment(self):
+        s = Spool(self.dir)
+        s.append(DEST, [b"complete"])
+        s.append(DEST, [b"torn"])
+        s.close()
+        path = os.path.join(self.dir, os.listdir(self.dir)[0])
+        os.truncate(path, os.path.getsize(path) - 2)
+
+        s = Spool(self.dir)
+        self.assertEqual(s.pop()[1], [b"complete"])
+        self.assertIsNone(s.pop())
+
+    def test_owner_only(self):
+        directory = os.path.join(self.dir, "spool")
+        s = Spool(directory)
+        s.append(DEST, [b"secret"])
+        s.close()
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0o700)
+        segment = os.path.join(directory, os.listdir(directory)[0])
+        self.assertEqual(stat.S_IMODE(os.stat(segment).st_mode), 0o600)
+
+    def test_reader_catching_up_does_not_sync(self):
+        s = Spool(self.dir)
+        with mock.patch("libhoney.spool.os.fsync") as fsync:
+            for i in range(5):
+                s.append(DEST, [b"%d" % i])
+                s.append(DEST, [b"more"])
+                self.assertEqual(s.pop()[1], [b"%d" % i])
+                self.assertEqual(len(os.listdir(self.dir)), 1)
+                self.assertEqual(s.pop()[1], [b"more"])
+            fsync.assert_not_called()
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertEqual(s.size(), 0)
@@ -0,0 +1,172 @@
+'''Tests for libhoney/tail.py'''
+
+import threading
+import unittest
+from unittest import mock
+
+import libhoney
+from libhoney import tail
+from libhoney.sampling import deterministic_keep
+
+
+class FakeEvent():
+    def __init__(self, **fields):
+        self.sample_rate = 1
+        self._data = fields
+
+    def fields(self):
+        return self._data
+
+
+def span(trace_id, parent_id="parent", **fields):
+    return FakeEvent(**{"trace.trace_id": trace_id, "trace.parent_id": parent_id}, **fields)
+
+
+def root(trace_id, **fields):
+    return span(trace_id, None, **fields)
+
+
+class TestKeepErrors(unittest.TestCase):
+    def test_keep_errors(self):
+        policy = tail.keep_errors(rate=20)
+        self.assertEqual(policy([span("t"), root("t")]), 20)
+        self.assertEqual(policy([span("t", error="boom"), root("t")]), 1)
+        self.assertEqual(policy([span("t"), root("t", status_code=503)]), 1)
+        self.assertEqual(policy([root("t", status_code="503")]), 20)
+
+
+class TestTailSampler(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.dropped = []
+
+    def sampler(self, **kwargs):
+        s = tail.TailSampler(**kwargs)
+        s.start(self.sent.append, self.dropped.append)
+        self.addCleanup(s.close)
+        return s
+
+    def test_decides_at_the_root(self):
+        s = self.sampler(policy=lambda events: 1 if len(events) > 2 else 0)
+        keep = [span("a"), span("a"), root("a")]
+        drop = [span("b"), root("b")]
+        for ev in [keep[0], drop[0], keep[1]]:
+            s.add(ev)
+        self.assertEqual(self.sent + self.dropped, [])
+        s.add(keep[2])
+        s.add(drop[1])
+        self.assertEqual(self.sent, keep)
+        self.assertEqual(self.dropped, drop)
+
+        # late events follow their trace
+        late = span("a")
+        s.add(late)
+        s.add(span("b"))
+        self.assertEqual(self.sent[-1], late)
+        self.assertEqual(len(self.dropped), 3)
+        self.assertEqual(s.stats(), {
+            "kept_traces": 1, "dropped_traces": 1, "kept_events": 4, "dropped_events": 3,
+            "evicted_traces": 0, "expired_traces": 0, "late_events": 2, "untraced_events": 0,
+            "buffered_traces": 0, "buffered_events": 0})
+
+    def test_consistent_sample_rate(self):
+        s = self.sampler(policy=lambda events: 4)
+        for i in range(50):
+            trace = f"trace-{i}"
+            s.add(span(trace))
+            s.add(root(trace))
+            if deterministic_keep(trace, 4):
+                self.assertEqual([ev.sample_rate for ev in self.sent[-2:]], [4, 4])
+                self.assertEqual(self.sent[-1].fields()["trace.trace_id"], trace)
+            else:
+                self.assertEqual(self.dropped[-1].fields()["trace.trace_id"], trace)
+        self.assertEqual(len(self.sent) + len(self.dropped), 100)
+
+    def test_untraced_events_go_straight_through(self):
+        s = self.sampler()
+        ev = FakeEvent(a=1)
+        s.add(ev)
+        self.assertEqual(self.sent, [ev])
+        self.assertEqual(s.stats()["untraced_events"], 1)
+
+    def test_memory_caps_evict_least_recently_active(self):
+        s = self.sampler(policy=lambda events: 1, max_traces=2, max_events=4)
+        s.add(span("a"))
+        s.add(span("b"))
+        s.add(span("a"))
+        s.add(span("c"))
+        # "b" was the least recently active
+        self.assertEqual([ev.fields()["trace.trace_id"] for ev in self.sent], ["b"])
+        s.add(span("c"))
+        s.add(span("c"))
+        self.assertEqual([ev.fields()["trace.trace_id"] for ev in self.sent], ["b", "a", "a"])
+        stats = s.stats()
+        self.assertEqual(stats["evicted_traces"], 2)
+        self.assertEqual((stats["buffered_traces"], stats["buffered_events"]), (1, 3))
+
+    def test_timeout(self):
+        s = self.sampler(policy=lambda events: 1, trace_timeout=30)
+        a = span("a")
+        with mock.patch("libhoney.tail.time.monotonic", return_value=100):
+            s.add(a)
+        with mock.patch("libhoney.tail.time.monotonic", return_value=120):
+            s.add(span("b"))
+            self.assertEqual(s._expire(129.9), [])
+            self.assertEqual(s._until_next_timeout(), 10)
+        self.assertEqual(s._expire(140), [([a], 1)])
+        self.assertEqual(s.stats()["expired_traces"], 1)
+        self.assertEqual(list(s._traces), ["b"])
+
+    def test_thread_decides_timed_out_traces(self):
+        done = threading.Event()
+        s = tail.TailSampler(policy=lambda events: 1, trace_timeout=0.01)
+        s.start(lambda ev: done.set(), self.dropped.append)
+        self.addCleanup(s.close)
+        s.add(span("b"))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(s.stats()["expired_traces"], 1)
+
+    def test_flush(self):
+        s = self.sampler(policy=lambda events: 1)
+        s.add(span("a"))
+        s.add(span("b"))
+        s.flush()
+        self.assertEqual(len(self.sent), 2)
+
+
+class TestClientTailSampler(unittest.TestCase):
+    def test_head_and_tail_rates_multiply(self):
+        tx = mock.Mock()
+        sampler = tail.TailSampler(policy=lambda events: 1 if len(events) > 1 else 4)
+        with mock.patch("libhoney.event._should_drop", return_value=False), \
+                libhoney.Client(writekey="wk", dataset="ds", transmission_impl=tx,
+                                sample_rate=10, tail_sampler=sampler) as c:
+            b = c.new_builder({"trace.trace_id": "trace-1"})
+            child = b.new_event()
+            child.add_field("trace.parent_id", "p")
+            child.send()
+            b.new_event().send()
+            self.assertEqual([call[0][0].sample_rate for call in tx.send.call_args_list], [10, 10])
+
+            # trace-2 is kept at a rate of 4
+            self.assertTrue(deterministic_keep("trace-2", 4))
+            c.new_event({"trace.trace_id": "trace-2"}).send()
+            self.assertEqual(tx.send.call_args[0][0].sample_rate, 40)
+
+    def test_client(self):
+        tx = mock.Mock()
+        sampler = tail.TailSampler(policy=lambda events: 0)
+        with libhoney.Client(writekey="wk", dataset="ds", transmission_impl=tx,
+                             tail_sampler=sampler) as c:
+            ev = c.new_event({"trace.trace_id": "t", "trace.parent_id": "p"})
+            ev.send()
+            tx.send.assert_not_called()
+            untraced = c.new_event({"a": 1})
+            untraced.send()
+            tx.send.assert_called_once_with(untraced)
+            # closing decides the trace, which is dropped
+            c.close()
+            tx.send.assert_called_once_with(untraced)
+        stats = c.stats()
+        self.assertEqual(stats["dropped"]["sampling"], 1)
+        self.assertEqual(stats["tail"]["dropped_traces"], 1)
@@ -1,5 +1,7 @@
 '''Tests for libhoney/transmission.py'''
 import datetime
+import gzip
+import json
 import unittest
 from unittest import mock
 
@@ -58,6 +60,7 @@ class TestTornadoTransmissionSend(unittest.TestCase):
                                sample_rate=1, created_at=datetime.datetime.now())
                 ev.fields.return_value = {"foo": "bar"}
                 t.send(ev)
+                self.assertEqual(t.metrics.counters()["messages_queued"], 1)
 
                 # wait on the batch to be "sent"
                 # we can detect this when data has been inserted into the
@@ -70,8 +73,11 @@ class TestTornadoTransmissionSend(unittest.TestCase):
                 t.close()
 
             tornado.ioloop.IOLoop.current().run_sync(_test)
-            m_statsd.return_value.incr.assert_any_call("messages_queued")
+            m_statsd.assert_called_once_with("localhost", 8125, prefix="libhoney")
             self.assertTrue(fetch_mock.called)
+            req = fetch_mock.call_args[0][0]
+            self.assertEqual(req.headers["Content-Encoding"], "gzip")
+            self.assertEqual(json.loads(gzip.decompress(req.body))[0]["data"], {"foo": "bar"})
 
 
 class TestTornadoTransmissionSendError(unittest.TestCase):
@@ -120,6 +126,6 @@ class TestTornadoTransmissionQueueOverflow(unittest.TestCase):
             t.send(mock.Mock())
             t.send(mock.Mock())
             t.send(mock.Mock())  # should overflow sending and land on response
-            m_statsd.return_value.incr.assert_any_call("queue_overflow")
+            self.assertEqual(t.metrics.counters()["queue_overflow"], 1)
             # shouldn't throw exception when response is full
             t.send(mock.Mock())
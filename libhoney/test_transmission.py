@@ -2,14 +2,22 @@
 
 import libhoney
 from libhoney import transmission
+from libhoney.adaptive import AIMDController
+from libhoney.buffer import PendingBuffer
+from libhoney.compression import AdaptiveCodec
+from libhoney.retry import RetryBudget
 from libhoney.version import VERSION
 from platform import python_version
 
+import collections
 import datetime
 import gzip
 import httpretty
 import io
 import json
+import shutil
+import tempfile
+import threading
 from unittest import mock
 import requests_mock
 import time
@@ -21,7 +29,7 @@ class TestTransmissionInit(unittest.TestCase):
     def test_defaults(self):
         t = transmission.Transmission()
         self.assertEqual(t.max_concurrent_batches, 10)
-        self.assertIsInstance(t.pending, queue.Queue)
+        self.assertIsInstance(t.pending, PendingBuffer)
         self.assertEqual(t.pending.maxsize, 1000)
         self.assertIsInstance(t.responses, queue.Queue)
         self.assertEqual(t.responses.maxsize, 2000)
@@ -37,6 +45,65 @@ class TestTransmissionInit(unittest.TestCase):
         self.assertEqual(t.block_on_response, True)
         t.close()
 
+    def test_pool_sized_to_concurrency(self):
+        t = transmission.Transmission(max_concurrent_batches=4)
+        self.assertEqual(t.transport.session.get_adapter("https://")._pool_maxsize, 4)
+        t = transmission.Transmission(max_concurrent_batches=4, http_backend="urllib3")
+        self.assertEqual(t.transport._manager.connection_pool_kw["maxsize"], 4)
+        t = transmission.Transmission(
+            adaptive=AIMDController(max_concurrency=6), http_backend="http.client")
+        self.assertEqual(t.transport.pool_size, 6)
+        with self.assertRaises(ValueError):
+            transmission.Transmission(http_backend="carrier-pigeon")
+
+    def test_transport(self):
+        libhoney.init()
+        transport = mock.Mock()
+        transport.post.return_value.status_code = 200
+        transport.post.return_value.headers = {}
+        transport.post.return_value.content = b'[{"status": 202}]'
+        t = transmission.Transmission(
+            http_backend=transport, prewarm_hosts=["http://urlme/"], gzip_enabled=False)
+        t.start()
+        ev = libhoney.Event()
+        ev.writekey, ev.dataset, ev.api_host = "writeme", "dataset", "http://urlme/"
+        ev.add_field("key", "value")
+        t.send(ev)
+        t.close()
+        transport.prewarm.assert_called_once_with("http://urlme/")
+        (url, headers, _, _), _ = transport.post.call_args
+        self.assertEqual(url, "http://urlme/1/batch/dataset")
+        self.assertEqual(headers["X-Honeycomb-Team"], "writeme")
+        self.assertEqual(t.responses.get()["status_code"], 202)
+        transport.close.assert_called_once_with()
+
+    def test_transport_reopened_after_flush(self):
+        class ClosingTransport():
+            def __init__(self, **kwargs):
+                self.closed = False
+                self.sent = 0
+
+            def post(self, url, headers, body, timeout):
+                if self.closed:
+                    raise RuntimeError("Cannot send a request, as the client has been closed.")
+                self.sent += 1
+                return mock.Mock(status_code=200, headers={}, content=b'[{"status": 202}]')
+
+            def close(self):
+                self.closed = True
+
+        with mock.patch.dict(transmission.TRANSPORTS, {"closing": ClosingTransport}):
+            with libhoney.Client(writekey="writeme", dataset="dataset", api_host="http://urlme/",
+                                 http_backend="closing", metrics_sink="none") as c:
+                first = c.xmit.transport
+                c.send_now({"a": 1})
+                c.flush()
+                c.send_now({"a": 2})
+                c.flush()
+                responses = [c.responses().get() for _ in range(3)]
+        self.assertEqual(first.sent, 1)
+        self.assertEqual([r and r["status_code"] for r in responses], [202, None, 202])
+
     def test_user_agent_addition(self):
         ''' ensure user_agent_addition is included in the User-Agent header '''
         with mock.patch('libhoney.transmission.Transmission._get_requests_session') as m_session:
@@ -63,9 +130,7 @@ class FakeEvent():
 class TestTransmissionSend(unittest.TestCase):
     def test_send(self):
         t = transmission.Transmission()
-        t.sd = mock.Mock()
-        qsize = 4
-        t.pending.qsize = mock.Mock(return_value=qsize)
+        t.metrics = mock.Mock()
         t.pending.put = mock.Mock()
         t.pending.put_nowait = mock.Mock()
         t.responses.put = mock.Mock()
@@ -74,25 +139,24 @@ class TestTransmissionSend(unittest.TestCase):
         ev = FakeEvent()
         ev.metadata = None
         t.send(ev)
-        t.sd.gauge.assert_called_with("queue_length", 4)
         t.pending.put_nowait.assert_called_with(ev)
         t.pending.put.assert_not_called()
-        t.sd.incr.assert_called_with("messages_queued")
+        t.metrics.incr.assert_called_with("messages_queued")
         t.pending.put.reset_mock()
         t.pending.put_nowait.reset_mock()
-        t.sd.reset_mock()
+        t.metrics.reset_mock()
         # put an event blocking
         t.block_on_send = True
         t.send(ev)
         t.pending.put.assert_called_with(ev)
         t.pending.put_nowait.assert_not_called()
-        t.sd.incr.assert_called_with("messages_queued")
-        t.sd.reset_mock()
+        t.metrics.incr.assert_called_with("messages_queued")
+        t.metrics.reset_mock()
         # put an event non-blocking queue full
         t.block_on_send = False
         t.pending.put_nowait = mock.Mock(side_effect=queue.Full())
         t.send(ev)
-        t.sd.incr.assert_called_with("queue_overflow")
+        t.metrics.incr.assert_called_with("queue_overflow")
         t.responses.put_nowait.assert_called_with({
             "status_code": 0, "duration": 0,
             "metadata": None, "body": "",
@@ -280,6 +344,372 @@ class TestTransmissionPrivateSend(unittest.TestCase):
             assert ({h.url for h in m.request_history} ==
                     {"http://urlme/1/batch/dataset", "http://urlme/1/batch/alt_dataset"})
 
+    def test_per_destination_batches(self):
+        libhoney.init()
+        with requests_mock.Mocker() as m:
+            for dataset in ("dataset", "alt_dataset"):
+                m.post("http://urlme/1/batch/" + dataset,
+                       text=json.dumps(10 * [{"status": 202}]), status_code=200,
+                       request_headers={"X-Honeycomb-Team": "writeme"})
+
+            t = transmission.Transmission(
+                max_batch_size=10, send_frequency=10, gzip_enabled=False,
+                destination_overrides={"alt_dataset": {"max_batch_size": 5}})
+            t.start()
+
+            builder = libhoney.Builder()
+            builder.writekey = "writeme"
+            builder.api_host = "http://urlme/"
+            # interleave the datasets; each should still fill its own batches
+            for i in range(20):
+                for dataset in ("dataset", "alt_dataset"):
+                    builder.dataset = dataset
+                    ev = builder.new_event()
+                    ev.add_field("key", i)
+                    t.send(ev)
+            t.close()
+
+            sizes = collections.defaultdict(list)
+            for req in m.request_history:
+                sizes[req.url].append(len(req.json()))
+            self.assertEqual(sizes["http://urlme/1/batch/dataset"], [10, 10])
+            self.assertEqual(sizes["http://urlme/1/batch/alt_dataset"], [5, 5, 5, 5])
+
+    def test_unknown_destination_override(self):
+        with self.assertRaises(ValueError):
+            transmission.Transmission(
+                destination_overrides={"dataset": {"max_batch_sizes": 5}})
+
+    def test_adaptive_backs_off_on_pushback(self):
+        libhoney.init()
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset",
+                   text=json.dumps({"error": "slow down"}), status_code=429)
+
+            controller = AIMDController(max_concurrency=4, max_batch_size=20)
+            t = transmission.Transmission(adaptive=controller, gzip_enabled=False)
+            t.start()
+            ev = libhoney.Event()
+            ev.writekey = "writeme"
+            ev.dataset = "dataset"
+            ev.api_host = "http://urlme/"
+            ev.add_field("key", "value")
+            t.send(ev)
+            t.close()
+
+            self.assertEqual(controller.concurrency, 2)
+            self.assertEqual(controller.batch_size, 10)
+            self.assertEqual(t._new_batch(transmission.destination(
+                "writeme", "dataset", "http://urlme/")).max_size, 10)
+
+    def _send_events(self, t, count):
+        for i in range(count):
+            ev = libhoney.Event()
+            ev.writekey = "writeme"
+            ev.dataset = "dataset"
+            ev.api_host = "http://urlme/"
+            ev.metadata = i
+            ev.add_field("key", i)
+            t.send(ev)
+
+    def _read_responses(self, t, count):
+        responses = {}
+        for _ in range(count):
+            resp = t.responses.get(timeout=5)
+            responses[resp["metadata"]] = resp
+        return responses
+
+    def test_retry_failed_events_only(self):
+        libhoney.init()
+        bodies = []
+
+        def respond(request, context):
+            body = request.json()
+            bodies.append([ev["data"]["key"] for ev in body])
+            if len(bodies) == 1:
+                return json.dumps([{"status": 202}, {"status": 429}, {"status": 400, "error": "bad"}])
+            return json.dumps(len(body) * [{"status": 202}])
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=respond)
+            t = transmission.Transmission(gzip_enabled=False, retry_base_delay=0.01)
+            t.start()
+            self._send_events(t, 3)
+            responses = self._read_responses(t, 3)
+            t.close()
+
+        self.assertEqual(bodies, [[0, 1, 2], [1]])
+        self.assertEqual(responses[0]["status_code"], 202)
+        self.assertEqual(responses[1]["status_code"], 202)
+        self.assertEqual(responses[2]["status_code"], 400)
+        self.assertEqual(responses[2]["error"], "bad")
+
+    def test_response_modes(self):
+        libhoney.init()
+        body = json.dumps([{"status": 202}, {"status": 400, "error": "bad"}, {"status": 202}])
+        for mode, expected in [
+                ("batches", [(202, None, [0, 2]), (400, "bad", [1])]),
+                ("errors", [(400, "bad", 1)]),
+                ("none", [])]:
+            with requests_mock.Mocker() as m:
+                m.post("http://urlme/1/batch/dataset", text=body)
+                t = transmission.Transmission(gzip_enabled=False, response_mode=mode)
+                t.start()
+                self._send_events(t, 3)
+                t.close()
+            records = []
+            while True:
+                resp = t.responses.get_nowait()
+                if resp is None:
+                    break
+                records.append((resp["status_code"], resp["error"], resp["metadata"]))
+            self.assertEqual(records, expected, mode)
+
+    def test_metrics_sink(self):
+        libhoney.init()
+        flushes = []
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=json.dumps(2 * [{"status": 202}]))
+            t = transmission.Transmission(
+                gzip_enabled=False, metrics_sink=lambda c, g: flushes.append((c, g)))
+            t.start()
+            self._send_events(t, 2)
+            t.close()
+
+        # the sender flushes when it shuts down
+        self.assertEqual(flushes, [({"messages_queued": 2},
+                                    {"queue_length": 0, "inflight_batches": 0})])
+
+    def test_statsd_only_when_used(self):
+        with mock.patch("statsd.StatsClient") as m_statsd:
+            transmission.Transmission(metrics_sink="none")
+            m_statsd.assert_not_called()
+            transmission.Transmission()
+            m_statsd.assert_called_once_with("localhost", 8125, prefix="libhoney")
+
+    def test_stats(self):
+        libhoney.init()
+        exported = []
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=json.dumps(3 * [{"status": 202}]))
+            t = transmission.Transmission(
+                gzip_enabled=False, max_pending=3, metrics_sink="none",
+                stats_hook=exported.append)
+            self._send_events(t, 4)
+            t.start()
+            t.close()
+
+        stats = t.stats()
+        self.assertEqual(stats["enqueued"], 3)
+        self.assertGreater(stats["enqueue_rate"], 0)
+        self.assertEqual(stats["dropped"], {"overflow": 1, "error": 0})
+        self.assertEqual(stats["queue_length"], 0)
+        self.assertEqual(stats["inflight_batches"], 0)
+        histograms = stats["histograms"]
+        for name in ("queue_wait", "serialize_time"):
+            self.assertEqual(histograms[name]["count"], 3, name)
+        for name in ("compress_time", "http_time", "batch_events", "batch_bytes"):
+            self.assertEqual(histograms[name]["count"], 1, name)
+        self.assertEqual(histograms["batch_events"]["sum"], 3)
+        # the sender exports on shutdown
+        self.assertEqual(len(exported), 1)
+        self.assertEqual(exported[0]["enqueued"], 3)
+
+    def test_response_callback(self):
+        libhoney.init()
+        records = []
+        threads = set()
+
+        def callback(record):
+            records.append(record)
+            threads.add(threading.current_thread())
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=json.dumps(2 * [{"status": 202}]))
+            t = transmission.Transmission(
+                gzip_enabled=False, response_mode="batches", response_callback=callback)
+            t.start()
+            self._send_events(t, 2)
+            t.close()
+
+        self.assertEqual([r["metadata"] for r in records], [[0, 1]])
+        self.assertNotIn(threading.main_thread(), threads)
+        # only the end of responses marker is queued
+        self.assertIsNone(t.responses.get_nowait())
+        self.assertTrue(t.responses.empty())
+
+    def test_retry_gives_up_after_max_retries(self):
+        libhoney.init()
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", status_code=503, text="unavailable")
+            t = transmission.Transmission(
+                gzip_enabled=False, retry_base_delay=0.01, max_retries=2)
+            t.start()
+            self._send_events(t, 2)
+            responses = self._read_responses(t, 2)
+            self.assertEqual(m.call_count, 3)
+            t.close()
+
+        for resp in responses.values():
+            self.assertEqual(resp["status_code"], 503)
+
+    def test_retry_after_is_respected(self):
+        t = transmission.Transmission(max_retry_delay=30)
+        t._retries = mock.Mock()
+        dest = transmission.destination("writeme", "dataset", "http://urlme/")
+        ev = FakeEvent()
+        now = time.monotonic()
+        t._retry(dest, [((ev, b"{}"), 429, None)], 0, time.time(), retry_after=10)
+        (due, (_, items, attempt)), _ = t._retries.push.call_args
+        self.assertGreaterEqual(due, now + 10)
+        self.assertEqual(items, [(ev, b"{}")])
+        self.assertEqual(attempt, 1)
+
+        # a Retry-After beyond max_retry_delay is not waited for
+        t._retries.reset_mock()
+        t._retry(dest, [((ev, b"{}"), 429, "slow down")], 0, time.time(), retry_after=60)
+        t._retries.push.assert_not_called()
+        self.assertEqual(t.responses.get_nowait()["error"], "slow down")
+
+    def test_retry_budget_limits_retries(self):
+        t = transmission.Transmission()
+        t._retries = mock.Mock()
+        dest = transmission.destination("writeme", "dataset", "http://urlme/")
+        t._retry_budgets[dest] = RetryBudget(reserve=2)
+        failures = [((FakeEvent(), b"{}"), 500, None) for _ in range(5)]
+        t._retry(dest, failures, 0, time.time())
+        (_, (_, items, _)), _ = t._retries.push.call_args
+        self.assertEqual(len(items), 2)
+        self.assertEqual(t.responses.qsize(), 3)
+
+    def test_compression(self):
+        libhoney.init()
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset",
+                   text=json.dumps([{"status": 202}]), status_code=200)
+            dest = transmission.destination("writeme", "dataset", "http://urlme/")
+            t = transmission.Transmission(compression="none")
+            t._send_batch(dest, [(FakeEvent(), b'{"data":{}}')])
+            req = m.request_history[-1]
+            self.assertNotIn("Content-Encoding", req.headers)
+            self.assertEqual(req.body, b'[{"data":{}}]')
+
+            t = transmission.Transmission(compression=AdaptiveCodec(codec="gzip", sample_every=1))
+            t._send_batch(dest, [(FakeEvent(), b'{"data":{}}')])
+            req = m.request_history[-1]
+            self.assertEqual(req.headers["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(req.body), b'[{"data":{}}]')
+            self.assertEqual(list(t.codec.stats()), [1])
+
+    def test_encode_event_uses_serializer(self):
+        t = transmission.Transmission(serializer="json")
+        ev = FakeEvent()
+        ev.created_at = datetime.datetime(2013, 1, 1, 11, 11, 11)
+        ev.sample_rate = 2
+        ev.fields = mock.Mock(return_value={"key": "value"})
+        self.assertEqual(
+            t._encode_event(ev),
+            b'{"time":"2013-01-01T11:11:11Z","samplerate":2,"data":{"key":"value"}}')
+
+        t.serializer = mock.Mock()
+        t.serializer.dumps.return_value = b"{}"
+        self.assertEqual(t._encode_event(ev), b"{}")
+
+    def test_event_time(self):
+        libhoney.init()
+        with mock.patch("libhoney.clock.now_ns", return_value=1451703845000006000):
+            ev = libhoney.Event()
+        self.assertEqual(transmission._event_time(ev), "2016-01-02T03:04:05.000006Z")
+        self.assertEqual(transmission._event_time(ev, native=True), datetime.datetime(
+            2016, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc))
+        # a created_at set by hand is used as is
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        ev.created_at = datetime.datetime(2016, 1, 2, 3, 4, 5, tzinfo=eastern)
+        self.assertEqual(transmission._event_time(ev), "2016-01-02T03:04:05-05:00")
+        self.assertIs(transmission._event_time(ev, native=True), ev.created_at)
+
+    def test_batch_fields(self):
+        calls = []
+
+        def batch_number():
+            calls.append(1)
+            return len(calls)
+
+        libhoney.init()
+        libhoney.add_dynamic_field(batch_number, refresh="batch")
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/datame",
+                   text=json.dumps(10 * [{"status": 202}]), status_code=200)
+            t = transmission.Transmission(gzip_enabled=False, max_batch_size=10)
+            t.start()
+            for i in range(30):
+                ev = libhoney.Event(data={"i": i})
+                ev.writekey = "writeme"
+                ev.dataset = "datame"
+                ev.api_host = "http://urlme/"
+                t.send(ev)
+            t.close()
+
+        # called once per batch, and sent with every event in it
+        self.assertEqual(len(calls), m.call_count)
+        for req in m.request_history:
+            numbers = {event["data"]["batch_number"] for event in req.json()}
+            self.assertEqual(len(numbers), 1)
+
+        # without a batch, it's called for each event
+        ev = libhoney.Event()
+        transmission._event_data(ev)
+        self.assertEqual(transmission._event_data(ev)["batch_number"], len(calls))
+
+    def test_batch_fields_across_byte_limit(self):
+        calls = []
+
+        def batch_number():
+            calls.append(1)
+            return len(calls)
+
+        def respond(request, context):
+            return json.dumps(len(request.json()) * [{"status": 202}])
+
+        libhoney.init()
+        libhoney.add_dynamic_field(batch_number, refresh="batch")
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/datame", text=respond, status_code=200)
+            t = transmission.Transmission(gzip_enabled=False, max_batch_bytes=3000)
+            t.start()
+            for _ in range(9):
+                ev = libhoney.Event(data={"key": "x" * 1000})
+                ev.writekey = "writeme"
+                ev.dataset = "datame"
+                ev.api_host = "http://urlme/"
+                t.send(ev)
+            t.close()
+
+        # every batch after the first is opened by an event that didn't fit
+        # in the one before, which gets a value of its own
+        self.assertGreaterEqual(m.call_count, 4)
+        self.assertEqual(len(calls), m.call_count)
+        for req in m.request_history:
+            numbers = {event["data"]["batch_number"] for event in req.json()}
+            self.assertEqual(len(numbers), 1)
+
+    def test_split_batch_earns_budget_once(self):
+        def respond(request, context):
+            if len(request.json()) > 1:
+                context.status_code = 413
+                return "too large"
+            return json.dumps([{"status": 202}])
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=respond)
+            t = transmission.Transmission(gzip_enabled=False)
+            dest = transmission.destination("writeme", "dataset", "http://urlme/")
+            budget = t._retry_budgets[dest] = mock.Mock()
+            t._run_batch(dest, [(FakeEvent(), b"{}") for _ in range(4)], 0)
+
+        self.assertEqual(m.call_count, 7)
+        budget.deposit.assert_called_once_with(4)
+
     def test_flush_after_timeout(self):
         libhoney.init()
         with requests_mock.Mocker() as m:
@@ -304,6 +734,289 @@ class TestTransmissionPrivateSend(unittest.TestCase):
             assert resp["status_code"] == 202
             t.close()
 
+    def test_batching_by_bytes(self):
+        libhoney.init()
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/datame",
+                   text=json.dumps(10 * [{"status": 202}]), status_code=200,
+                   request_headers={"X-Honeycomb-Team": "writeme"})
+
+            t = transmission.Transmission(
+                gzip_enabled=False, max_batch_bytes=3000)
+            t.start()
+            for i in range(10):
+                ev = libhoney.Event()
+                ev.writekey = "writeme"
+                ev.dataset = "datame"
+                ev.api_host = "http://urlme/"
+                ev.add_field("key", "x" * 1000)
+                t.send(ev)
+            t.close()
+
+            # each event is over 1000 bytes once encoded, so no more than
+            # two fit under the limit
+            self.assertGreaterEqual(len(m.request_history), 5)
+            sent = 0
+            for req in m.request_history:
+                self.assertLessEqual(len(req.body), 3000)
+                sent += len(req.json())
+            self.assertEqual(sent, 10)
+
+    def test_split_batch_on_413(self):
+        libhoney.init()
+
+        def respond(request, context):
+            body = request.json()
+            if len(body) > 2:
+                context.status_code = 413
+                return json.dumps({"error": "request body is too large"})
+            context.status_code = 200
+            return json.dumps(len(body) * [{"status": 202}])
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/datame", text=respond)
+
+            t = transmission.Transmission(gzip_enabled=False)
+            t.start()
+            for i in range(7):
+                ev = libhoney.Event()
+                ev.writekey = "writeme"
+                ev.dataset = "datame"
+                ev.api_host = "http://urlme/"
+                ev.metadata = i
+                ev.add_field("key", i)
+                t.send(ev)
+            t.close()
+
+            metadata = []
+            while not t.responses.empty():
+                resp = t.responses.get()
+                if resp is None:
+                    break
+                self.assertEqual(resp["status_code"], 202)
+                metadata.append(resp["metadata"])
+            self.assertEqual(sorted(metadata), list(range(7)))
+
+
+class TestTransmissionSpool(unittest.TestCase):
+    def setUp(self):
+        libhoney.close()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _event(self, key):
+        ev = libhoney.Event()
+        ev.writekey = "writeme"
+        ev.dataset = "dataset"
+        ev.api_host = "http://urlme/"
+        ev.metadata = key
+        ev.add_field("key", key)
+        return ev
+
+    def test_overflow_is_spooled(self):
+        libhoney.init()
+        t = transmission.Transmission(max_pending=1, spool_dir=self.dir)
+        for i in range(3):
+            t.send(self._event(i))
+        self.assertTrue(t.responses.empty())
+        dest, payloads = t.spool.pop()
+        self.assertEqual(dest, ("writeme", "dataset", "http://urlme/"))
+        self.assertEqual(json.loads(payloads[0])["data"], {"key": 1})
+        self.assertEqual(json.loads(t.spool.pop()[1][0])["data"], {"key": 2})
+
+    def test_undeliverable_batches_are_spooled_and_drained(self):
+        libhoney.init()
+        bodies = []
+
+        def respond(request, context):
+            bodies.append(request.json())
+            if len(bodies) == 1:
+                context.status_code = 503
+                return "unavailable"
+            return json.dumps(len(bodies[-1]) * [{"status": 202}])
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset", text=respond)
+            t = transmission.Transmission(
+                gzip_enabled=False, max_retries=0, spool_dir=self.dir)
+            t.start()
+            t.send(self._event("a"))
+            resp = t.responses.get(timeout=5)
+            t.close()
+
+        self.assertEqual(resp["status_code"], 202)
+        # metadata does not survive the spool
+        self.assertIsNone(resp["metadata"])
+        self.assertEqual(len(bodies), 2)
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertEqual(t.spool.size(), 0)
+
+    def test_spool_recovered_on_start(self):
+        libhoney.init()
+        t = transmission.Transmission(max_pending=1, spool_dir=self.dir)
+        t.send(self._event("queued"))
+        t.send(self._event("spooled"))
+        t.spool.close()
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset",
+                   text=json.dumps([{"status": 202}]), status_code=200)
+            t = transmission.Transmission(gzip_enabled=False, spool_dir=self.dir)
+            t.start()
+            resp = t.responses.get(timeout=5)
+            t.close()
+            self.assertEqual(resp["status_code"], 202)
+            self.assertEqual(m.request_history[0].json()[0]["data"], {"key": "spooled"})
+
+    def test_spooled_events_are_merged_into_batches(self):
+        libhoney.init()
+        t = transmission.Transmission(max_pending=1, spool_dir=self.dir)
+        for i in range(51):
+            t.send(self._event(i))
+        t.spool.close()
+
+        with requests_mock.Mocker() as m:
+            m.post("http://urlme/1/batch/dataset",
+                   text=json.dumps(50 * [{"status": 202}]), status_code=200)
+            t = transmission.Transmission(gzip_enabled=False, spool_dir=self.dir)
+            t.start()
+            # shutting down doesn't drain the spool, so wait for the sender
+            # to get to it
+            for _ in range(50):
+                resp = t.responses.get(timeout=5)
+            t.close()
+            self.assertEqual(resp["status_code"], 202)
+            self.assertEqual(m.call_count, 1)
+            self.assertEqual(len(m.request_history[0].json()), 50)
+
+    def test_spooled_events_are_a_last_attempt(self):
+        t = transmission.Transmission(spool_dir=self.dir, max_retries=3)
+        dest = transmission.destination("writeme", "dataset", "http://urlme/")
+        t.spool.append(dest, [b"{}", b"{}"])
+        t._submit = mock.Mock()
+        t._drain_spool(mock.Mock(), time.monotonic())
+        (_, sent_dest, items, attempt), _ = t._submit.call_args
+        self.assertEqual(sent_dest, dest)
+        self.assertEqual(len(items), 2)
+        # no fresh retry budget and no new round of retries
+        self.assertEqual(attempt, 3)
+
+
+class TestTransmissionScheduling(unittest.TestCase):
+    def test_idle_sender_blocks_without_timeout(self):
+        t = transmission.Transmission()
+        t.pending = mock.Mock()
+        t.pending.drain.side_effect = [[None]]
+        t._sender()
+        t.pending.drain.assert_called_once_with(None)
+
+    def test_sender_sleeps_until_batch_deadline(self):
+        t = transmission.Transmission(send_frequency=5)
+        ev = FakeEvent()
+        ev.writekey, ev.dataset, ev.api_host = "writeme", "datame", "http://urlme/"
+        ev.sample_rate = 1
+        ev.fields = mock.Mock(return_value={"key": "value"})
+        t.pending = mock.Mock()
+        t.pending.drain.side_effect = [[ev], [None]]
+        t._send_batch = mock.Mock()
+        t._sender()
+        (timeout,), _ = t.pending.drain.call_args
+        self.assertGreater(timeout, 4)
+        self.assertLessEqual(timeout, 5)
+        # the open batch is sent on shutdown
+        t._send_batch.assert_called_once()
+
+    def test_min_batch_size_lingers(self):
+        dest = transmission.destination("writeme", "datame", "http://urlme/")
+        batch = transmission._PendingBatch(
+            dest, max_size=100, max_bytes=1000, frequency=0.25,
+            min_size=3, max_linger=2)
+        batch.add(FakeEvent(), b"{}")
+        self.assertEqual(batch.deadline(), batch.opened_at + 2)
+        batch.add(FakeEvent(), b"{}")
+        batch.add(FakeEvent(), b"{}")
+        self.assertEqual(batch.deadline(), batch.opened_at + 0.25)
+
+    def test_max_linger_never_shortens_send_frequency(self):
+        dest = transmission.destination("writeme", "datame", "http://urlme/")
+        batch = transmission._PendingBatch(
+            dest, max_size=100, max_bytes=1000, frequency=3,
+            min_size=10, max_linger=1)
+        batch.add(FakeEvent(), b"{}")
+        self.assertEqual(batch.deadline(), batch.opened_at + 3)
+
+
+class TestTransmissionFork(unittest.TestCase):
+    def test_child_starts_fresh(self):
+        t = transmission.Transmission(max_pending=5)
+        t.start()
+        # a real child has no copy of the parent's sender thread, so stop it,
+        # but leave the transmission open
+        t.close()
+        t._closed = False
+        pending, responses, transport = t.pending, t.responses, t.transport
+        t.pending.put_nowait(FakeEvent())
+        t._retries.push(0, "retry")
+
+        t._before_fork()
+        t._after_fork_in_child()
+        self.addCleanup(t.close)
+
+        # same objects, so a Client's references stay valid, but empty
+        self.assertIs(t.pending, pending)
+        self.assertIs(t.responses, responses)
+        self.assertTrue(t.pending.empty())
+        self.assertTrue(t.responses.empty())
+        self.assertEqual(len(t._retries), 0)
+        self.assertIsNot(t.transport, transport)
+        self.assertEqual(t.pending.maxsize, 5)
+        self.assertTrue(t._sending_thread.is_alive())
+        self.assertFalse(t._fork_lock.locked())
+
+    def test_child_does_not_restart_closed_transmission(self):
+        t = transmission.Transmission()
+        t.start()
+        t.close()
+        thread, transport = t._sending_thread, t.transport
+        with mock.patch.object(t, "_new_transport") as m_new:
+            t._before_fork()
+            t._after_fork_in_child()
+            m_new.assert_not_called()
+        self.assertIs(t._sending_thread, thread)
+        self.assertFalse(thread.is_alive())
+        self.assertIs(t.transport, transport)
+
+    def test_parent_releases_fork_lock(self):
+        t = transmission.Transmission()
+        t._before_fork()
+        self.assertTrue(t._fork_lock.locked())
+        t._after_fork_in_parent()
+        self.assertFalse(t._fork_lock.locked())
+
+    def test_child_does_not_share_spool(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        t = transmission.Transmission(spool_dir=spool_dir)
+        t._before_fork()
+        t._after_fork_in_child()
+        self.assertIsNone(t.spool)
+
+    @unittest.skipUnless(hasattr(transmission.os, "fork"), "needs fork")
+    def test_fork(self):
+        t = transmission.Transmission()
+        t.start()
+        self.addCleanup(t.close)
+        t.send(FakeEvent())
+        pid = transmission.os.fork()
+        if pid == 0:
+            ok = t._sending_thread.is_alive() and t.pending.empty()
+            transmission.os._exit(0 if ok else 1)
+        _, status = transmission.os.waitpid(pid, 0)
+        self.assertTrue(transmission.os.WIFEXITED(status))
+        self.assertEqual(transmission.os.WEXITSTATUS(status), 0)
+
 
 class TestFileTransmissionSend(unittest.TestCase):
     def test_send(self):
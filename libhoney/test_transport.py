@@ -0,0 +1,131 @@
+'''Tests for libhoney/transport.py'''
+
+import http.server
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from libhoney import transport
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, None))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(("POST", self.path, body))
+        self.server.user_agents.append(self.headers["User-Agent"])
+        status = 503 if self.path.endswith("/unavailable") else 200
+        reply = json.dumps([{"status": 202}]).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.requests = []
+        self.user_agents = []
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class TransportTests():  # pylint: disable=no-member
+    '''runs against each transport that can be created here'''
+    transport_class = None
+
+    def setUp(self):
+        self.server = _Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.transport = self.transport_class(  # pylint: disable=not-callable
+            pool_size=2, user_agent="libhoney-test")
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_post(self):
+        resp = self.transport.post(self.url + "/1/batch/ds", {"Content-Type": "application/json"},
+                                   b"[]", 5.0)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers.get("content-type"), "application/json")
+        self.assertEqual(json.loads(resp.content), [{"status": 202}])
+        resp.raise_for_status()
+        self.assertEqual(self.server.requests, [("POST", "/1/batch/ds", b"[]")])
+        self.assertEqual(self.server.user_agents, ["libhoney-test"])
+
+    def test_keeps_connections_alive(self):
+        for _ in range(3):
+            self.transport.post(self.url + "/1/batch/ds", {}, b"[]", 5.0)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_raise_for_status(self):
+        resp = self.transport.post(self.url + "/unavailable", {}, b"[]", 5.0)
+        self.assertEqual(resp.status_code, 503)
+        with self.assertRaises(Exception):
+            resp.raise_for_status()
+
+    def test_prewarm(self):
+        self.transport.prewarm(self.url)
+        self.transport.post(self.url + "/1/batch/ds", {}, b"[]", 5.0)
+        self.assertEqual(self.server.requests[0][0], "HEAD")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_prewarm_ignores_errors(self):
+        self.transport.prewarm("http://127.0.0.1:1")
+
+
+class TestUrllib3Transport(TransportTests, unittest.TestCase):
+    transport_class = transport.Urllib3Transport
+
+
+class TestHTTPClientTransport(TransportTests, unittest.TestCase):
+    transport_class = transport.HTTPClientTransport
+
+    def test_retries_stale_connection(self):
+        # the server drops connections that sit idle
+        with mock.patch.object(_Handler, "timeout", 0.1):
+            self.transport.post(self.url + "/1/batch/ds", {}, b"[]", 5.0)
+            time.sleep(0.3)
+            resp = self.transport.post(self.url + "/1/batch/ds", {}, b"[]", 5.0)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_no_proxies(self):
+        with self.assertRaises(ValueError):
+            transport.HTTPClientTransport(proxies={"https": "http://proxy:3128"})
+
+
+try:
+    import httpx  # pylint: disable=unused-import
+    has_httpx = True
+except ImportError:
+    has_httpx = False
+
+
+@unittest.skipUnless(has_httpx, "requires httpx")
+class TestHTTPXTransport(TransportTests, unittest.TestCase):
+    def transport_class(self, **kwargs):  # pylint: disable=method-hidden
+        # the test server only speaks HTTP/1.1
+        return transport.HTTPXTransport(http2=False, **kwargs)
@@ -1,21 +1,31 @@
 '''Transmission handles colleting and sending individual events to Honeycomb'''
-from datetime import timedelta
+from datetime import timedelta, timezone
 import queue
 from urllib.parse import urljoin
 
-import gzip
-import io
-import json
+import os
 import threading
-import statsd
 import sys
 import time
+import types
+import weakref
 import collections
 import concurrent.futures
 
 from platform import python_version
+from libhoney import clock
 from libhoney.version import VERSION
-from libhoney.internal import json_default_handler
+from libhoney.adaptive import AIMDController
+from libhoney.buffer import PendingBuffer
+from libhoney.compression import get_codec
+from libhoney.encoding import encode_batch
+from libhoney.metrics import BYTE_BUCKETS, COUNT_BUCKETS, TIME_BUCKETS, Metrics, get_metrics_sink
+from libhoney.responses import ResponseReporter, succeeded
+from libhoney.retry import (
+    RETRYABLE_STATUSES, RetryBudget, RetryQueue, backoff_delay, parse_retry_after)
+from libhoney.serializer import JSON_CONTENT_TYPE, get_serializer, parse_batch_response
+from libhoney.spool import Spool
+from libhoney.transport import TRANSPORTS, RequestsTransport
 
 try:
     from tornado import ioloop, gen
@@ -31,56 +41,172 @@ except ImportError:
 destination = collections.namedtuple("destination",
                                      ["writekey", "dataset", "api_host"])
 
+# stands in for the event behind a payload read back from the spool, whose
+# metadata isn't kept on disk
+_SPOOLED_EVENT = types.SimpleNamespace(metadata=None)
+# how often a spooled batch is tried while sends are failing, in seconds
+_SPOOL_PROBE_INTERVAL = 5.0
+
+# the Transmission settings that can be overridden per destination
+_BATCH_LIMITS = ("max_batch_size", "max_batch_bytes", "send_frequency",
+                 "min_batch_size", "max_linger")
+
 
 class Transmission():
     def __init__(self, max_concurrent_batches=10, block_on_send=False,
                  block_on_response=False, max_batch_size=100, send_frequency=0.25,
                  user_agent_addition='', debug=False, gzip_enabled=True, gzip_compression_level=1,
-                 proxies={}, max_pending=1000, max_responses=2000):
+                 proxies={}, max_pending=1000, max_responses=2000, max_batch_bytes=5000000,
+                 destination_overrides=None, min_batch_size=1, max_linger=1.0,
+                 adaptive=None, max_retries=3, retry_base_delay=0.5, max_retry_delay=30.0,
+                 retry_budget_ratio=0.1, spool_dir=None, spool_max_bytes=100 * 1024 * 1024,
+                 spool_drain_rate=1000, serializer=None, compression=None,
+                 http_backend="requests", prewarm_hosts=(), response_mode="events",
+                 response_callback=None, metrics_sink="statsd", metrics_interval=10.0,
+                 stats_hook=None):
         self.max_concurrent_batches = max_concurrent_batches
         self.block_on_send = block_on_send
         self.block_on_response = block_on_response
         self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
         self.send_frequency = send_frequency
+        self.min_batch_size = min_batch_size
+        self.max_linger = max_linger
         self.gzip_compression_level = gzip_compression_level
         self.gzip_enabled = gzip_enabled
+        # compression is "none", "gzip", "zstd", "adaptive" or a codec from
+        # libhoney.compression; by default gzip_enabled and
+        # gzip_compression_level decide
+        if compression is None:
+            compression = "gzip" if gzip_enabled else "none"
+        self.codec = get_codec(
+            compression, gzip_compression_level if compression == "gzip" else None)
+        # serializer encodes each event; see libhoney.serializer.get_serializer
+        self.serializer = get_serializer(serializer)
+        # adaptive may be an AIMDController, or True for one bounded by
+        # max_concurrent_batches and max_batch_size
+        if adaptive is True:
+            adaptive = AIMDController(
+                max_concurrency=max_concurrent_batches,
+                min_batch_size=min(10, max_batch_size), max_batch_size=max_batch_size)
+        self.adaptive = adaptive or None
+        # failed events are retried up to max_retries times after a jittered
+        # exponential backoff, as long as the destination's retry budget allows
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.max_retry_delay = max_retry_delay
+        self.retry_budget_ratio = retry_budget_ratio
+        # with a spool_dir, events that overflow the pending queue or that
+        # can't be delivered are kept on disk and sent later, at no more than
+        # spool_drain_rate events per second
+        self.spool = None
+        if spool_dir:
+            self.spool = Spool(spool_dir, max_bytes=spool_max_bytes)
+        self.spool_drain_rate = spool_drain_rate
+        # destination_overrides maps a dataset name (or a full `destination`)
+        # to a dict that replaces any of the settings in _BATCH_LIMITS for the
+        # batches sent there
+        self.destination_overrides = destination_overrides or {}
+        for limits in self.destination_overrides.values():
+            unknown = set(limits) - set(_BATCH_LIMITS)
+            if unknown:
+                raise ValueError(
+                    f"unknown destination override(s): {', '.join(sorted(unknown))}")
 
         if user_agent_addition:
             user_agent = f"libhoney-py/{VERSION} {user_agent_addition} python/{python_version()}"
         else:
             user_agent = f"libhoney-py/{VERSION} python/{python_version()}"
 
-        session = self._get_requests_session()
-        session.headers.update({"User-Agent": user_agent})
-        if self.gzip_enabled:
-            session.headers.update({"Content-Encoding": "gzip"})
-        if proxies:
-            session.proxies.update(proxies)
-        self.session = session
-
-        # libhoney adds events to the pending queue for us to send
-        self.pending = queue.Queue(maxsize=max_pending)
-        # we hand back responses from the API on the responses queue
+        self._user_agent = user_agent
+        self._proxies = proxies
+        # http_backend is "requests", "urllib3", "http.client", "httpx" or a
+        # transport from libhoney.transport. Connection pools are sized to
+        # the number of batches that can be in flight. A named backend gets
+        # a new transport if the transmission is restarted after close(); a
+        # transport passed in is reused, and must cope with this itself.
+        self.http_backend = http_backend
+        self._pool_size = max_concurrent_batches
+        if self.adaptive is not None:
+            self._pool_size = self.adaptive.max_concurrency
+        self.transport = self._new_transport()
+        # true once close() has closed the transport, until start() opens
+        # a new one
+        self._closed = False
+        # connections to the api hosts in prewarm_hosts are opened as the
+        # sender starts, rather than by the first batch
+        self.prewarm_hosts = prewarm_hosts
+
+        # libhoney adds events to the pending buffer for us to send
+        self.pending = PendingBuffer(maxsize=max_pending)
+        # we hand back responses from the API on the responses queue, or to
+        # response_callback, as response_mode says
         self.responses = queue.Queue(maxsize=max_responses)
+        self._reporter = ResponseReporter(
+            self.responses, response_mode, response_callback, block_on_response)
 
         self._sending_thread = None
-        self.sd = statsd.StatsClient(prefix="libhoney")
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        self._retries = RetryQueue()
+        self._retry_budgets = {}
+        self._retry_budgets_lock = threading.Lock()
+        self._sending_healthy = True
+        self._next_spool_drain = 0
+        # held by the sender while it works through a pass, so a fork never
+        # copies it halfway through one
+        self._fork_lock = threading.Lock()
+        self._fork_locked = False
+        # internal metrics are counted in memory, and the sender thread
+        # flushes them to metrics_sink ("statsd", "none", a function or a
+        # sink from libhoney.metrics) every metrics_interval seconds, along
+        # with a call to stats_hook with the result of stats()
+        self.stats_hook = stats_hook
+        self.metrics = Metrics(get_metrics_sink(metrics_sink), metrics_interval,
+                               self._export_stats if stats_hook else None)
+        self.metrics.gauge("queue_length", self.pending.qsize)
+        self.metrics.gauge("inflight_batches", lambda: self._inflight)
+        self._queue_wait = self.metrics.histogram("queue_wait", TIME_BUCKETS)
+        self._serialize_time = self.metrics.histogram("serialize_time", TIME_BUCKETS)
+        self._compress_time = self.metrics.histogram("compress_time", TIME_BUCKETS)
+        self._http_time = self.metrics.histogram("http_time", TIME_BUCKETS)
+        self._batch_events = self.metrics.histogram("batch_events", COUNT_BUCKETS)
+        self._batch_bytes = self.metrics.histogram("batch_bytes", BYTE_BUCKETS)
 
         self.debug = debug
         if debug:
             self._init_logger()
 
+        _live_transmissions.add(self)
+
+    def _new_transport(self):
+        backend = self.http_backend
+        if not isinstance(backend, str):
+            return backend
+        if backend == RequestsTransport.name:
+            return RequestsTransport(self._new_session())
+        transport_class = TRANSPORTS.get(backend)
+        if transport_class is None:
+            raise ValueError(f"unknown http_backend: {backend}")
+        return transport_class(pool_size=self._pool_size, user_agent=self._user_agent,
+                               proxies=self._proxies)
+
+    def _new_session(self):
+        session = self._get_requests_session(self._pool_size)
+        session.headers.update({"User-Agent": self._user_agent})
+        if self._proxies:
+            session.proxies.update(self._proxies)
+        return session
+
     @staticmethod
-    def _get_requests_session():
+    def _get_requests_session(pool_size=10):
         # lazy load requests only when needed (for why, see #121)
         from requests import Session  # pylint: disable=import-outside-toplevel
         from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
-        from urllib3.util import Retry  # pylint: disable=import-outside-toplevel
 
-        retry_strategy = Retry(total=1,
-                               status_forcelist=[500, 503, 504, 408, 429],  # retry status codes
-                               allowed_methods=["POST"])  # allow 1 retry on post
-        http_adapter = HTTPAdapter(max_retries=retry_strategy)
+        # retries are handled by Transmission so that only failed events are
+        # resent, after a backoff
+        http_adapter = HTTPAdapter(max_retries=0, pool_maxsize=pool_size)
 
         session = Session()
         session.mount("http://", http_adapter)
@@ -103,141 +229,365 @@ class Transmission():
             self._logger.debug(msg, *args, **kwargs)
 
     def start(self):
+        if self._closed:
+            # restarted after close(), as Client.flush() does
+            self.transport = self._new_transport()
+            self._closed = False
         self._sending_thread = threading.Thread(target=self._sender)
         self._sending_thread.daemon = True
         self._sending_thread.start()
 
     def send(self, ev):
         '''send accepts an event and queues it to be sent'''
-        self.sd.gauge("queue_length", self.pending.qsize())
+        # for the queue_wait histogram
+        ev._queued_at = time.monotonic()
         try:
             if self.block_on_send:
                 self.pending.put(ev)
             else:
                 self.pending.put_nowait(ev)
-            self.sd.incr("messages_queued")
+            self.metrics.incr("messages_queued")
         except queue.Full:
-            response = {
-                "status_code": 0,
-                "duration": 0,
-                "metadata": ev.metadata,
-                "body": "",
-                "error": "event dropped; queue overflow",
-            }
-            if self.block_on_response:
-                self.responses.put(response)
-            else:
-                try:
-                    self.responses.put_nowait(response)
-                except queue.Full:
-                    # if the response queue is full when trying to add an event
-                    # queue is full response, just skip it.
-                    pass
-            self.sd.incr("queue_overflow")
+            if self.spool is not None and self._spool_event(ev):
+                self.metrics.incr("messages_spooled")
+                return
+            self._reporter.report(0, "event dropped; queue overflow", None, [ev.metadata])
+            self.metrics.incr("queue_overflow")
 
     def _sender(self):
         '''_sender is the control loop that pulls events off the `self.pending`
-        queue and submits batches for actual sending. '''
-        events = []
-        last_flush = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrent_batches) as pool:
+        queue and submits batches for actual sending. Events are encoded as
+        they arrive and accumulated separately for each destination, so every
+        dataset gets its own batches. A batch is submitted as soon as it
+        reaches its `max_batch_size` or `max_batch_bytes`, or once its deadline
+        passes: `send_frequency` seconds after its first event, or
+        `max_linger` seconds if it is still smaller than `min_batch_size`.
+
+        Each pass drains everything waiting in `self.pending` at once, and
+        submits any retries that have come due and the next spooled batch.
+        Between passes the loop sleeps until the earliest batch, retry or
+        spool deadline, or until the next event arrives when nothing is
+        waiting to be sent. '''
+        batches = {}
+        max_workers = self.max_concurrent_batches
+        if self.adaptive is not None:
+            max_workers = self.adaptive.max_concurrency
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for host in self.prewarm_hosts:
+                _safe_submit(pool, self.transport.prewarm, host)
             while True:
-                try:
-                    ev = self.pending.get(timeout=self.send_frequency)
-                    if ev is None:
-                        # signals shutdown
-                        _safe_submit(pool, self._flush, events)
-                        pool.shutdown()
-                        return
-                    events.append(ev)
-                    if (len(events) > self.max_batch_size or
-                            time.time() - last_flush > self.send_frequency):
-                        _safe_submit(pool, self._flush, events)
-                        events = []
-                        last_flush = time.time()
-                except queue.Empty:
-                    _safe_submit(pool, self._flush, events)
-                    events = []
-                    last_flush = time.time()
+                deadlines = [batch.deadline() for batch in batches.values()]
+                retry_due = self._retries.next_due()
+                if retry_due is not None:
+                    deadlines.append(retry_due)
+                if self.spool is not None and self.spool.size():
+                    deadlines.append(self._next_spool_drain)
+                if self.metrics.active and self.metrics.dirty:
+                    # an idle sender needn't wake up for metrics that
+                    # haven't changed
+                    deadlines.append(self.metrics.next_flush)
+                timeout = None
+                if deadlines:
+                    timeout = max(0, min(deadlines) - time.monotonic())
+                events = self.pending.drain(timeout)
+                with self._fork_lock:
+                    for ev in events:
+                        if ev is None:
+                            # signals shutdown
+                            self._shutdown(pool, batches)
+                            return
+                        self._add_to_batch(pool, batches, ev)
+                    now = time.monotonic()
+                    for dest in [dest for dest, batch in batches.items() if batch.deadline() <= now]:
+                        batch = batches.pop(dest)
+                        self._submit(pool, dest, batch.items)
+                    for dest, items, attempt in self._retries.pop_due(now):
+                        self._submit(pool, dest, items, attempt)
+                    if self.spool is not None:
+                        self._drain_spool(pool, now)
+                        # persist whatever was spooled since the last pass
+                        self.spool.flush()
+                    self.metrics.maybe_flush(now)
 
-    def _flush(self, events):
-        if not events:
+    def _shutdown(self, pool, batches):
+        '''sends the open batches and waits for them. Retries still waiting
+        are sent right away, without their backoff, and are not retried
+        again.'''
+        for batch in batches.values():
+            self._submit(pool, batch.destination, batch.items)
+        pool.shutdown()
+        for dest, items, _ in self._retries.pop_all():
+            self._send_batch(dest, items, self.max_retries)
+        if self.spool is not None:
+            self.spool.close()
+        self.metrics.flush()
+
+    def _spool_event(self, ev):
+        '''writes an event that doesn't fit in the pending queue to the
+        spool. Returns False if the spool is full.'''
+        payload = self._encode_event(ev)
+        if payload is None:
+            # _encode_event has already reported the error
+            return True
+        return self.spool.append(
+            destination(ev.writekey, ev.dataset, ev.api_host), [payload])
+
+    def _drain_spool(self, pool, now):
+        '''submits spooled events, if it is time to. Records for the same
+        destination are merged into batches within the usual limits, up to
+        about one batch worth of events per call. While sends are failing,
+        only a single record is tried, to probe for recovery.
+
+        Spooled events have already used up their retries, so they are sent
+        as a last attempt: they earn no retry budget, and go back to the spool
+        if they fail again.'''
+        if now < self._next_spool_drain:
             return
-        for dest, group in group_events_by_destination(events).items():
-            self._send_batch(dest, group)
+        batches = {}
+        drained = 0
+        while drained < self.max_batch_size:
+            record = self.spool.pop()
+            if record is None:
+                break
+            dest, payloads = record
+            dest = destination(*dest)
+            for payload in payloads:
+                self._add_payload(pool, batches, dest, _SPOOLED_EVENT, payload,
+                                  self.max_retries)
+            drained += len(payloads)
+            if not self._sending_healthy:
+                break
+        if not drained:
+            return
+        self.log("sending %d spooled events", drained)
+        for dest, batch in batches.items():
+            self._submit(pool, dest, batch.items, self.max_retries)
+        if self._sending_healthy:
+            self._next_spool_drain = now + drained / self.spool_drain_rate
+        else:
+            self._next_spool_drain = now + _SPOOL_PROBE_INTERVAL
+
+    def _add_to_batch(self, pool, batches, ev):
+        '''encodes an event and adds it to the pending batch for its
+        destination, submitting that batch if a size limit is reached'''
+        queued_at = getattr(ev, "_queued_at", None)
+        if queued_at is not None:
+            self._queue_wait.observe(time.monotonic() - queued_at)
+        batch = None
+        batch_values = None
+        if getattr(ev, "_batch_fields", None).__class__ is list:
+            # dynamic fields refreshed once per batch are evaluated for the
+            # first event in the batch that has them
+            batch = batches.get(destination(ev.writekey, ev.dataset, ev.api_host))
+            batch_values = batch.dynamic_values if batch is not None else {}
+        payload = self._encode_event(ev, batch_values)
+        if payload is None:
+            return
+        dest = destination(ev.writekey, ev.dataset, ev.api_host)
+        if batch is not None and not batch.fits(payload):
+            # the event opens the next batch, so it needs that batch's values
+            self._submit(pool, dest, batches.pop(dest).items)
+            batch_values = {}
+            payload = self._encode_event(ev, batch_values)
+            if payload is None:
+                return
+        batch = self._add_payload(pool, batches, dest, ev, payload)
+        if batch_values is not None and batch.dynamic_values is not batch_values:
+            batch.dynamic_values = batch_values
+
+    def _add_payload(self, pool, batches, dest, ev, payload, attempt=0):
+        '''adds an encoded event to the pending batch for dest, and returns
+        that batch'''
+        batch = batches.get(dest)
+        if batch is not None and not batch.fits(payload):
+            # this event would push the batch over the byte limit
+            self._submit(pool, dest, batches.pop(dest).items, attempt)
+            batch = None
+        if batch is None:
+            batch = batches[dest] = self._new_batch(dest)
+        batch.add(ev, payload)
+        if batch.is_full():
+            self._submit(pool, dest, batches.pop(dest).items, attempt)
+        return batch
+
+    def _submit(self, pool, dest, items, attempt=0):
+        '''hands a batch to the sending pool. In adaptive mode this first waits
+        until fewer batches are in flight than the controller allows.'''
+        with self._inflight_cond:
+            if self.adaptive is not None:
+                while self._inflight >= self.adaptive.concurrency:
+                    self._inflight_cond.wait()
+            self._inflight += 1
+        if not _safe_submit(pool, self._run_batch, dest, items, attempt):
+            self._batch_done()
+
+    def _run_batch(self, dest, items, attempt):
+        try:
+            if attempt == 0:
+                # fresh traffic earns retry budget, once per event even if
+                # the batch has to be split
+                self._retry_budget(dest).deposit(len(items))
+            self._send_batch(dest, items, attempt)
+        finally:
+            self._batch_done()
+
+    def _batch_done(self):
+        with self._inflight_cond:
+            self._inflight -= 1
+            self._inflight_cond.notify()
+
+    def _new_batch(self, dest):
+        limits = self.destination_overrides.get(dest)
+        if limits is None:
+            limits = self.destination_overrides.get(dest.dataset, {})
+        max_size = self.max_batch_size
+        if self.adaptive is not None:
+            max_size = self.adaptive.batch_size
+        return _PendingBatch(
+            dest,
+            max_size=limits.get("max_batch_size", max_size),
+            max_bytes=limits.get("max_batch_bytes", self.max_batch_bytes),
+            frequency=limits.get("send_frequency", self.send_frequency),
+            min_size=limits.get("min_batch_size", self.min_batch_size),
+            max_linger=limits.get("max_linger", self.max_linger),
+        )
+
+    def _encode_event(self, ev, batch_values=None):
+        '''returns the JSON encoding of a single event as it appears in a
+        batch request body, or None if the event could not be encoded.
+        See _event_data for `batch_values`.'''
+        try:
+            start = time.perf_counter()
+            payload = _encode_payload(self.serializer, ev, batch_values)
+            self._serialize_time.observe(time.perf_counter() - start)
+            return payload
+        except Exception as e:
+            self._enqueue_errors(0, e, time.time(), [ev])
+            return None
 
-    def _send_batch(self, destination, events):
-        ''' Makes a single batch API request with the given list of events. The
-        `destination` argument contains the write key, API host and dataset
-        name used to build the request.'''
+    def _send_batch(self, destination, batch, attempt=0):
+        ''' Makes a single batch API request with the given list of encoded
+        events. The `destination` argument contains the write key, API host and
+        dataset name used to build the request. If the API rejects the request
+        as too large, the batch is split in half and each half is resent.
+
+        If the request fails with a retryable status or without a response,
+        or individual events come back with a retryable status, those events
+        are scheduled to be retried. `attempt` counts the earlier tries.'''
         start = time.time()
         status_code = 0
+        retry_after = None
         try:
             url = urljoin(urljoin(destination.api_host, "/1/batch/"),
                           destination.dataset)
-            payload = []
-            for ev in events:
-                event_time = ev.created_at.isoformat()
-                if ev.created_at.tzinfo is None:
-                    event_time += "Z"
-                payload.append({
-                    "time": event_time,
-                    "samplerate": ev.sample_rate,
-                    "data": ev.fields()})
-
-            data = json.dumps(payload, default=json_default_handler)
-            if self.gzip_enabled:
-                # The gzip lib works with file-like objects so we use a buffered byte stream
-                stream = io.BytesIO()
-                compressor = gzip.GzipFile(
-                    fileobj=stream, mode='wb', compresslevel=self.gzip_compression_level)
-                # python 2.7 works fine with str data here, but in python 3.x the byte stream object is more strict
-                # so we `encode` the string to get a bytes object
-                compressor.write(data.encode())
-                compressor.close()
-                data = stream.getvalue()
-                stream.close()
-            self.log("firing batch, size = %d", len(payload))
-            resp = self.session.post(
-                url,
-                headers={"X-Honeycomb-Team": destination.writekey,
-                         "Content-Type": "application/json"},
-                data=data,
-                timeout=10.0,
-            )
+            compress_start = time.perf_counter()
+            data = encode_batch([payload for _, payload in batch],
+                                self.codec.compressobj(), self.serializer)
+            self._compress_time.observe(time.perf_counter() - compress_start)
+            self._batch_events.observe(len(batch))
+            self._batch_bytes.observe(len(data))
+            self.log("firing batch, size = %d", len(batch))
+            sent = time.monotonic()
+            try:
+                resp = self.transport.post(
+                    url, self._batch_headers(destination), data, 10.0)
+            except Exception:
+                self._record_latency(sent, 0)
+                raise
             status_code = resp.status_code
+            self._record_latency(sent, status_code)
+            self._sending_healthy = status_code not in RETRYABLE_STATUSES
+            if status_code == 413 and len(batch) > 1:
+                # the API won't take a body this large, so bisect the batch
+                # rather than failing every event in it
+                self.log("batch too large, splitting, size = %d", len(batch))
+                half = len(batch) // 2
+                self._send_batch(destination, batch[:half], attempt)
+                self._send_batch(destination, batch[half:], attempt)
+                return
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
             resp.raise_for_status()
             statuses = [{"status": d.get("status"), "error": d.get(
-                "error")} for d in resp.json()]
-            for ev, status in zip(events, statuses):
-                self._enqueue_response(status.get(
-                    "status"), "", status.get("error"), start, ev.metadata)
+                "error")} for d in parse_batch_response(resp.headers.get("Content-Type"), resp.content)]
+            failures = []
+            # metadata of the events that are done with, by outcome
+            outcomes = {}
+            wants_successes = self._reporter.wants_successes
+            for item, status in zip(batch, statuses):
+                code, error = status["status"], status["error"]
+                if code in RETRYABLE_STATUSES:
+                    failures.append((item, code, error))
+                elif wants_successes or not succeeded(code, error):
+                    outcomes.setdefault((code, error), []).append(item[0].metadata)
+            for (code, error), metadata in outcomes.items():
+                self._reporter.report(code, error, start, metadata)
+            if failures:
+                self._retry(destination, failures, attempt, start, retry_after)
 
         except Exception as e:
-            # Catch all exceptions and hand them to the responses queue.
-            self._enqueue_errors(status_code, e, start, events)
+            # Catch all exceptions and hand them to the responses queue, unless
+            # the whole batch is worth another try.
+            if status_code == 0 or status_code in RETRYABLE_STATUSES:
+                self._sending_healthy = False
+                self._retry(destination, [(item, status_code, e) for item in batch],
+                            attempt, start, retry_after)
+            else:
+                self._enqueue_errors(status_code, e, start, [ev for ev, _ in batch])
+
+    def _batch_headers(self, destination):
+        headers = {"X-Honeycomb-Team": destination.writekey,
+                   "Content-Type": self.serializer.content_type}
+        if self.codec.content_encoding:
+            headers["Content-Encoding"] = self.codec.content_encoding
+        return headers
+
+    def _retry(self, destination, failures, attempt, start, retry_after=None):
+        '''schedules failed events, given as (item, status_code, error) tuples,
+        to be sent again after a backoff. Events that are out of attempts, or
+        over the destination's retry budget, are spooled if there is a spool
+        with room for them, and otherwise reported as errors.'''
+        retrying = []
+        if attempt < self.max_retries:
+            delay = backoff_delay(attempt, self.retry_base_delay, self.max_retry_delay)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if delay <= self.max_retry_delay:
+                granted = self._retry_budget(destination).withdraw(len(failures))
+                retrying, failures = failures[:granted], failures[granted:]
+        if failures and self.spool is not None:
+            if self.spool.append(destination, [payload for (_, payload), _, _ in failures]):
+                self.log("spooled %d undeliverable events", len(failures))
+                self.metrics.incr("messages_spooled", len(failures))
+                failures = []
+                # make sure the sender knows there is spool to drain
+                self.pending.wake()
+        for (ev, _), status_code, error in failures:
+            self._enqueue_errors(status_code, error, start, [ev])
+        if retrying:
+            self.log("retrying %d events in %.2fs", len(retrying), delay)
+            self._retries.push(time.monotonic() + delay, (
+                destination, [item for item, _, _ in retrying], attempt + 1))
+            # make sure the sender knows about the new deadline
+            self.pending.wake()
+
+    def _retry_budget(self, destination):
+        budget = self._retry_budgets.get(destination)
+        if budget is None:
+            with self._retry_budgets_lock:
+                budget = self._retry_budgets.setdefault(
+                    destination, RetryBudget(self.retry_budget_ratio))
+        return budget
+
+    def _record_latency(self, sent, status_code):
+        latency = time.monotonic() - sent
+        self._http_time.observe(latency)
+        if self.adaptive is not None:
+            self.adaptive.record(latency, status_code)
 
     def _enqueue_errors(self, status_code, error, start, events):
-        for ev in events:
-            self.sd.incr("send_errors")
-            self._enqueue_response(status_code, "", error, start, ev.metadata)
-
-    def _enqueue_response(self, status_code, body, error, start, metadata):
-        resp = {
-            "status_code": status_code,
-            "body": body,
-            "error": error,
-            "duration": (time.time() - start) * 1000,
-            "metadata": metadata
-        }
-        self.log("enqueuing response = %s", resp)
-        if self.block_on_response:
-            self.responses.put(resp)
-        else:
-            try:
-                self.responses.put_nowait(resp)
-            except queue.Full:
-                pass
+        self.metrics.incr("send_errors", len(events))
+        self.log("reporting %d failed events: %s", len(events), error)
+        self._reporter.report(status_code, error, start, [ev.metadata for ev in events])
 
     def close(self):
         '''call close to send all in-flight requests and shut down the
@@ -248,6 +598,8 @@ class Transmission():
         except queue.Full:
             pass
         self._sending_thread.join()
+        self.transport.close()
+        self._closed = True
         # signal to the responses queue that nothing more is coming.
         try:
             self.responses.put(None, True, 10)
@@ -259,6 +611,119 @@ class Transmission():
         objects from each event send'''
         return self.responses
 
+    def stats(self):
+        '''returns a snapshot of how the transmission is doing:
+
+        - `uptime`: seconds since it was created.
+        - `enqueued`, `enqueue_rate`: events queued to send, in total and per
+          second of uptime.
+        - `dropped`: events dropped, by reason: "overflow" (the queue was
+          full and there was no room in the spool) or "error" (sending
+          failed for good).
+        - `spooled`: events written to the spool.
+        - `queue_length`, `inflight_batches`: the current values.
+        - `histograms`: seconds events waited in the queue (`queue_wait`),
+          seconds spent encoding each event (`serialize_time`), framing and
+          compressing each batch (`compress_time`) and on each batch request
+          (`http_time`), and each batch's size in events (`batch_events`)
+          and bytes (`batch_bytes`). See `libhoney.metrics.Histogram`.'''
+        counters = self.metrics.counters()
+        uptime = time.monotonic() - self.metrics.started_at
+        enqueued = counters.get("messages_queued", 0)
+        return {
+            "uptime": uptime,
+            "enqueued": enqueued,
+            "enqueue_rate": enqueued / uptime if uptime else 0,
+            "dropped": {
+                "overflow": counters.get("queue_overflow", 0),
+                "error": counters.get("send_errors", 0),
+            },
+            "spooled": counters.get("messages_spooled", 0),
+            "queue_length": self.pending.qsize(),
+            "inflight_batches": self._inflight,
+            "histograms": self.metrics.histograms(),
+        }
+
+    def _export_stats(self):
+        self.stats_hook(self.stats())
+
+    def _before_fork(self):
+        # wait briefly for the sender to finish its current pass, but never
+        # hold up the fork for long
+        # released in _after_fork_in_parent, and replaced in the child
+        self._fork_locked = self._fork_lock.acquire(timeout=1.0)  # pylint: disable=consider-using-with
+
+    def _after_fork_in_parent(self):
+        if self._fork_locked:
+            self._fork_locked = False
+            self._fork_lock.release()
+
+    def _after_fork_in_child(self):
+        '''gives the child process its own, empty, copy of the transmission.
+        Events queued before the fork are left for the parent to send. The
+        queues are reinitialized in place so that references held elsewhere,
+        such as by the Client, stay valid.'''
+        self._fork_lock = threading.Lock()
+        self._fork_locked = False
+        self.pending._reset()
+        _reset_queue(self.responses)
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        self._retries = RetryQueue()
+        self._retry_budgets = {}
+        self._retry_budgets_lock = threading.Lock()
+        if self.adaptive is not None:
+            self.adaptive._lock = threading.Lock()
+        self.metrics._after_fork()
+        # the spool directory belongs to the parent, and the transport's
+        # connection pool shares its sockets with the parent. A transport
+        # passed in as http_backend is kept, and must cope with this itself.
+        self.spool = None
+        if self._closed:
+            # a closed transmission needs no sender; start() opens a new
+            # transport if it is ever restarted
+            return
+        self.transport = self._new_transport()
+        if self._sending_thread is not None:
+            self.start()
+
+
+def _reset_queue(q):
+    '''empties a queue.Queue in place and gives it new locks'''
+    q.queue.clear()
+    q.unfinished_tasks = 0
+    q.mutex = threading.Lock()
+    q.not_empty = threading.Condition(q.mutex)
+    q.not_full = threading.Condition(q.mutex)
+    q.all_tasks_done = threading.Condition(q.mutex)
+
+
+# The sender thread, its pool and its connections don't survive a fork, so the
+# child gets a freshly started Transmission. Transmissions are tracked weakly
+# so that this doesn't keep them alive.
+_live_transmissions = weakref.WeakSet()
+
+
+def _before_fork():
+    for t in list(_live_transmissions):
+        t._before_fork()
+
+
+def _after_fork_in_parent():
+    for t in list(_live_transmissions):
+        t._after_fork_in_parent()
+
+
+def _after_fork_in_child():
+    for t in list(_live_transmissions):
+        t._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork,
+                        after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+
 
 # only define this class if tornado exists, otherwise we'll get NameError on gen
 # Is there a better way to do this?
@@ -269,7 +734,9 @@ if has_tornado:
     class TornadoTransmission():
         def __init__(self, max_concurrent_batches=10, block_on_send=False,
                      block_on_response=False, max_batch_size=100, send_frequency=timedelta(seconds=0.25),
-                     user_agent_addition='', max_pending=1000, max_responses=2000):
+                     user_agent_addition='', max_pending=1000, max_responses=2000,
+                     serializer=None, compression="gzip", metrics_sink="statsd",
+                     metrics_interval=10.0):
             if not has_tornado:
                 raise ImportError(
                     'TornadoTransmission requires tornado, but it was not found.')
@@ -278,6 +745,10 @@ if has_tornado:
             self.block_on_response = block_on_response
             self.max_batch_size = max_batch_size
             self.send_frequency = send_frequency
+            self.serializer = get_serializer(serializer)
+            # compression is "none", "gzip", "zstd", "adaptive" or a codec
+            # from libhoney.compression
+            self.codec = get_codec(compression)
 
             if user_agent_addition:
                 user_agent = f"libhoney-py/{VERSION} (tornado/{tornado_version}) {user_agent_addition} python/{python_version()}"
@@ -294,7 +765,8 @@ if has_tornado:
             self.responses = Queue(maxsize=max_responses)
 
             self.batch_data = {}
-            self.sd = statsd.StatsClient(prefix="libhoney")
+            self.metrics = Metrics(get_metrics_sink(metrics_sink), metrics_interval)
+            self.metrics.gauge("queue_length", self.pending.qsize)
             self.batch_sem = Semaphore(max_concurrent_batches)
 
         def start(self):
@@ -302,13 +774,12 @@ if has_tornado:
 
         def send(self, ev):
             '''send accepts an event and queues it to be sent'''
-            self.sd.gauge("queue_length", self.pending.qsize())
             try:
                 if self.block_on_send:
                     self.pending.put(ev)
                 else:
                     self.pending.put_nowait(ev)
-                self.sd.incr("messages_queued")
+                self.metrics.incr("messages_queued")
             except QueueFull:
                 response = {
                     "status_code": 0,
@@ -326,7 +797,7 @@ if has_tornado:
                         # if the response queue is full when trying to add an event
                         # queue is full response, just skip it.
                         pass
-                self.sd.incr("queue_overflow")
+                self.metrics.incr("queue_overflow")
 
         # We're using the older decorator/yield model for compatibility with
         # Python versions before 3.5.
@@ -343,6 +814,7 @@ if has_tornado:
                     if ev is None:
                         # signals shutdown
                         yield self._flush(events)
+                        self.metrics.flush()
                         return
                     events.append(ev)
                     if (len(events) > self.max_batch_size or
@@ -353,6 +825,7 @@ if has_tornado:
                     yield self._flush(events)
                     events = []
                     last_flush = time.time()
+                self.metrics.maybe_flush()
 
         @gen.coroutine
         def _flush(self, events):
@@ -374,23 +847,19 @@ if has_tornado:
                 yield self.batch_sem.acquire()
                 url = urljoin(urljoin(destination.api_host, "/1/batch/"),
                               destination.dataset)
-                payload = []
-                for ev in events:
-                    event_time = ev.created_at.isoformat()
-                    if ev.created_at.tzinfo is None:
-                        event_time += "Z"
-                    payload.append({
-                        "time": event_time,
-                        "samplerate": ev.sample_rate,
-                        "data": ev.fields()})
+                batch_values = {}
+                payloads = [_encode_payload(self.serializer, ev, batch_values) for ev in events]
+                headers = {
+                    "X-Honeycomb-Team": destination.writekey,
+                    "Content-Type": self.serializer.content_type,
+                }
+                if self.codec.content_encoding:
+                    headers["Content-Encoding"] = self.codec.content_encoding
                 req = HTTPRequest(
                     url,
                     method='POST',
-                    headers={
-                        "X-Honeycomb-Team": destination.writekey,
-                        "Content-Type": "application/json",
-                    },
-                    body=json.dumps(payload, default=json_default_handler),
+                    headers=headers,
+                    body=encode_batch(payloads, self.codec.compressobj(), self.serializer),
                 )
                 yield self.http_client.fetch(req, self._response_callback)
                 # store the events that were sent so we can process responses later
@@ -404,7 +873,7 @@ if has_tornado:
 
         def _enqueue_errors(self, status_code, error, start, events):
             for ev in events:
-                self.sd.incr("send_errors")
+                self.metrics.incr("send_errors")
                 self._enqueue_response(
                     status_code, "", error, start, ev.metadata)
 
@@ -417,15 +886,16 @@ if has_tornado:
                 status_code = resp.code
                 resp.rethrow()
 
-                statuses = [d["status"] for d in json.loads(resp.body)]
+                statuses = [d["status"] for d in parse_batch_response(
+                    resp.headers.get("Content-Type"), resp.body)]
                 for ev, status in zip(events, statuses):
                     self._enqueue_response(
                         status, "", None, start, ev.metadata)
-                    self.sd.incr("messages_sent")
+                    self.metrics.incr("messages_sent")
             except Exception as e:
                 status_code = resp.code
                 self._enqueue_errors(status_code, e, start, events)
-                self.sd.incr("send_errors")
+                self.metrics.incr("send_errors")
             finally:
                 # clean up the data for this batch
                 del self.batch_data[resp.request]
@@ -470,8 +940,11 @@ class FileTransmission():
     ''' Transmission implementation that writes to a file object
     rather than sending events to Honeycomb. Defaults to STDERR. '''
 
-    def __init__(self, user_agent_addition='', output=sys.stderr):
+    def __init__(self, user_agent_addition='', output=sys.stderr, serializer=None):
         self._output = output
+        self.serializer = get_serializer(serializer)
+        if self.serializer.content_type != JSON_CONTENT_TYPE:
+            raise ValueError("FileTransmission writes JSON lines, and needs a JSON serializer")
 
         if user_agent_addition:
             self._user_agent = f"libhoney-py/{VERSION} {user_agent_addition} python/{python_version()}"
@@ -485,23 +958,18 @@ class FileTransmission():
 
     def send(self, ev):
         '''send accepts an event and writes it to the configured output file'''
-        event_time = ev.created_at.isoformat()
-        if ev.created_at.tzinfo is None:
-            event_time += "Z"
-
         # we add dataset and user_agent to the payload
         # if processed by another honeycomb agent (i.e. agentless integrations
         # for AWS), this data will get used to route the event to the right
         # location with appropriate metadata
         payload = {
-            "time": event_time,
+            "time": _event_time(ev),
             "samplerate": ev.sample_rate,
             "dataset": ev.dataset,
             "user_agent": self._user_agent,
-            "data": ev.fields(),
+            "data": _event_data(ev),
         }
-        self._output.write(json.dumps(
-            payload, default=json_default_handler) + "\n")
+        self._output.write(self.serializer.dumps(payload).decode() + "\n")
 
     def close(self):
         '''Exists to be consistent with the Transmission API, but does nothing
@@ -519,6 +987,95 @@ class FileTransmission():
         pass
 
 
+class _PendingBatch():
+    '''_PendingBatch accumulates the encoded events headed for a single
+    destination until one of its limits is reached'''
+    __slots__ = ("destination", "items", "nbytes", "opened_at",
+                 "max_size", "max_bytes", "frequency", "min_size", "max_linger",
+                 "dynamic_values")
+
+    def __init__(self, destination, max_size, max_bytes, frequency,
+                 min_size=1, max_linger=0):
+        self.destination = destination
+        self.items = []
+        self.nbytes = 0
+        self.opened_at = time.monotonic()
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.frequency = frequency
+        self.min_size = min_size
+        self.max_linger = max_linger
+        # values of the batch's once-per-batch dynamic fields
+        self.dynamic_values = {}
+
+    def fits(self, payload):
+        '''returns true if payload can be added without exceeding max_bytes.
+        An empty batch accepts any payload.'''
+        return not self.items or self.nbytes + len(payload) <= self.max_bytes
+
+    def add(self, ev, payload):
+        self.items.append((ev, payload))
+        # account for the separator between encoded events
+        self.nbytes += len(payload) + 1
+
+    def is_full(self):
+        return len(self.items) >= self.max_size or self.nbytes >= self.max_bytes
+
+    def deadline(self):
+        '''returns the monotonic time at which this batch must be sent'''
+        if len(self.items) >= self.min_size:
+            return self.opened_at + self.frequency
+        # small batches linger in the hope of filling up, but never for
+        # less than send_frequency
+        return self.opened_at + max(self.frequency, self.max_linger)
+
+
+def _event_time(ev, native=False):
+    '''returns the time of an event as an RFC3339 string, or if `native`, as
+    a datetime with a timezone'''
+    ns = getattr(ev, "_timestamp_ns", None)
+    # events that haven't had created_at set keep a timestamp in ns
+    if ns.__class__ is int:
+        if native:
+            return clock.to_datetime(ns, timezone.utc)
+        return clock.rfc3339(ns)
+    created_at = ev.created_at
+    # naive times are in UTC
+    if native:
+        if created_at.tzinfo is None:
+            return created_at.replace(tzinfo=timezone.utc)
+        return created_at
+    if created_at.tzinfo is None:
+        return created_at.isoformat() + "Z"
+    return created_at.isoformat()
+
+
+def _event_data(ev, batch_values=None):
+    '''returns the fields of an event, including those of its dynamic fields
+    that are evaluated once per batch. Their values are looked up in, or
+    else added to, `batch_values`. Without it they are evaluated afresh.'''
+    data = ev.fields()
+    batch_fields = getattr(ev, "_batch_fields", None)
+    if batch_fields.__class__ is not list:
+        return data
+    if batch_values is None:
+        batch_values = {}
+    data = dict(data)
+    for fn in batch_fields:
+        if fn not in batch_values:
+            batch_values[fn] = fn()
+        data[fn.__name__] = batch_values[fn]
+    return data
+
+
+def _encode_payload(serializer, ev, batch_values=None):
+    '''returns an event encoded with serializer as it appears in a batch'''
+    return serializer.dumps({
+        "time": _event_time(ev, serializer.native_datetimes),
+        "samplerate": ev.sample_rate,
+        "data": _event_data(ev, batch_values)})
+
+
 def group_events_by_destination(events):
     ''' Events all get added to a single queue when you call send(), but you
     might be sending different events to different datasets. This function
@@ -539,5 +1096,6 @@ def _safe_submit(pool, *args, **kwargs):
     # silently discard the error
     try:
         pool.submit(*args, **kwargs)
+        return True
     except RuntimeError:
-        pass
+        return False
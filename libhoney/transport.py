@@ -0,0 +1,233 @@
+'''transport holds the HTTP clients Transmission can send batches with.
+
+Every transport has the same small interface:
+
+- `post(url, headers, body, timeout)` returns a response with `status_code`,
+  a case-insensitive `headers` mapping, `content` and `raise_for_status()`.
+- `prewarm(url)` opens a connection to url's host ahead of the first batch.
+- `close()` closes idle connections.
+
+Transports are safe to use from several threads at once. Each one only
+imports its HTTP library when it is created.'''
+import http.client
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+
+class HTTPError(Exception):
+    '''raised by `raise_for_status` for a 4xx or 5xx response'''
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Response():
+    __slots__ = ("status_code", "headers", "content", "url")
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise HTTPError(f"{self.status_code} {kind} Error for url: {self.url}",
+                            self.status_code)
+
+
+def _prewarm(transport, url):
+    # any response will do; what we're after is the pooled connection
+    try:
+        transport.request("HEAD", url, {}, None, 5.0)
+    except Exception:
+        pass
+
+
+class RequestsTransport():
+    '''RequestsTransport sends with a `requests.Session`. Its responses are
+    requests' own.'''
+    name = "requests"
+
+    def __init__(self, session):
+        self.session = session
+
+    def request(self, method, url, headers, body, timeout):
+        return self.session.request(method, url, headers=headers, data=body, timeout=timeout)
+
+    def post(self, url, headers, body, timeout):
+        return self.session.post(url, headers=headers, data=body, timeout=timeout)
+
+    def prewarm(self, url):
+        _prewarm(self, url)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport():
+    '''Urllib3Transport sends through a urllib3 `PoolManager`, without the
+    per-request work requests layers on top. Up to `pool_size` connections
+    are kept per host. `proxies` is a dict like requests takes; the https
+    proxy, or failing that the http one, is used for every request.'''
+    name = "urllib3"
+
+    def __init__(self, pool_size=10, user_agent=None, proxies=None):
+        import urllib3  # pylint: disable=import-outside-toplevel
+
+        self._user_agent = user_agent
+        # retries are handled by Transmission
+        options = {"maxsize": pool_size, "block": False, "retries": False}
+        proxy = proxies and (proxies.get("https") or proxies.get("http"))
+        if proxy:
+            self._manager = urllib3.ProxyManager(proxy, **options)
+        else:
+            self._manager = urllib3.PoolManager(**options)
+
+    def request(self, method, url, headers, body, timeout):
+        if self._user_agent:
+            # headers given with a request replace the pool's, so add ours here
+            headers = dict(headers, **{"User-Agent": self._user_agent})
+        r = self._manager.request(method, url, body=body, headers=headers,
+                                  timeout=timeout, retries=False)
+        return _Response(r.status, r.headers, r.data, url)
+
+    def post(self, url, headers, body, timeout):
+        return self.request("POST", url, headers, body, timeout)
+
+    def prewarm(self, url):
+        _prewarm(self, url)
+
+    def close(self):
+        self._manager.clear()
+
+
+class HTTPClientTransport():
+    '''HTTPClientTransport sends with the standard library's http.client and
+    needs no other packages. Up to `pool_size` idle keep-alive connections
+    are kept per host. It doesn't support proxies.'''
+    name = "http.client"
+
+    # errors meaning a kept-alive connection was closed by the server while
+    # it sat idle, so the request never reached it
+    _STALE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, pool_size=10, user_agent=None, proxies=None):
+        if proxies:
+            raise ValueError("the http.client transport doesn't support proxies")
+        self.pool_size = pool_size
+        self._user_agent = user_agent
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def request(self, method, url, headers, body, timeout):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers)
+        if self._user_agent:
+            headers.setdefault("User-Agent", self._user_agent)
+
+        conn = self._get(key)
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect(key, timeout)
+        try:
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                r = conn.getresponse()
+            except self._STALE:
+                if not reused:
+                    raise
+                conn.close()
+                conn = self._connect(key, timeout)
+                conn.request(method, path, body=body, headers=headers)
+                r = conn.getresponse()
+            content = r.read()
+        except Exception:
+            conn.close()
+            raise
+        if r.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return _Response(r.status, r.headers, content, url)
+
+    def post(self, url, headers, body, timeout):
+        return self.request("POST", url, headers, body, timeout)
+
+    def prewarm(self, url):
+        _prewarm(self, url)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout,
+                                               context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _get(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            return conns.pop() if conns else None
+
+    def _put(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.pool_size:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+class HTTPXTransport():
+    '''HTTPXTransport sends with httpx. With `http2` (the default, which
+    needs the h2 package) batches to a host are multiplexed as concurrent
+    streams over a single connection instead of one connection each. It
+    doesn't support the proxies setting; httpx reads the usual proxy
+    environment variables instead.'''
+    name = "httpx"
+
+    def __init__(self, pool_size=10, user_agent=None, proxies=None, http2=True):
+        import httpx  # pylint: disable=import-outside-toplevel,import-error
+
+        if proxies:
+            raise ValueError("the httpx transport doesn't support proxies")
+        headers = {"User-Agent": user_agent} if user_agent else None
+        self._client = httpx.Client(
+            http2=http2, headers=headers,
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size))
+
+    def request(self, method, url, headers, body, timeout):
+        r = self._client.request(method, url, headers=headers, content=body, timeout=timeout)
+        return _Response(r.status_code, r.headers, r.content, url)
+
+    def post(self, url, headers, body, timeout):
+        return self.request("POST", url, headers, body, timeout)
+
+    def prewarm(self, url):
+        _prewarm(self, url)
+
+    def close(self):
+        self._client.close()
+
+
+TRANSPORTS = {
+    Urllib3Transport.name: Urllib3Transport,
+    HTTPClientTransport.name: HTTPClientTransport,
+    HTTPXTransport.name: HTTPXTransport,
+}